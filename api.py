@@ -0,0 +1,153 @@
+"""Headless HTTP API for story generation.
+
+Stories are generated by the same background job workers as the Streamlit app
+(see jobs.py) and cached in the shared story cache, so a story requested here
+is served instantly to the app and vice versa. Requires `pip install fastapi uvicorn`.
+
+    python api.py --port 8000
+
+    POST /stories              queue a story (returns it at once if cached)
+    GET  /jobs/{job_id}        job status and progress
+    GET  /jobs/{job_id}/story  the finished story, in the app's download format
+    GET  /stories/{story_key}  a cached story
+    GET  /metrics              Prometheus metrics
+"""
+import os
+import time
+import asyncio
+import argparse
+from typing import Any, Dict, Optional
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field
+from jobs import JobManager, JobQueueFull, FINISHED_STATUSES
+from story_cache import story_download_name
+from story_generator import GENERATION_MODES
+from telemetry import get_telemetry
+
+load_dotenv()
+
+
+class StoryRequest(BaseModel):
+    curriculum: str = "General"
+    subject: str = Field(min_length=1)
+    topic: str = Field(min_length=1)
+    specific_area: str = ""
+    grade: str = "grade_6"
+    mode: str = "sequential"
+
+
+app = FastAPI(title="Scene-by-Scene Story Generator")
+_job_manager: Optional[JobManager] = None
+
+
+def get_job_manager() -> JobManager:
+    global _job_manager
+    if _job_manager is None:
+        _job_manager = JobManager()
+    return _job_manager
+
+
+def download_headers(request: Dict[str, Any]) -> Dict[str, str]:
+    filename = story_download_name(request["curriculum"], request["subject"], request["topic"], request.get("specific_area"), request["grade"])
+    return {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+
+def job_summary(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Job fields for API responses; the partial story is left out"""
+    summary = {key: job[key] for key in ("job_id", "story_key", "status", "progress", "error", "created_at", "started_at", "finished_at")}
+    if "queue_position" in job:
+        summary["queue_position"] = job["queue_position"]
+    return summary
+
+
+@app.get("/health")
+async def health() -> Dict[str, Any]:
+    return {"status": "ok", "jobs": await asyncio.to_thread(get_job_manager().stats)}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> str:
+    return get_telemetry().render_prometheus()
+
+
+@app.post("/stories")
+async def create_story(request: StoryRequest, wait: float = 0.0) -> JSONResponse:
+    """Queue a story request.
+
+    Returns 200 with the story if it is cached (or finishes within `wait` seconds),
+    otherwise 202 with the job to poll. Identical requests share one job.
+    """
+    if request.mode not in GENERATION_MODES:
+        raise HTTPException(status_code=422, detail=f"mode must be one of {GENERATION_MODES}")
+    manager = get_job_manager()
+    payload = request.model_dump()
+
+    story_key = await asyncio.to_thread(manager.story_key, payload)
+    story = await asyncio.to_thread(manager.story_cache.get, story_key)
+    if story is not None:
+        return JSONResponse({"status": "succeeded", "story_key": story_key, "story": story})
+
+    try:
+        job_id = await asyncio.to_thread(manager.submit, payload)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "60"})
+
+    deadline = time.monotonic() + max(0.0, wait)
+    while True:
+        job = await asyncio.to_thread(manager.get, job_id)
+        if job["status"] == "succeeded":
+            story = await asyncio.to_thread(manager.result, job_id)
+            return JSONResponse({**job_summary(job), "story": story})
+        if job["status"] == "failed" or time.monotonic() >= deadline:
+            break
+        await asyncio.sleep(0.5)
+    return JSONResponse(job_summary(job), status_code=202, headers={"Location": f"/jobs/{job_id}"})
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, include_partial: bool = False) -> Dict[str, Any]:
+    job = await asyncio.to_thread(get_job_manager().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    summary = job_summary(job)
+    if include_partial:
+        summary["partial"] = job["partial"]
+    return summary
+
+
+@app.get("/jobs/{job_id}/story")
+async def get_job_story(job_id: str) -> Response:
+    manager = get_job_manager()
+    job = await asyncio.to_thread(manager.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    if job["status"] not in FINISHED_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=job["error"] or "Story generation failed")
+    story = await asyncio.to_thread(manager.result, job_id)
+    return JSONResponse(story, headers=download_headers(job["request"]))
+
+
+@app.get("/stories/{story_key}")
+async def get_story(story_key: str) -> Dict[str, Any]:
+    story = await asyncio.to_thread(get_job_manager().story_cache.get, story_key)
+    if story is None:
+        raise HTTPException(status_code=404, detail="Story not cached")
+    return story
+
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the story generator over HTTP")
+    parser.add_argument("--host", default=os.getenv("API_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", 8000)))
+    args = parser.parse_args(argv)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
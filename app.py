@@ -2,20 +2,20 @@ import streamlit as st
 import time
 import os
 from dotenv import load_dotenv
-from story_generator import StoryGenerator
-from knowledge_base import KnowledgeBaseSeeder
-import requests
-from PIL import Image
-from io import BytesIO
+from story_cache import create_story_cache, story_download_name
+from jobs import JobManager, JobQueueFull
+from scene_parser import SceneStreamParser
+from image_store import ImageStore
+from runtime import get_runtime
+from telemetry import get_telemetry
 import base64
 import json
 
 # Load environment variables
 load_dotenv()
 
-# Initialize story generator and knowledge base seeder
-story_generator = StoryGenerator()
-knowledge_seeder = KnowledgeBaseSeeder()
+# Time this script run so reruns can be checked against the one-off model load
+run_started = time.perf_counter()
 
 # Set page config
 st.set_page_config(
@@ -24,6 +24,145 @@ st.set_page_config(
     layout="wide"
 )
 
+# Streamlit re-executes this script on every interaction, so shared objects are
+# built once per process and shared across reruns and sessions. Stories are
+# generated by the job manager's background workers, which build the generators
+# (and import openai, qdrant_client and the encoder) on the first story request,
+# so the form paints without waiting for them.
+@st.cache_resource
+def load_story_cache():
+    return create_story_cache()
+
+@st.cache_resource
+def load_job_manager():
+    return JobManager(story_cache=load_story_cache())
+
+@st.cache_resource
+def start_metrics_endpoint():
+    # Serves Prometheus metrics on METRICS_PORT when it is set
+    return get_telemetry().start_metrics_server()
+
+story_cache = load_story_cache()
+job_manager = load_job_manager()
+start_metrics_endpoint()
+runtime_setup_ms = (time.perf_counter() - run_started) * 1000
+
+# Rendering helpers - the page is laid out first and filled in as story events arrive
+def render_outline(area, outline):
+    with area:
+        with st.expander("Story Outline", expanded=False):
+            st.markdown(outline)
+
+def create_scene_slots(area, count):
+    slots = []
+    with area:
+        for i in range(count):
+            st.markdown(f"<div class='scene-title'>Scene {i+1}</div>", unsafe_allow_html=True)
+            slots.append({"narrative": st.empty(), "explanation": st.empty(), "image": st.empty()})
+            
+            # Add separator between scenes
+            if i < count - 1:
+                st.markdown("<hr style='margin: 2rem 0;'>", unsafe_allow_html=True)
+    return slots
+
+def preview_narrative(streamed_text):
+    # Show only the narrative section of a scene that is still streaming
+    parser = SceneStreamParser()
+    parser.feed(streamed_text)
+    return parser.value("narrative")
+
+def render_scene_text(slots, scene):
+    # Display narrative
+    slots["narrative"].markdown(f"<div class='narrative'>{scene['narrative']}</div>", unsafe_allow_html=True)
+    
+    # Display explanation
+    slots["explanation"].markdown(f"<div class='explanation'>{scene['explanation']}</div>", unsafe_allow_html=True)
+
+def follow_job(job_id, outline_area, scenes_area, poll_interval=1.0):
+    # Poll a background job and fill the page in as its outline, scenes and images arrive
+    status = st.empty()
+    scene_slots = []
+    streamed = {}
+    rendered = {}
+    
+    while True:
+        job = job_manager.get(job_id)
+        if job is None:
+            status.error("This story job no longer exists. Please generate the story again.")
+            return None
+        
+        partial = job["partial"] or {}
+        progress = job["progress"]
+        if partial.get("outline") and not scene_slots:
+            render_outline(outline_area, partial["outline"])
+            scene_slots = create_scene_slots(scenes_area, len(partial["scenes"]))
+        
+        for i, slots in enumerate(scene_slots):
+            scene = partial["scenes"][i]
+            if scene is None:
+                # Still being written - show the narrative streamed so far
+                streamed_text = partial.get("streaming", {}).get(str(i))
+                if streamed_text and streamed.get(i) != streamed_text:
+                    slots["narrative"].markdown(f"<div class='narrative'>{preview_narrative(streamed_text)}</div>", unsafe_allow_html=True)
+                    streamed[i] = streamed_text
+                continue
+            if i not in rendered:
+                render_scene_text(slots, scene)
+                slots["image"].caption("Drawing the illustration...")
+                rendered[i] = "text"
+            if rendered[i] == "text" and "image_path" in scene:
+                render_scene_image(slots, scene)
+                rendered[i] = "image"
+        
+        if job["status"] == "succeeded":
+            status.empty()
+            return job_manager.result(job_id)
+        if job["status"] == "failed":
+            status.error(f"Story generation failed: {job['error']}")
+            return None
+        
+        if job["status"] == "queued":
+            status.info(f"Waiting for a free worker - position {job.get('queue_position', 1)} in the queue...")
+        elif progress.get("stage") == "seeding":
+            status.info("Seeding knowledge base with relevant information...")
+        elif progress.get("stage") == "outline":
+            status.info("Writing the story outline...")
+        elif progress.get("stage") == "scenes":
+            status.info(f"Writing scenes ({progress['scenes_done']}/{progress['scene_count']} done, estimated cost \\${progress.get('estimated_cost_usd', 0):.2f})...")
+        else:
+            status.info(f"Drawing illustrations ({progress.get('images_done', 0)}/{progress.get('scene_count')} done)...")
+        time.sleep(poll_interval)
+
+def render_story_header(request):
+    # Display story title with specific area if provided
+    title_text = f"{request['subject']}: {request['topic']}"
+    if request.get("specific_area"):
+        title_text += f" - {request['specific_area']}"
+    
+    st.markdown(f"<div class='story-title'>{title_text}</div>", unsafe_allow_html=True)
+    st.markdown(f"<p style='text-align: center; color: #e6e6e6;'>Tailored for {request['grade_display']} students following {request['curriculum']} curriculum</p>", unsafe_allow_html=True)
+
+def render_download_link(story, request):
+    story_json = json.dumps(story, indent=2)
+    b64 = base64.b64encode(story_json.encode()).decode()
+    
+    # Create a more descriptive filename with the new fields
+    filename = story_download_name(request["curriculum"], request["subject"], request["topic"], request.get("specific_area"), request["grade"])
+    
+    href = f'<a href="data:file/json;base64,{b64}" download="{filename}">Download Story as JSON</a>'
+    st.markdown(href, unsafe_allow_html=True)
+
+def render_scene_image(slots, scene):
+    # Prefer the locally stored copy - the DALL-E URL expires
+    image = scene.get("image_path") if ImageStore.exists(scene.get("image_path")) else scene.get("image_url")
+    
+    # Display image if available
+    if image:
+        # Replace deprecated use_column_width with use_container_width
+        slots["image"].image(image, use_container_width=True)
+    else:
+        slots["image"].empty()
+
 # Custom CSS
 st.markdown("""
     <style>
@@ -85,10 +224,6 @@ st.markdown("""
 st.markdown("<h1 style='text-align: center; color: #3498db;'>📚 Scene-by-Scene Story Generator</h1>", unsafe_allow_html=True)
 st.markdown("<p style='text-align: center; font-size: 1.2rem; color: #ffffff;'>Generate engaging, educational stories with visuals</p>", unsafe_allow_html=True)
 
-# Cache for stories
-if 'stories' not in st.session_state:
-    st.session_state.stories = {}
-
 # Input form
 with st.form("story_form"):
     # Add curriculum selection
@@ -172,11 +307,22 @@ with st.form("story_form"):
     # Convert display value to internal value
     grade = grade_options[selected_grade_display]
     
+    # Fast mode writes every scene at once from the outline instead of one after another
+    mode_options = {
+        "Standard (scenes build on each other)": "sequential",
+        "Fast (all scenes written at once)": "fast"
+    }
+    mode = mode_options[st.radio("Generation speed", list(mode_options), index=0, horizontal=True)]
+    
     st.markdown("<p style='font-size: 0.9rem; color: #e6e6e6;'>Generation may take a few minutes depending on the complexity of the subject and the number of scenes.</p>", unsafe_allow_html=True)
     
     submit_button = st.form_submit_button("Generate Story")
 
 # Handle form submission
+request = None
+story = None
+job_id = None
+
 if submit_button and subject and topic:
     # We need to determine which grade was selected based on the active tab
     active_tab_index = 0
@@ -198,72 +344,88 @@ if submit_button and subject and topic:
     # Convert to internal grade value
     grade = grade_options[selected_grade_display]
     
-    # Create a unique key for caching the story
-    # Include the new fields in the key to ensure uniqueness
-    story_key = f"{curriculum}_{subject}_{topic}_{specific_area}_{grade}" if specific_area else f"{curriculum}_{subject}_{topic}_{grade}"
-    
-    if story_key not in st.session_state.stories:
-        with st.spinner("Seeding knowledge base with relevant information..."):
-            # Include specific area if provided
-            full_topic = f"{topic} - {specific_area}" if specific_area else topic
-            knowledge_seeder.seed_knowledge_base(subject, full_topic, grade, curriculum)
-        
-        with st.spinner(f"Generating story about {subject} focused on {full_topic} for {selected_grade_display} following {curriculum} curriculum..."):
-            # Generate the story
-            story = story_generator.generate_complete_story(subject, full_topic, grade, curriculum)
-            st.session_state.stories[story_key] = story
-    
-    # Display the story
-    story = st.session_state.stories[story_key]
-    
-    # Display story title with specific area if provided
-    title_text = f"{subject}: {topic}"
-    if specific_area:
-        title_text += f" - {specific_area}"
+    request = {
+        "curriculum": curriculum,
+        "subject": subject,
+        "topic": topic,
+        "specific_area": specific_area,
+        "grade": grade,
+        "grade_display": selected_grade_display,
+        "mode": mode,
+    }
     
-    st.markdown(f"<div class='story-title'>{title_text}</div>", unsafe_allow_html=True)
-    st.markdown(f"<p style='text-align: center; color: #e6e6e6;'>Tailored for {selected_grade_display} students following {curriculum} curriculum</p>", unsafe_allow_html=True)
+    # Stories are cached across users by the normalized request, model and prompt version
+    story = story_cache.get(job_manager.story_key(request))
+    if story is not None:
+        st.experimental_set_query_params()
+    else:
+        try:
+            # Identical requests from other sessions attach to the same job
+            job_id = job_manager.submit(request)
+            st.experimental_set_query_params(job=job_id)
+        except JobQueueFull as e:
+            st.error(str(e))
+            request = None
+
+elif submit_button:
+    st.error("Please enter both a subject and a topic to generate a story.")
+
+elif st.experimental_get_query_params().get("job"):
+    # A refreshed page reattaches to its running (or finished) job
+    job_id = st.experimental_get_query_params()["job"][0]
+    job = job_manager.get(job_id)
+    if job is None:
+        st.experimental_set_query_params()
+        job_id = None
+    else:
+        request = job["request"]
+
+if request is not None:
+    render_story_header(request)
     
-    # Display outline
-    with st.expander("Story Outline", expanded=False):
-        st.markdown(story["outline"])
+    # Reserve the outline and scene areas so content can fill in as it arrives
+    outline_area = st.container()
+    scenes_area = st.container()
     
-    # Display each scene
-    for i, scene in enumerate(story["scenes"]):
-        st.markdown(f"<div class='scene-title'>Scene {i+1}</div>", unsafe_allow_html=True)
-        
-        # Display narrative
-        st.markdown(f"<div class='narrative'>{scene['narrative']}</div>", unsafe_allow_html=True)
-        
-        # Display explanation
-        st.markdown(f"<div class='explanation'>{scene['explanation']}</div>", unsafe_allow_html=True)
-        
-        # Display image if available
-        if scene.get("image_url"):
-            st.markdown("<div class='img-container'>", unsafe_allow_html=True)
-            # Replace deprecated use_column_width with use_container_width
-            st.image(scene["image_url"], use_container_width=True)
-            st.markdown("</div>", unsafe_allow_html=True)
-        
-        # Add separator between scenes
-        if i < len(story["scenes"]) - 1:
-            st.markdown("<hr style='margin: 2rem 0;'>", unsafe_allow_html=True)
+    if job_id is not None:
+        story = follow_job(job_id, outline_area, scenes_area)
+    else:
+        render_outline(outline_area, story["outline"])
+        scene_slots = create_scene_slots(scenes_area, len(story["scenes"]))
+        for slots, scene in zip(scene_slots, story["scenes"]):
+            render_scene_text(slots, scene)
+            render_scene_image(slots, scene)
     
     # Add download button
-    story_json = json.dumps(story, indent=2)
-    b64 = base64.b64encode(story_json.encode()).decode()
-    
-    # Create a more descriptive filename with the new fields
-    filename = f"{curriculum}_{subject}_{topic}"
-    if specific_area:
-        filename += f"_{specific_area}"
-    filename += f"_{grade}_story.json"
-    
-    href = f'<a href="data:file/json;base64,{b64}" download="{filename}">Download Story as JSON</a>'
-    st.markdown(href, unsafe_allow_html=True)
+    if story is not None:
+        render_download_link(story, request)
 
-elif submit_button:
-    st.error("Please enter both a subject and a topic to generate a story.")
+# Runtime diagnostics
+with st.sidebar.expander("Runtime stats", expanded=False):
+    runtime_stats = get_runtime().get_stats()
+    st.write(f"Setup this run: {runtime_setup_ms:.1f} ms")
+    if runtime_stats["encoder_load_seconds"] is not None:
+        st.write(f"Encoder load: {runtime_stats['encoder_load_seconds']:.2f} s (+{runtime_stats['encoder_rss_delta_mb']:.0f} MB)")
+    if runtime_stats["qdrant_init_seconds"] is not None:
+        st.write(f"Qdrant init ({runtime_stats['qdrant_mode']}): {runtime_stats['qdrant_init_seconds'] * 1000:.1f} ms")
+    st.write(f"Process RSS: {runtime_stats['rss_mb']:.0f} MB")
+    if "embedding_cache" in runtime_stats:
+        embedding_stats = runtime_stats["embedding_cache"]
+        st.write(f"Embedding cache: {embedding_stats['hit_rate']:.0%} hit rate ({embedding_stats['hits']} hits / {embedding_stats['misses']} misses, {embedding_stats['stored']} stored)")
+    for span_name, span_stats in sorted(get_telemetry().summary().items()):
+        st.write(f"{span_name}: {span_stats['count']} x {span_stats['mean_seconds']:.2f} s avg")
+    for model, tokens in sorted(get_telemetry().token_totals().items()):
+        st.write(f"{model} prompt cache: {tokens['cached_ratio']:.0%} of {tokens['prompt']:.0f} prompt tokens cached")
+    if not runtime_stats["encoder_loaded"]:
+        st.write("Models not loaded yet - they load with the first story request")
+    job_stats = job_manager.stats()
+    st.write(f"Story jobs: {job_stats['running']} running, {job_stats['queue_depth']} queued ({job_stats['workers']} workers)")
+    if "image_prompt_cache" in runtime_stats["vector_stores"]:
+        # The image cache collection exists once the story generator has been built
+        image_cache_stats = job_manager.generator.image_cache.stats()
+        st.write(f"Image reuse: {image_cache_stats['hits']} hits / {image_cache_stats['misses']} misses (threshold {image_cache_stats['threshold']})")
+        if image_cache_stats["recent_score_p50"] is not None:
+            st.write(f"Recent best similarity: p50 {image_cache_stats['recent_score_p50']:.3f}, p90 {image_cache_stats['recent_score_p90']:.3f}")
 
 # Footer
 st.markdown("---")
@@ -0,0 +1,489 @@
+"""Offline benchmark for the story generation pipeline.
+
+Runs seeding, retrieval and full story generation against a local mock of the
+OpenAI API (see mock_openai.py) and writes the results as JSON so runs can be
+compared over time. The real encoder and Qdrant client are used.
+
+    python benchmark.py --scenes 5 --concurrency 1 4 8 --text-latency 0.5 --image-latency 2
+
+Encoder backends (see encoders.py) can be compared on their own; each one is
+loaded in a fresh subprocess so cold start and RSS are measured in isolation:
+
+    python benchmark.py --encoder-backends torch torch-int8 onnx onnx-int8
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import tempfile
+import platform
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any
+from mock_openai import MockOpenAIServer
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the story generator against a local mock OpenAI server")
+    parser.add_argument("--scenes", type=int, default=5, help="Scenes per mock outline")
+    parser.add_argument("--chunks", type=int, default=10, help="Knowledge chunks per mock seeding response")
+    parser.add_argument("--mode", choices=["sequential", "fast"], nargs="+", default=["sequential", "fast"], help="Generation modes to time")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4], help="Concurrent story requests for the throughput test")
+    parser.add_argument("--text-latency", type=float, default=0.5, help="Mock chat completion latency in seconds")
+    parser.add_argument("--image-latency", type=float, default=2.0, help="Mock image generation latency in seconds")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Delay between streamed tokens in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock requests that fail with 429/500")
+    parser.add_argument("--mock-chat-rpm", type=int, default=None, help="Mock server chat requests per window before it returns 429")
+    parser.add_argument("--mock-image-rpm", type=int, default=None, help="Mock server image requests per window before it returns 429")
+    parser.add_argument("--mock-rate-window", type=float, default=60.0, help="Length of the mock rate-limit window in seconds")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of mock scene responses cut off part-way, to exercise scene repair")
+    parser.add_argument("--mock-prompt-cache-min-tokens", type=int, default=1024, help="Shortest prompt the mock reports cached tokens for (OpenAI uses 1024)")
+    parser.add_argument("--rate-limits", default="", help="Client-side OPENAI_RATE_LIMITS for the scheduler, e.g. gpt-4o=60:100000,dall-e-3=10")
+    parser.add_argument("--search-queries", type=int, default=50, help="Queries for the VectorStore.search latency test")
+    parser.add_argument("--image-cache-threshold", type=float, default=1.1, help="Semantic image cache threshold (above 1 disables reuse)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for latency jitter and error injection")
+    parser.add_argument("--encoder-backends", nargs="+", default=None, help="Only compare these encoder backends (first one is the parity reference)")
+    parser.add_argument("--encoder-texts", type=int, default=256, help="Texts per encoder throughput batch")
+    parser.add_argument("--encoder-worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--output", default=None, help="Where to write the JSON results (default benchmark_results/<timestamp>.json)")
+    return parser.parse_args(argv)
+
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    """Count, mean and percentiles of a list of durations"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def percentile(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": percentile(0.5),
+        "p95": percentile(0.95),
+        "max": ordered[-1],
+    }
+
+
+def bench_encoder(encoder, texts: List[str], repeats: int = 3) -> Dict[str, Any]:
+    """Time batched and one-at-a-time encoding"""
+    batch_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        encoder.encode(texts)
+        batch_times.append(time.perf_counter() - start)
+
+    single_times = []
+    for text in texts:
+        start = time.perf_counter()
+        encoder.encode(text)
+        single_times.append(time.perf_counter() - start)
+
+    best_batch = min(batch_times)
+    return {
+        "texts": len(texts),
+        "batch_seconds": summarize(batch_times),
+        "single_seconds": summarize(single_times),
+        "batch_texts_per_second": len(texts) / best_batch if best_batch else None,
+    }
+
+
+def encoder_benchmark_texts(count: int) -> List[str]:
+    """Knowledge-chunk sized texts for encoder throughput runs"""
+    return [
+        f"Fact {i}: this paragraph explains one specific aspect of topic {i % 17}, "
+        f"with an example a grade {i % 12 + 1} student would recognise."
+        for i in range(count)
+    ]
+
+
+def run_encoder_worker(backend: str, text_count: int) -> Dict[str, Any]:
+    """Load one encoder backend in this (fresh) process and measure it"""
+    from runtime import _current_rss_mb
+    from encoders import create_encoder, PARITY_SAMPLE_TEXTS
+
+    rss_before = _current_rss_mb()
+    start = time.perf_counter()
+    encoder = create_encoder(backend)
+    load_seconds = time.perf_counter() - start
+    first_start = time.perf_counter()
+    encoder.encode(PARITY_SAMPLE_TEXTS[0])
+    first_encode_seconds = time.perf_counter() - first_start
+
+    result = {
+        "backend": backend,
+        "import_and_load_seconds": load_seconds,
+        "first_encode_seconds": first_encode_seconds,
+        "rss_delta_mb": _current_rss_mb() - rss_before,
+        "torch_imported": "torch" in sys.modules,
+        "throughput": bench_encoder(encoder, encoder_benchmark_texts(text_count)),
+        "parity_embeddings": encoder.encode(PARITY_SAMPLE_TEXTS).tolist(),
+    }
+    result["rss_after_encode_mb"] = _current_rss_mb()
+    return result
+
+
+def bench_encoder_backends(backends: List[str], text_count: int) -> Dict[str, Any]:
+    """Measure each backend in its own subprocess and check parity against the first one"""
+    import numpy as np
+    from encoders import check_parity
+
+    class Precomputed:
+        def __init__(self, embeddings):
+            self.embeddings = np.array(embeddings, dtype=np.float32)
+
+        def encode(self, texts, **kwargs):
+            return self.embeddings
+
+    results = {}
+    reference = None
+    for backend in backends:
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--encoder-worker", backend, "--encoder-texts", str(text_count)],
+            capture_output=True, text=True,
+        )
+        if completed.returncode != 0:
+            results[backend] = {"error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f"exit {completed.returncode}"}
+            print(f"Encoder backend {backend} failed: {results[backend]['error']}")
+            continue
+
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        embeddings = np.array(result.pop("parity_embeddings"), dtype=np.float32)
+        if reference is None:
+            reference = (backend, embeddings)
+        result["parity"] = check_parity(Precomputed(embeddings), reference[1])
+        result["parity"]["reference"] = reference[0]
+        results[backend] = result
+        print(f"Encoder {backend}: load {result['import_and_load_seconds']:.2f}s, "
+              f"{result['throughput']['batch_texts_per_second']:.0f} texts/s, "
+              f"+{result['rss_delta_mb']:.0f} MB RSS, min cosine {result['parity']['min_cosine']:.4f}")
+    return results
+
+
+def bench_seeding(seeder, subject: str, topic: str) -> Dict[str, Any]:
+    """Time a cold seed (completion + encoding), a seed of a topic already stored (count check only)
+    and a seed into an empty collection from the knowledge cache (upsert of cached chunks and vectors)"""
+    from knowledge_base import KnowledgeBaseSeeder
+    from vector_store import VectorStore
+
+    start = time.perf_counter()
+    seeder.seed_knowledge_base(subject, topic)
+    cold = time.perf_counter() - start
+
+    start = time.perf_counter()
+    seeder.seed_knowledge_base(subject, topic)
+    stored = time.perf_counter() - start
+
+    store = seeder.vector_store
+    collection = f"{store.collection_name}_cache_bench"
+    cache_seeder = KnowledgeBaseSeeder(VectorStore(collection, encoder=store.encoder, client=store.client), cache=seeder.cache)
+    try:
+        start = time.perf_counter()
+        cache_seeder.seed_knowledge_base(subject, topic)
+        cached = time.perf_counter() - start
+    finally:
+        store.client.delete_collection(collection)
+    return {"cold_seconds": cold, "already_stored_seconds": stored, "knowledge_cache_seconds": cached}
+
+
+def bench_search(vector_store, subject: str, topic: str, count: int) -> Dict[str, Any]:
+    """Time VectorStore.search with and without the partition filter, and search_batch"""
+    partition = {"curriculum": "General", "subject": subject, "topic": topic, "grade": "grade_6"}
+    queries = [f"{subject} {topic} scene {i} about idea number {i}" for i in range(count)]
+
+    results = {}
+    for label, filters in (("unfiltered", None), ("filtered", partition)):
+        times = []
+        for query in queries:
+            start = time.perf_counter()
+            vector_store.search(query, limit=3, filters=filters)
+            times.append(time.perf_counter() - start)
+        results[label] = summarize(times)
+
+    # One batched call for all queries, as generate_complete_story does per outline
+    start = time.perf_counter()
+    vector_store.search_batch(queries, limit=3, filters=partition)
+    results["batched_total_seconds"] = time.perf_counter() - start
+    results["per_query_total_seconds"] = results["filtered"]["mean"] * len(queries)
+    return results
+
+
+def bench_retrieval(generator, subject: str, topic: str, count: int) -> Dict[str, Any]:
+    """Compare the background packed by the retrieval stage with the plain top-3 search it replaced"""
+    from outline_analyzer import estimate_tokens
+    from retrieval import partition_filter
+
+    partition = partition_filter(subject, topic, "grade_6", "General")
+    queries = [generator.retrieval_query(subject, topic, f"Scene {i+1}: idea number {i}") for i in range(count)]
+
+    start = time.perf_counter()
+    plain = generator.vector_store.search_batch(queries, limit=3, filters=partition)
+    plain_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    packed = generator.retriever.retrieve_batch(queries, filters=partition)
+    packed_seconds = time.perf_counter() - start
+
+    def context_stats(results, seconds):
+        return {
+            "total_seconds": seconds,
+            "mean_chunks": sum(len(chunks) for chunks in results) / len(results),
+            "mean_context_tokens": sum(estimate_tokens("\n".join(c["text"] for c in chunks)) for chunks in results) / len(results),
+        }
+
+    return {"top3": context_stats(plain, plain_seconds), "retriever": context_stats(packed, packed_seconds)}
+
+
+def bench_prompt_cache(token_totals: Dict[str, Dict[str, float]]) -> Dict[str, Any]:
+    """Static system prompt sizes against the provider's caching minimum, and the cached share of prompt tokens measured in this run"""
+    from outline_analyzer import estimate_tokens
+    from prompt_templates import (STATIC_PREFIX_TOKENS_MIN, STORY_GRADE_GUIDELINES, knowledge_system_prompt,
+                                  outline_system_prompt, scene_system_prompt)
+
+    prompts = {
+        "outline": lambda grade: outline_system_prompt(grade, "General", 3, 8),
+        "scene": lambda grade: scene_system_prompt(grade, "General"),
+        "knowledge": lambda grade: knowledge_system_prompt(grade, "General"),
+    }
+    results: Dict[str, Any] = {"min_cacheable_tokens": STATIC_PREFIX_TOKENS_MIN, "static_prefix_tokens": {}}
+    for name, prompt in prompts.items():
+        shortest = min(estimate_tokens(prompt(grade)) for grade in STORY_GRADE_GUIDELINES)
+        results["static_prefix_tokens"][name] = {"shortest": shortest, "cacheable": shortest >= STATIC_PREFIX_TOKENS_MIN}
+        print(f"Static {name} prompt: {shortest} tokens (cacheable: {shortest >= STATIC_PREFIX_TOKENS_MIN})")
+    results["cached_ratio"] = {model: totals["cached_ratio"] for model, totals in token_totals.items()}
+    for model, totals in token_totals.items():
+        print(f"Prompt cache {model}: {totals['cached']:.0f} of {totals['prompt']:.0f} prompt tokens cached ({totals['cached_ratio']:.1%})")
+    return results
+
+
+# Labelled corpus for comparing search modes: each query's answer is the one chunk
+# that uses its exact terms, alongside generic chunks about the same subject
+SEARCH_MODE_CORPUS = {
+    "Mathematics": [
+        ("Pythagorean theorem proof", "A classic proof of the Pythagorean theorem rearranges four right triangles inside a square so the areas a squared plus b squared equal c squared."),
+        ("prime factorization", "Prime factorization writes a whole number as a product of prime numbers, such as 60 = 2 x 2 x 3 x 5, using a factor tree."),
+        ("quadratic formula discriminant", "The discriminant b squared minus 4ac inside the quadratic formula tells whether a quadratic equation has two, one or no real roots."),
+    ],
+    "Physics": [
+        ("nuclear fission", "In nuclear fission a heavy uranium-235 nucleus absorbs a neutron and splits into lighter nuclei, releasing energy and more neutrons in a chain reaction."),
+        ("Doppler effect", "The Doppler effect is the change in pitch you hear as an ambulance siren approaches and then moves away, because the sound waves are compressed and stretched."),
+        ("Ohm's law resistance", "Ohm's law says voltage equals current times resistance, so doubling the resistance in a circuit halves the current at the same voltage."),
+    ],
+    "Biology": [
+        ("photosynthesis chlorophyll", "Chlorophyll in the chloroplasts absorbs red and blue light, and photosynthesis uses that energy to turn carbon dioxide and water into glucose and oxygen."),
+        ("mitosis stages", "The stages of mitosis are prophase, metaphase, anaphase and telophase, during which the copied chromosomes are pulled apart into two nuclei."),
+        ("mitochondria ATP", "Mitochondria release energy from glucose during cellular respiration and store it as ATP, the molecule cells spend to do work."),
+    ],
+}
+SEARCH_MODE_FILLER = [
+    "{subject} helps students understand the world around them through careful observation and reasoning.",
+    "Scientists and mathematicians in {subject} build on the discoveries of people who came before them.",
+    "Learning {subject} step by step makes difficult ideas easier to remember and apply in everyday life.",
+    "Teachers often use diagrams, experiments and stories to make {subject} lessons more engaging for students.",
+    "Many important ideas in {subject} were discovered by asking simple questions and testing the answers.",
+]
+
+
+def bench_search_modes(encoder, client, count: int, limit: int = 3) -> Dict[str, Any]:
+    """Recall@limit and latency of dense, lexical, hybrid and auto search on a labelled corpus"""
+    from vector_store import VectorStore, SEARCH_MODES
+
+    store = VectorStore("benchmark_search_modes", encoder=encoder, client=client)
+    texts, metadata, queries = [], [], []
+    for subject, facts in SEARCH_MODE_CORPUS.items():
+        for query, text in facts:
+            texts.append(text)
+            metadata.append({"subject": subject})
+            queries.append((query, text))
+        for filler in SEARCH_MODE_FILLER:
+            texts.append(filler.format(subject=subject))
+            metadata.append({"subject": subject})
+    store.add_texts(texts, metadata)
+    # Same-subject queries with the topic words only, as a short query from the app would be
+    queries += [(f"{query} explained for students", text) for query, text in queries]
+
+    results = {}
+    for mode in SEARCH_MODES:
+        times = []
+        hits = 0
+        for _ in range(max(1, count // len(queries))):
+            hits = 0
+            for query, expected in queries:
+                start = time.perf_counter()
+                found = store.search(query, limit=limit, mode=mode)
+                times.append(time.perf_counter() - start)
+                hits += any(result["text"] == expected for result in found)
+        results[mode] = {f"recall_at_{limit}": hits / len(queries), "latency_seconds": summarize(times)}
+        print(f"Search mode {mode}: recall@{limit} {results[mode][f'recall_at_{limit}']:.2f}, "
+              f"p50 {results[mode]['latency_seconds']['p50'] * 1000:.2f}ms")
+    return results
+
+
+def bench_story(generator, subject: str, topic: str, mode: str) -> Dict[str, Any]:
+    """Generate one story and record when each stage finished"""
+    start = time.perf_counter()
+    marks = {"first_content": None, "outline": None, "scenes": [], "images": [], "total": None}
+    for event in generator.iter_story_events(subject, topic, mode=mode):
+        elapsed = time.perf_counter() - start
+        if event["type"] in ("scene_delta", "scene") and marks["first_content"] is None:
+            marks["first_content"] = elapsed
+        if event["type"] == "outline":
+            marks["outline"] = elapsed
+        elif event["type"] == "scene":
+            marks["scenes"].append(elapsed)
+        elif event["type"] == "image":
+            marks["images"].append(elapsed)
+    marks["total"] = time.perf_counter() - start
+    marks["scene_count"] = len(marks["scenes"])
+    marks["last_scene_text"] = max(marks["scenes"]) if marks["scenes"] else None
+    return marks
+
+
+def bench_throughput(generator, seeder, mode: str, concurrency: int) -> Dict[str, Any]:
+    """Run `concurrency` distinct story requests at once and measure stories per minute"""
+    def run(i: int) -> Dict[str, Any]:
+        topic = f"Throughput Topic {mode} {concurrency} {i}"
+        start = time.perf_counter()
+        try:
+            seeder.seed_knowledge_base("Science", topic)
+            generator.generate_complete_story("Science", topic, mode=mode)
+            return {"ok": True, "seconds": time.perf_counter() - start}
+        except Exception as e:
+            return {"ok": False, "seconds": time.perf_counter() - start, "error": repr(e)}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(run, range(concurrency)))
+    wall = time.perf_counter() - start
+    succeeded = [o for o in outcomes if o["ok"]]
+    return {
+        "concurrency": concurrency,
+        "wall_seconds": wall,
+        "stories_per_minute": len(succeeded) / wall * 60 if wall else None,
+        "latency_seconds": summarize([o["seconds"] for o in succeeded]),
+        "failures": [o["error"] for o in outcomes if not o["ok"]],
+    }
+
+
+def write_results(results: Dict[str, Any], output: str = None, prefix: str = "benchmark") -> str:
+    output = output or os.path.join("benchmark_results", f"{prefix}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote benchmark results to {output}")
+    return output
+
+
+def main(argv=None) -> Dict[str, Any]:
+    args = parse_args(argv)
+
+    if args.encoder_worker:
+        # Child process of bench_encoder_backends: report on stdout only
+        print(json.dumps(run_encoder_worker(args.encoder_worker, args.encoder_texts)))
+        return {}
+
+    if args.encoder_backends:
+        results = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "config": vars(args),
+            "environment": {"python": sys.version.split()[0], "platform": platform.platform()},
+            "encoder_backends": bench_encoder_backends(args.encoder_backends, args.encoder_texts),
+        }
+        write_results(results, args.output, prefix="encoders")
+        return results
+
+    scratch = tempfile.mkdtemp(prefix="story-benchmark-")
+
+    server = MockOpenAIServer(
+        text_latency=args.text_latency,
+        image_latency=args.image_latency,
+        error_rate=args.error_rate,
+        scene_count=args.scenes,
+        num_chunks=args.chunks,
+        stream_token_delay=args.token_delay,
+        prompt_cache_min_tokens=args.mock_prompt_cache_min_tokens,
+        malformed_rate=args.malformed_rate,
+        seed=args.seed,
+        chat_rpm=args.mock_chat_rpm,
+        image_rpm=args.mock_image_rpm,
+        rate_window=args.mock_rate_window,
+    ).start()
+
+    # Point the OpenAI client and every on-disk cache at throwaway locations
+    # before the pipeline modules are imported and read their configuration
+    os.environ.update({
+        "OPENAI_BASE_URL": f"{server.url}/v1",
+        "OPENAI_API_KEY": "mock-key",
+        "KNOWLEDGE_CACHE_PATH": os.path.join(scratch, "knowledge_cache.sqlite3"),
+        "IMAGE_STORE_PATH": os.path.join(scratch, "images"),
+        "STORY_CACHE_PATH": os.path.join(scratch, "stories.sqlite3"),
+        "EMBEDDING_CACHE_PATH": os.path.join(scratch, "embeddings"),
+        "IMAGE_CACHE_THRESHOLD": str(args.image_cache_threshold),
+        "OPENAI_RATE_LIMITS": args.rate_limits,
+    })
+    # The mock's one-sentence scenes cannot be split up to the minimum, so fewer scenes lower it
+    from outline_analyzer import DEFAULT_MIN_SCENES
+    if args.scenes < int(os.getenv("STORY_MIN_SCENES", DEFAULT_MIN_SCENES)):
+        os.environ["STORY_MIN_SCENES"] = str(args.scenes)
+    # A fresh in-memory Qdrant, not a configured server, on-disk store or prebuilt corpus
+    for name in ("QDRANT_URL", "QDRANT_PATH", "QDRANT_PRELOAD_DIR"):
+        os.environ.pop(name, None)
+
+    from runtime import get_runtime
+    from telemetry import get_telemetry
+    from story_generator import StoryGenerator
+    from knowledge_base import KnowledgeBaseSeeder
+    from scheduler import get_scheduler
+
+    try:
+        runtime = get_runtime()
+        encoder = runtime.get_encoder()
+        generator = StoryGenerator()
+        seeder = KnowledgeBaseSeeder()
+
+        subject, topic = "Biology", "Photosynthesis"
+        results = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "config": vars(args),
+            "environment": {"python": sys.version.split()[0], "platform": platform.platform()},
+        }
+        results["seeding"] = bench_seeding(seeder, subject, topic)
+        encoder_texts = [f"Fact {i} about {topic}: this paragraph explains one specific aspect of {topic}." for i in range(args.chunks)]
+        # Raw model throughput, then the same texts served from the embedding cache
+        results["encoder"] = bench_encoder(getattr(encoder, "base_encoder", encoder), encoder_texts)
+        if hasattr(encoder, "base_encoder"):
+            encoder.encode(encoder_texts)
+            results["encoder_cached"] = bench_encoder(encoder, encoder_texts)
+        results["search"] = bench_search(seeder.vector_store, subject, topic, args.search_queries)
+        results["retrieval"] = bench_retrieval(generator, subject, topic, args.search_queries)
+        results["search_modes"] = bench_search_modes(encoder, runtime.get_qdrant_client(), args.search_queries)
+        results["story"] = {mode: bench_story(generator, subject, topic, mode) for mode in args.mode}
+        results["throughput"] = {
+            mode: [bench_throughput(generator, seeder, mode, n) for n in args.concurrency]
+            for mode in args.mode
+        }
+        results["runtime"] = runtime.get_stats()
+        results["image_cache"] = generator.image_cache.stats()
+        results["scheduler"] = get_scheduler().stats()
+        results["spans"] = get_telemetry().summary()
+        results["tokens"] = get_telemetry().token_totals()
+        results["prompt_cache"] = bench_prompt_cache(results["tokens"])
+        results["scene_repair"] = {
+            "parse_failures": get_telemetry().counter_values("scene_parse_failures_total"),
+            "repairs": get_telemetry().counter_values("scene_repairs_total"),
+            "wasted_completions": sum(get_telemetry().counter_values("scene_completions_wasted_total").values()),
+        }
+        results["mock_server"] = server.stats()
+    finally:
+        server.stop()
+
+    write_results(results, args.output)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""Batch story generation from the command line.
+
+Reads a JSONL file with one request per line (curriculum, subject, topic,
+specific_area, grade and optionally mode) and writes each story to the output
+directory in the same JSON format as the app's download link. Finished stories
+also go into the shared story cache, so a batch run warms it for the app.
+
+Completed story keys are appended to <output-dir>/completed.jsonl, and a rerun
+skips them, so an interrupted batch resumes where it stopped:
+
+    python cli.py requests.jsonl --output-dir stories --parallelism 4
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Tuple
+from dotenv import load_dotenv
+from story_cache import create_story_cache, make_story_key, story_download_name
+
+load_dotenv()
+
+MANIFEST_NAME = "completed.jsonl"
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate stories in bulk from a JSONL file of requests")
+    parser.add_argument("requests", help="JSONL file, one {curriculum, subject, topic, specific_area, grade[, mode]} object per line")
+    parser.add_argument("--output-dir", default="stories", help="Where to write the story JSON files")
+    parser.add_argument("--parallelism", type=int, default=2, help="Stories generated at once")
+    parser.add_argument("--mode", choices=["sequential", "fast"], default="sequential", help="Generation mode for requests that do not set one")
+    parser.add_argument("--limit", type=int, default=None, help="Only process the first N pending requests")
+    return parser.parse_args(argv)
+
+
+def load_requests(path: str, default_mode: str) -> List[Dict[str, Any]]:
+    """Read and validate the request file"""
+    requests = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                raw = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON ({e})") from e
+            missing = [field for field in ("subject", "topic") if not raw.get(field)]
+            if missing:
+                raise ValueError(f"{path}:{line_number}: missing {', '.join(missing)}")
+            requests.append({
+                "curriculum": raw.get("curriculum") or "General",
+                "subject": raw["subject"],
+                "topic": raw["topic"],
+                "specific_area": raw.get("specific_area") or "",
+                "grade": raw.get("grade") or "grade_6",
+                "mode": raw.get("mode") or default_mode,
+            })
+    return requests
+
+
+def load_completed(output_dir: str) -> Dict[str, str]:
+    """Map of story key to output file for stories finished by earlier runs"""
+    completed = {}
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return completed
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interrupted run
+                continue
+            if os.path.exists(os.path.join(output_dir, entry["file"])):
+                completed[entry["key"]] = entry["file"]
+    return completed
+
+
+def write_story(output_dir: str, filename: str, story: Dict[str, Any]):
+    """Write the story atomically in the download-link format"""
+    path = os.path.join(output_dir, filename)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(story, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class BatchRunner:
+    """Generates pending requests in parallel, recording each finished story in the manifest"""
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.story_cache = create_story_cache()
+        self._manifest_lock = threading.Lock()
+        self._generator = None
+        self._seeder = None
+        self._factory_lock = threading.Lock()
+
+    def _pipeline(self):
+        # Built on first use so a fully resumed batch never loads the models
+        with self._factory_lock:
+            if self._generator is None:
+                from story_generator import StoryGenerator
+                from knowledge_base import KnowledgeBaseSeeder
+                self._seeder = KnowledgeBaseSeeder()
+                self._generator = StoryGenerator()
+            return self._seeder, self._generator
+
+    def generate(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        seeder, generator = self._pipeline()
+        full_topic = f"{request['topic']} - {request['specific_area']}" if request["specific_area"] else request["topic"]
+        seeder.seed_knowledge_base(request["subject"], full_topic, request["grade"], request["curriculum"])
+        return generator.generate_complete_story(request["subject"], full_topic, request["grade"], request["curriculum"], request["mode"])
+
+    def run_one(self, key: str, filename: str, request: Dict[str, Any]) -> Tuple[float, bool]:
+        """Generate (or fetch from the cache) one story and write it out; returns (seconds, from_cache)"""
+        start = time.perf_counter()
+        story = self.story_cache.get(key)
+        from_cache = story is not None
+        if story is None:
+            story = self.story_cache.get_or_create(key, lambda: self.generate(request))
+        write_story(self.output_dir, filename, story)
+        with self._manifest_lock:
+            with open(os.path.join(self.output_dir, MANIFEST_NAME), "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "file": filename, "request": request}) + "\n")
+        return time.perf_counter() - start, from_cache
+
+
+def plan(requests: List[Dict[str, Any]], completed: Dict[str, str]) -> Tuple[List[Tuple[str, str, Dict[str, Any]]], int]:
+    """Return (pending (key, filename, request) tuples, number skipped as already completed)"""
+    from story_generator import GENERATION_MODES, LLM_MODEL, STORY_PROMPT_VERSION
+
+    pending = []
+    skipped = 0
+    seen = set()
+    used_names = set(completed.values())
+    for request in requests:
+        if request["mode"] not in GENERATION_MODES:
+            raise ValueError(f"Unknown mode {request['mode']!r}, expected one of {GENERATION_MODES}")
+        key = make_story_key(request["curriculum"], request["subject"], request["topic"], request["specific_area"],
+                             request["grade"], request["mode"], LLM_MODEL, STORY_PROMPT_VERSION)
+        if key in completed or key in seen:
+            skipped += 1
+            continue
+        seen.add(key)
+        filename = story_download_name(request["curriculum"], request["subject"], request["topic"], request["specific_area"], request["grade"])
+        if filename in used_names:
+            # Same story fields in another mode - keep both files
+            filename = filename.replace("_story.json", f"_{request['mode']}_{key[:8]}_story.json")
+        used_names.add(filename)
+        pending.append((key, filename, request))
+    return pending, skipped
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    requests = load_requests(args.requests, args.mode)
+    pending, skipped = plan(requests, load_completed(args.output_dir))
+    if args.limit is not None:
+        pending = pending[:args.limit]
+    print(f"{len(requests)} requests: {skipped} already completed, {len(pending)} to generate with parallelism {args.parallelism}")
+
+    runner = BatchRunner(args.output_dir)
+    failures = 0
+    done = 0
+    started = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=args.parallelism)
+    try:
+        futures = {executor.submit(runner.run_one, key, filename, request): filename for key, filename, request in pending}
+        for future in as_completed(futures):
+            done += 1
+            try:
+                seconds, from_cache = future.result()
+                source = "cached" if from_cache else "generated"
+                print(f"[{done}/{len(pending)}] {futures[future]} ({source} in {seconds:.1f}s)")
+            except Exception as e:
+                failures += 1
+                print(f"[{done}/{len(pending)}] {futures[future]} failed: {e}")
+    except KeyboardInterrupt:
+        print("Interrupted - finished stories are recorded, rerun the same command to resume")
+        executor.shutdown(wait=False, cancel_futures=True)
+        return 130
+    executor.shutdown()
+
+    print(f"Finished {done - failures} stories in {time.perf_counter() - started:.1f}s, {failures} failed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+import os
+import re
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+import numpy as np
+from dotenv import load_dotenv
+from telemetry import get_telemetry
+
+# Persistent embedding cache shared by every worker process on the host.
+# Each encoder model gets a directory holding two append-only files:
+#   vectors.f32 - float32 rows of the model's dimension, read through np.memmap
+#   index.bin   - fixed-size records of (16-byte text digest, uint64 row)
+# Writers append under an exclusive flock; readers pick up rows other processes
+# appended by reading the new tail of the index.
+
+load_dotenv()
+
+DEFAULT_EMBEDDING_CACHE_PATH = os.path.join(".cache", "embeddings")
+# 200k MiniLM rows is roughly 300 MB of vectors
+DEFAULT_MAX_ROWS = 200_000
+
+INDEX_RECORD = np.dtype([("digest", "u1", (16,)), ("row", "<u8")])
+
+
+def text_digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()[:16]
+
+
+class EmbeddingCache:
+    """Append-only, memory-mapped store of embeddings keyed by text hash for one model"""
+
+    def __init__(self, model_name: str, dimension: int, root: Optional[str] = None, max_rows: Optional[int] = None):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.row_bytes = dimension * 4
+        self.max_rows = max_rows if max_rows is not None else int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", DEFAULT_MAX_ROWS))
+
+        root = root or os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_EMBEDDING_CACHE_PATH)
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        self.directory = os.path.join(root, f"{slug}-{dimension}")
+        os.makedirs(self.directory, exist_ok=True)
+        self.vectors_path = os.path.join(self.directory, "vectors.f32")
+        self.index_path = os.path.join(self.directory, "index.bin")
+        self.lock_path = os.path.join(self.directory, "lock")
+        for path in (self.vectors_path, self.index_path):
+            open(path, "ab").close()
+
+        self._lock = threading.Lock()
+        self._rows: Dict[bytes, int] = {}
+        self._index_offset = 0
+        self._vectors: Optional[np.memmap] = None
+        with self._lock:
+            self._refresh_index()
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        """Exclusive lock across processes for appending"""
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh_index(self):
+        """Read index records appended (by any process) since the last refresh"""
+        size = os.path.getsize(self.index_path)
+        complete = size - size % INDEX_RECORD.itemsize
+        if complete <= self._index_offset:
+            return
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_offset)
+            records = np.frombuffer(f.read(complete - self._index_offset), dtype=INDEX_RECORD)
+        for digest, row in zip(records["digest"], records["row"].tolist()):
+            self._rows[digest.tobytes()] = row
+        self._index_offset = complete
+
+    def _vector_map(self, needed_rows: int) -> np.memmap:
+        """Return a read-only map of the vectors file that covers at least needed_rows rows"""
+        if self._vectors is None or len(self._vectors) < needed_rows:
+            rows = os.path.getsize(self.vectors_path) // self.row_bytes
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dimension)) if rows else None
+        return self._vectors
+
+    def get_many(self, texts: Sequence[str]) -> Tuple[np.ndarray, List[int]]:
+        """Return (vectors, indexes of texts that missed); rows for missed texts are left as zeros"""
+        digests = [text_digest(text) for text in texts]
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        with self._lock:
+            if any(digest not in self._rows for digest in digests):
+                self._refresh_index()
+            found = [(i, self._rows[d]) for i, d in enumerate(digests) if d in self._rows]
+            if found:
+                positions, rows = zip(*found)
+                vectors[list(positions)] = self._vector_map(max(rows) + 1)[list(rows)]
+        found_positions = {i for i, _ in found}
+        return vectors, [i for i in range(len(texts)) if i not in found_positions]
+
+    def put_many(self, texts: Sequence[str], vectors: np.ndarray) -> int:
+        """Append embeddings for texts not already stored; returns how many were written"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dimension)
+        with self._lock, self._file_lock():
+            self._refresh_index()
+            new = {}
+            for text, vector in zip(texts, vectors):
+                digest = text_digest(text)
+                if digest not in self._rows and digest not in new:
+                    new[digest] = vector
+            if not new:
+                return 0
+
+            with open(self.vectors_path, "r+b") as vectors_file, open(self.index_path, "r+b") as index_file:
+                # Drop any partial row or record left by a writer that crashed mid-append
+                first_row = os.path.getsize(self.vectors_path) // self.row_bytes
+                if first_row + len(new) > self.max_rows:
+                    return 0
+                vectors_file.truncate(first_row * self.row_bytes)
+                index_file.truncate(self._index_offset)
+
+                # Vectors first, so an index record never points at a row that is not on disk
+                vectors_file.seek(first_row * self.row_bytes)
+                vectors_file.write(np.stack(list(new.values())).tobytes())
+                vectors_file.flush()
+                os.fsync(vectors_file.fileno())
+
+                records = np.empty(len(new), dtype=INDEX_RECORD)
+                records["digest"] = np.frombuffer(b"".join(new), dtype=np.uint8).reshape(-1, 16)
+                records["row"] = np.arange(first_row, first_row + len(new))
+                index_file.seek(self._index_offset)
+                index_file.write(records.tobytes())
+                index_file.flush()
+
+            self._refresh_index()
+            return len(new)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh_index()
+            return len(self._rows)
+
+
+class CachedEncoder:
+    """Wraps an encoder so texts already embedded (by any process) are read from the cache instead of re-encoded"""
+
+    def __init__(self, base_encoder: Any, model_name: str, root: Optional[str] = None):
+        self.base_encoder = base_encoder
+        self.cache = EmbeddingCache(model_name, base_encoder.get_sentence_embedding_dimension(), root=root)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, sentences: Union[str, List[str]], **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        vectors, missing = self.cache.get_many(texts)
+        if missing:
+            # Encode each distinct missing text once
+            unique = list(dict.fromkeys(texts[i] for i in missing))
+            encoded = np.asarray(self.base_encoder.encode(unique, **kwargs), dtype=np.float32)
+            by_text = dict(zip(unique, encoded))
+            for i in missing:
+                vectors[i] = by_text[texts[i]]
+            self.cache.put_many(unique, encoded)
+
+        hits = len(texts) - len(missing)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(missing)
+        telemetry = get_telemetry()
+        telemetry.record_cache("embedding", True, count=hits)
+        telemetry.record_cache("embedding", False, count=len(missing))
+        return vectors[0] if single else vectors
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.base_encoder.get_sentence_embedding_dimension()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counts for this process and the number of stored embeddings"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+        stats["stored"] = len(self.cache)
+        stats["path"] = self.cache.directory
+        return stats
@@ -0,0 +1,159 @@
+import os
+from typing import Any, Dict, List, Optional, Protocol, Sequence, Union
+import numpy as np
+from dotenv import load_dotenv
+
+# Pluggable sentence encoder backends. Every backend produces the same
+# normalized all-MiniLM-L6-v2 embeddings, so they are interchangeable in the
+# vector store; ENCODER_BACKEND selects one:
+#   torch       - SentenceTransformer in full precision (reference)
+#   torch-int8  - SentenceTransformer with dynamically int8-quantized linear layers
+#   onnx        - ONNX Runtime on CPU, no torch import
+#   onnx-int8   - ONNX Runtime with the int8-quantized export of the model
+
+load_dotenv()
+
+DEFAULT_MODEL_NAME = "all-MiniLM-L6-v2"
+ENCODER_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+# Quantized ONNX exports published alongside the model on the Hugging Face Hub
+DEFAULT_ONNX_FILES = {
+    "onnx": "onnx/model.onnx",
+    "onnx-int8": "onnx/model_quint8_avx2.onnx",
+}
+
+PARITY_SAMPLE_TEXTS = [
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "The Pythagorean theorem relates the sides of a right triangle.",
+    "Nuclear fission splits a heavy nucleus into smaller nuclei and releases energy.",
+    "The French Revolution began in 1789 and reshaped European politics.",
+    "Mitochondria are the powerhouse of the cell.",
+    "A labeled diagram of the water cycle showing evaporation and condensation.",
+]
+
+
+class Encoder(Protocol):
+    """Interface the vector store expects from an encoder"""
+
+    def encode(self, sentences: Union[str, List[str]], **kwargs) -> np.ndarray: ...
+
+    def get_sentence_embedding_dimension(self) -> int: ...
+
+
+class TorchEncoder:
+    """SentenceTransformer on PyTorch, optionally with int8 dynamic quantization"""
+
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME, quantize: bool = False):
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device="cpu" if quantize else None)
+        if quantize:
+            import torch
+
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def encode(self, sentences: Union[str, List[str]], **kwargs) -> np.ndarray:
+        return self.model.encode(sentences, **kwargs)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+
+class OnnxEncoder:
+    """all-MiniLM-L6-v2 on ONNX Runtime with mean pooling and L2 normalization, matching SentenceTransformer"""
+
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME, onnx_file: Optional[str] = None, model_path: Optional[str] = None, max_length: int = 256, batch_size: int = 32):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("The onnx encoder backends require the 'onnxruntime' and 'tokenizers' packages (pip install onnxruntime tokenizers)") from e
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        repo_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+        if model_path is None:
+            from huggingface_hub import hf_hub_download
+
+            model_path = hf_hub_download(repo_id, onnx_file or DEFAULT_ONNX_FILES["onnx"])
+            tokenizer_path = hf_hub_download(repo_id, "tokenizer.json")
+        else:
+            tokenizer_path = os.path.join(os.path.dirname(model_path), "tokenizer.json")
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.dimension = self.session.get_outputs()[0].shape[-1]
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            inputs["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        token_embeddings = self.session.run(None, inputs)[0]
+
+        # Mean pooling over real tokens, then L2 normalization (the model's Normalize layer)
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def encode(self, sentences: Union[str, List[str]], **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        embeddings = np.vstack([
+            self._encode_batch(texts[i:i + self.batch_size])
+            for i in range(0, len(texts), self.batch_size)
+        ]).astype(np.float32)
+        return embeddings[0] if single else embeddings
+
+    def get_sentence_embedding_dimension(self) -> int:
+        if isinstance(self.dimension, int):
+            return self.dimension
+        return int(self._encode_batch(["dimension probe"]).shape[-1])
+
+
+def create_encoder(backend: Optional[str] = None, model_name: str = DEFAULT_MODEL_NAME) -> Encoder:
+    """Build the encoder backend named by ENCODER_BACKEND (default torch)"""
+    backend = (backend or os.getenv("ENCODER_BACKEND", "torch")).lower()
+    if backend == "torch":
+        return TorchEncoder(model_name)
+    if backend == "torch-int8":
+        return TorchEncoder(model_name, quantize=True)
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEncoder(
+            model_name,
+            onnx_file=os.getenv("ENCODER_ONNX_FILE", DEFAULT_ONNX_FILES[backend]),
+            model_path=os.getenv("ENCODER_ONNX_PATH") or None,
+        )
+    raise ValueError(f"Unknown ENCODER_BACKEND {backend!r}, expected one of {ENCODER_BACKENDS}")
+
+
+def check_parity(candidate: Encoder, reference: Union[Encoder, np.ndarray], texts: Sequence[str] = PARITY_SAMPLE_TEXTS, min_cosine: float = 0.99) -> Dict[str, Any]:
+    """Compare a backend's embeddings with reference embeddings (or a reference encoder) by cosine similarity"""
+    texts = list(texts)
+    expected = reference if isinstance(reference, np.ndarray) else reference.encode(texts)
+    actual = candidate.encode(texts)
+
+    expected = expected / np.linalg.norm(expected, axis=1, keepdims=True)
+    actual = actual / np.linalg.norm(actual, axis=1, keepdims=True)
+    cosines = (expected * actual).sum(axis=1)
+    return {
+        "texts": len(texts),
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "threshold": min_cosine,
+        "passed": bool(cosines.min() >= min_cosine),
+    }
@@ -0,0 +1,74 @@
+import os
+import threading
+from collections import deque
+from typing import Dict, Any, Optional
+from dotenv import load_dotenv
+from vector_store import VectorStore
+from runtime import get_runtime
+from image_store import ImageStore
+from telemetry import get_telemetry
+
+load_dotenv()
+
+IMAGE_CACHE_COLLECTION = "image_prompt_cache"
+DEFAULT_SIMILARITY_THRESHOLD = 0.92
+
+
+class SemanticImageCache:
+    """Reuses a stored image when a new image prompt is close enough to one already drawn.
+
+    Prompts are embedded with the shared encoder and kept in their own Qdrant
+    collection, filtered by the grade's image style so a Grade 1 illustration is
+    never reused for a college diagram.
+    """
+
+    def __init__(self, vector_store: Optional[VectorStore] = None, threshold: Optional[float] = None):
+        self.vector_store = vector_store if vector_store is not None else get_runtime().get_vector_store(IMAGE_CACHE_COLLECTION, index_fields=("image_style",))
+        self.threshold = threshold if threshold is not None else float(os.getenv("IMAGE_CACHE_THRESHOLD", DEFAULT_SIMILARITY_THRESHOLD))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Best similarity seen on recent lookups, to help pick a threshold
+        self.recent_scores = deque(maxlen=200)
+
+    def lookup(self, prompt: str, image_style: str) -> Optional[Dict[str, Any]]:
+        """Return {"image_url", "image_path", "score"} for a similar stored image, or None"""
+        results = self.vector_store.search(prompt, limit=1, filters={"image_style": image_style})
+        best = results[0] if results else None
+
+        with self._lock:
+            self.recent_scores.append(best["score"] if best else 0.0)
+            # Only reuse images we still hold locally - the original DALL-E URL has probably expired
+            hit = bool(best) and best["score"] >= self.threshold and ImageStore.exists(best.get("image_path"))
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        get_telemetry().record_cache("image", hit)
+        if hit:
+            return {"image_url": best.get("image_url"), "image_path": best["image_path"], "score": best["score"]}
+        return None
+
+    def add(self, prompt: str, image_style: str, image_url: Optional[str], image_path: Optional[str]):
+        """Remember the image drawn for a prompt"""
+        if not image_path:
+            return
+        self.vector_store.add_texts(
+            [prompt],
+            [{"image_style": image_style, "image_url": image_url, "image_path": image_path}]
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counts and the distribution of recent best scores"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            scores = sorted(self.recent_scores)
+        return {
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "recent_score_p50": scores[len(scores) // 2] if scores else None,
+            "recent_score_p90": scores[int(len(scores) * 0.9)] if scores else None,
+        }
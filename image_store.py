@@ -0,0 +1,86 @@
+import os
+import uuid
+import hashlib
+from io import BytesIO
+from typing import Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_IMAGE_STORE_PATH = os.path.join(".cache", "images")
+# Stories are displayed at column width, so 1024px DALL-E output is downscaled to this
+DEFAULT_DISPLAY_SIZE = 768
+
+
+class ImageStore:
+    """Downloads generated images once and keeps them as local, content-addressed files.
+
+    DALL-E URLs expire after a while, so stories reference the stored copy instead.
+    Images are optionally recompressed to WebP or JPEG at display size.
+    """
+
+    def __init__(self, root: Optional[str] = None, image_format: Optional[str] = None, display_size: Optional[int] = None, quality: int = 85):
+        self.root = root or os.getenv("IMAGE_STORE_PATH", DEFAULT_IMAGE_STORE_PATH)
+        # "webp", "jpeg" or "original" to keep the downloaded bytes untouched
+        self.image_format = (image_format or os.getenv("IMAGE_STORE_FORMAT", "webp")).lower()
+        self.display_size = display_size if display_size is not None else int(os.getenv("IMAGE_DISPLAY_SIZE", DEFAULT_DISPLAY_SIZE))
+        self.quality = quality
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path_for(self, digest: str, extension: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}.{extension}")
+
+    def _recompress(self, data: bytes) -> Tuple[bytes, str]:
+        """Return (bytes, extension) for the configured output format"""
+        # Pillow is only needed once an image is stored, so it is not imported at page load
+        from PIL import Image
+
+        if self.image_format == "original":
+            with Image.open(BytesIO(data)) as image:
+                return data, (image.format or "png").lower()
+
+        with Image.open(BytesIO(data)) as image:
+            image = image.convert("RGB")
+            if self.display_size:
+                image.thumbnail((self.display_size, self.display_size))
+            output = BytesIO()
+            if self.image_format == "jpeg":
+                image.save(output, format="JPEG", quality=self.quality, optimize=True)
+                return output.getvalue(), "jpg"
+            image.save(output, format="WEBP", quality=self.quality, method=4)
+            return output.getvalue(), "webp"
+
+    def save_bytes(self, data: bytes) -> str:
+        """Store image bytes and return the local path"""
+        # Address by the source bytes so the same image is only processed and stored once
+        digest = hashlib.sha256(data).hexdigest()
+        for extension in ("webp", "jpg", "png", "jpeg"):
+            existing = self._path_for(digest, extension)
+            if os.path.exists(existing):
+                return existing
+
+        stored, extension = self._recompress(data)
+        path = self._path_for(digest, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so concurrent readers never see a partial file
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(stored)
+        os.replace(tmp_path, path)
+        return path
+
+    def save_from_url(self, url: str) -> Optional[str]:
+        """Download an image and store it locally, returning the path or None on failure"""
+        import requests
+
+        try:
+            response = requests.get(url, timeout=60)
+            response.raise_for_status()
+            return self.save_bytes(response.content)
+        except Exception as e:
+            print(f"Error storing image: {e}")
+            return None
+
+    @staticmethod
+    def exists(path: Optional[str]) -> bool:
+        return bool(path) and os.path.exists(path)
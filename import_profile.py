@@ -0,0 +1,103 @@
+"""Import-time profile of the app's modules.
+
+Imports each module in a fresh interpreter with `python -X importtime` and
+reports the total import time, the slowest top-level packages and whether any
+of the heavy libraries (torch, sentence_transformers, qdrant_client, openai,
+PIL) were pulled in. Use it to track container cold start:
+
+    python import_profile.py app runtime story_generator --top 15
+    python import_profile.py app --budget-ms 1500 --json import_profile.json
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+from collections import defaultdict
+from typing import Any, Dict, List
+
+HEAVY_PACKAGES = ("torch", "sentence_transformers", "transformers", "onnxruntime", "qdrant_client", "openai", "PIL")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Profile how long the app's modules take to import")
+    parser.add_argument("modules", nargs="*", default=["app", "runtime", "story_generator", "knowledge_base"], help="Modules to import, each in a fresh interpreter")
+    parser.add_argument("--top", type=int, default=10, help="Slowest top-level packages to list per module")
+    parser.add_argument("--budget-ms", type=float, default=None, help="Exit non-zero if any module takes longer than this to import")
+    parser.add_argument("--json", default=None, help="Also write the report as JSON to this path")
+    return parser.parse_args(argv)
+
+
+def profile_import(module: str) -> Dict[str, Any]:
+    """Import one module under -X importtime and aggregate the timings by top-level package"""
+    env = dict(os.environ)
+    # Streamlit prints warnings when app.py runs outside `streamlit run`; they are not import time
+    env.setdefault("STREAMLIT_GLOBAL_SHOW_WARNING_ON_DIRECT_EXECUTION", "false")
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+
+    # Lines look like "import time:       self [us] |  cumulative | imported package"
+    packages = defaultdict(float)
+    imported = set()
+    total_us = None
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_text, cumulative_text, name = line[len("import time:"):].split("|")
+            self_us, cumulative_us = int(self_text), int(cumulative_text)
+        except ValueError:
+            continue
+        name = name.strip()
+        imported.add(name)
+        packages[name.split(".")[0]] += self_us
+        # The requested module is imported last and at the top level
+        if name == module:
+            total_us = cumulative_us
+
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return {
+        "module": module,
+        "ok": completed.returncode == 0,
+        "error": completed.stderr.strip().splitlines()[-1] if completed.returncode != 0 and completed.stderr.strip() else None,
+        "total_ms": total_us / 1000 if total_us is not None else None,
+        "modules_imported": len(imported),
+        "heavy_imported": [package for package in HEAVY_PACKAGES if package in packages],
+        "slowest_packages": [{"package": name, "self_ms": us / 1000} for name, us in slowest],
+    }
+
+
+def print_report(reports: List[Dict[str, Any]], top: int):
+    for report in reports:
+        if not report["ok"]:
+            print(f"{report['module']}: import failed - {report['error']}")
+            continue
+        total = f"{report['total_ms']:.0f} ms" if report["total_ms"] is not None else "unknown"
+        heavy = ", ".join(report["heavy_imported"]) or "none"
+        print(f"{report['module']}: {total} ({report['modules_imported']} modules, heavy: {heavy})")
+        for entry in report["slowest_packages"][:top]:
+            print(f"    {entry['self_ms']:9.1f} ms  {entry['package']}")
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    reports = [profile_import(module) for module in args.modules]
+    print_report(reports, args.top)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+        print(f"Wrote import profile to {args.json}")
+
+    if args.budget_ms is not None:
+        over = [r for r in reports if not r["ok"] or (r["total_ms"] or 0) > args.budget_ms]
+        if over:
+            print(f"Over the {args.budget_ms:.0f} ms import budget: {', '.join(r['module'] for r in over)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,363 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+from story_cache import StoryCache, create_story_cache, make_story_key, pid_alive
+from telemetry import get_telemetry
+
+# Background story jobs. A submitted request gets a job ID and runs on a bounded
+# pool of worker threads (seeding, then the story event stream), so a slow
+# story never blocks the Streamlit script run that submitted it. Job status,
+# progress and the partial story are kept in SQLite, so a refreshed page (or
+# another process on the host) can reattach to a running job by its ID.
+
+load_dotenv()
+
+DEFAULT_JOBS_PATH = os.path.join(".cache", "jobs.sqlite3")
+DEFAULT_JOB_WORKERS = 2
+DEFAULT_MAX_QUEUED = 50
+# Finished jobs are kept this long for reattaching, then deleted
+DEFAULT_JOB_RETENTION_SECONDS = 24 * 60 * 60
+
+ACTIVE_STATUSES = ("queued", "running")
+FINISHED_STATUSES = ("succeeded", "failed")
+
+# Minimum seconds between progress writes while scene text is streaming
+PROGRESS_WRITE_INTERVAL = 0.5
+
+# Identifies this process as a job owner alongside its PID, which a restarted
+# container can reuse (often PID 1). Shared by every JobManager in the process.
+PROCESS_TOKEN = uuid.uuid4().hex
+
+
+def owner_alive(owner_pid: Optional[int], owner_token: Optional[str]) -> bool:
+    """True if the process that owns a job is still running"""
+    if owner_pid == os.getpid():
+        return owner_token == PROCESS_TOKEN
+    return pid_alive(owner_pid)
+
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are already waiting for a worker"""
+
+
+class JobManager:
+    """Runs story requests on background workers and tracks them in SQLite"""
+
+    def __init__(self, story_cache: Optional[StoryCache] = None, generator_factory: Optional[Callable[[], Any]] = None,
+                 seeder_factory: Optional[Callable[[], Any]] = None, path: Optional[str] = None, workers: Optional[int] = None,
+                 max_queued: Optional[int] = None, retention_seconds: Optional[int] = None):
+        self.story_cache = story_cache if story_cache is not None else create_story_cache()
+        self._generator_factory = generator_factory
+        self._seeder_factory = seeder_factory
+        self.path = path or os.getenv("JOBS_PATH", DEFAULT_JOBS_PATH)
+        self.workers = workers if workers is not None else int(os.getenv("JOB_WORKERS", DEFAULT_JOB_WORKERS))
+        self.max_queued = max_queued if max_queued is not None else int(os.getenv("JOB_MAX_QUEUED", DEFAULT_MAX_QUEUED))
+        self.retention_seconds = retention_seconds if retention_seconds is not None else int(os.getenv("JOB_RETENTION_SECONDS", DEFAULT_JOB_RETENTION_SECONDS))
+
+        self._generator = None
+        self._seeder = None
+        self._factory_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="story-job")
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, story_key TEXT NOT NULL, request TEXT NOT NULL, "
+                "status TEXT NOT NULL, progress TEXT NOT NULL, partial TEXT, error TEXT, owner_pid INTEGER, "
+                "created_at REAL NOT NULL, started_at REAL, finished_at REAL, updated_at REAL NOT NULL)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)").fetchall()]
+            if "owner_token" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner_token TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_story_key ON jobs (story_key, status)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+        self._recover_orphaned_jobs()
+        self._update_gauges()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    @property
+    def generator(self):
+        """The shared StoryGenerator, built on first use"""
+        with self._factory_lock:
+            if self._generator is None:
+                if self._generator_factory is None:
+                    from story_generator import StoryGenerator
+                    self._generator_factory = StoryGenerator
+                self._generator = self._generator_factory()
+            return self._generator
+
+    @property
+    def seeder(self):
+        """The shared KnowledgeBaseSeeder, built on first use"""
+        with self._factory_lock:
+            if self._seeder is None:
+                if self._seeder_factory is None:
+                    from knowledge_base import KnowledgeBaseSeeder
+                    self._seeder_factory = KnowledgeBaseSeeder
+                self._seeder = self._seeder_factory()
+            return self._seeder
+
+    @staticmethod
+    def story_key(request: Dict[str, Any]) -> str:
+        from story_generator import LLM_MODEL, STORY_PROMPT_VERSION
+        return make_story_key(request["curriculum"], request["subject"], request["topic"], request.get("specific_area"),
+                              request["grade"], request["mode"], LLM_MODEL, STORY_PROMPT_VERSION)
+
+    def submit(self, request: Dict[str, Any]) -> str:
+        """Queue a story request and return its job ID.
+
+        request holds curriculum, subject, topic, specific_area, grade and mode. If the
+        same story is already queued or running, that job's ID is returned instead; if
+        the process that owned it has exited, this process takes the job over.
+        """
+        story_key = self.story_key(request)
+        now = time.time()
+        with self._connect() as conn:
+            # Take the write lock first so two processes cannot both queue the same story
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT job_id, owner_pid, owner_token FROM jobs WHERE story_key = ? AND status IN ('queued', 'running') ORDER BY created_at LIMIT 1",
+                (story_key,)
+            ).fetchone()
+            if row is not None and owner_alive(row[1], row[2]):
+                return row[0]
+
+            if row is not None:
+                # Orphaned by a crashed worker process - take it over here, as _recover_orphaned_jobs does
+                job_id = row[0]
+                self._claim(conn, job_id, row[1], row[2], now)
+            else:
+                queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+                if queued >= self.max_queued:
+                    get_telemetry().increment("story_jobs_rejected_total")
+                    raise JobQueueFull(f"{queued} stories are already waiting; please try again in a few minutes")
+
+                job_id = uuid.uuid4().hex
+                conn.execute(
+                    "INSERT INTO jobs (job_id, story_key, request, status, progress, partial, owner_pid, owner_token, created_at, updated_at) "
+                    "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?, ?)",
+                    (job_id, story_key, json.dumps(request), json.dumps({"stage": "queued"}), json.dumps(self._empty_partial(request)),
+                     os.getpid(), PROCESS_TOKEN, now, now)
+                )
+
+        if row is not None:
+            print(f"Resuming interrupted story job {job_id}")
+        else:
+            get_telemetry().increment("story_jobs_total", status="queued")
+        self._executor.submit(self._run, job_id)
+        self._update_gauges()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job's status, progress, partial story and error, or None if unknown"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT job_id, story_key, request, status, progress, partial, error, created_at, started_at, finished_at, "
+                "(SELECT COUNT(*) FROM jobs AS ahead WHERE ahead.status = 'queued' AND ahead.created_at < jobs.created_at) "
+                "FROM jobs WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = {
+            "job_id": row[0],
+            "story_key": row[1],
+            "request": json.loads(row[2]),
+            "status": row[3],
+            "progress": json.loads(row[4]),
+            "partial": json.loads(row[5]) if row[5] else None,
+            "error": row[6],
+            "created_at": row[7],
+            "started_at": row[8],
+            "finished_at": row[9],
+        }
+        if job["status"] == "queued":
+            job["queue_position"] = row[10] + 1
+        return job
+
+    def wait(self, job_id: str, timeout: Optional[float] = None, poll_interval: float = 0.5) -> Optional[Dict[str, Any]]:
+        """Block until a job finishes (or timeout) and return it"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] in FINISHED_STATUSES:
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            time.sleep(poll_interval)
+
+    def result(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the finished story for a succeeded job"""
+        job = self.get(job_id)
+        if job is None or job["status"] != "succeeded":
+            return None
+        return self.story_cache.get(job["story_key"]) or job["partial"]
+
+    @staticmethod
+    def _empty_partial(request: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "subject": request["subject"],
+            "topic": request["topic"],
+            "grade": request["grade"],
+            "curriculum": request["curriculum"],
+            "mode": request["mode"],
+            "outline": None,
+            "scenes": [],
+            "streaming": {},
+        }
+
+    def _update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        for key in ("progress", "partial"):
+            if key in fields:
+                fields[key] = json.dumps(fields[key])
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def _run(self, job_id: str):
+        """Worker: seed, stream the story into the job's partial result, then cache it"""
+        telemetry = get_telemetry()
+        job = self.get(job_id)
+        if job is None:
+            return
+        request = job["request"]
+        started = time.time()
+        # Only the process that queued or claimed the job runs it, and only once
+        with self._connect() as conn:
+            claimed = conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, progress = ?, updated_at = ? "
+                "WHERE job_id = ? AND status = 'queued' AND owner_pid = ? AND owner_token = ?",
+                (started, json.dumps({"stage": "seeding"}), started, job_id, os.getpid(), PROCESS_TOKEN)
+            ).rowcount
+        if not claimed:
+            return
+        telemetry.observe("story_job_wait_seconds", started - job["created_at"])
+        self._update_gauges()
+
+        try:
+            story = self.story_cache.get(job["story_key"])
+            if story is None:
+                with self.story_cache.single_flight(job["story_key"]):
+                    # Another worker may have finished this story while we waited
+                    story = self.story_cache.get(job["story_key"])
+                    if story is None:
+                        story = self._generate(job_id, request)
+                        self.story_cache.put(job["story_key"], story)
+            self._update(job_id, status="succeeded", finished_at=time.time(), progress={"stage": "done"}, partial=story)
+            telemetry.increment("story_jobs_total", status="succeeded")
+        except Exception as e:
+            print(f"Story job {job_id} failed: {e}")
+            self._update(job_id, status="failed", finished_at=time.time(), error=str(e) or repr(e))
+            telemetry.increment("story_jobs_total", status="failed")
+        finally:
+            telemetry.observe("story_job_run_seconds", time.time() - started)
+            self._update_gauges()
+
+    def _generate(self, job_id: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        full_topic = f"{request['topic']} - {request['specific_area']}" if request.get("specific_area") else request["topic"]
+        self.seeder.seed_knowledge_base(request["subject"], full_topic, request["grade"], request["curriculum"])
+
+        partial = self._empty_partial(request)
+        progress = {"stage": "outline", "scene_count": None, "scenes_done": 0, "images_done": 0}
+        self._update(job_id, progress=progress)
+        last_write = 0.0
+        story = None
+
+        for event in self.generator.iter_story_events(request["subject"], full_topic, request["grade"], request["curriculum"], request["mode"]):
+            if event["type"] == "outline":
+                partial["outline"] = event["outline"]
+                partial["scenes"] = [None] * event["scene_count"]
+                progress.update(stage="scenes", scene_count=event["scene_count"], estimated_cost_usd=event["estimate"]["cost_usd"],
+                                estimated_tokens=event["estimate"]["total_tokens"])
+            elif event["type"] == "scene_delta":
+                key = str(event["index"])
+                partial["streaming"][key] = partial["streaming"].get(key, "") + event["text"]
+                # Token deltas arrive many times a second; only persist them periodically
+                if time.monotonic() - last_write < PROGRESS_WRITE_INTERVAL:
+                    continue
+            elif event["type"] == "scene":
+                partial["streaming"].pop(str(event["index"]), None)
+                partial["scenes"][event["index"]] = dict(event["scene"])
+                progress["scenes_done"] += 1
+                if progress["scenes_done"] == len(partial["scenes"]):
+                    progress["stage"] = "images"
+            elif event["type"] == "image":
+                partial["scenes"][event["index"]].update(image_url=event["image_url"], image_path=event["image_path"])
+                progress["images_done"] += 1
+            elif event["type"] == "story":
+                story = event["story"]
+                continue
+            self._update(job_id, progress=progress, partial=partial)
+            last_write = time.monotonic()
+
+        return story
+
+    @staticmethod
+    def _claim(conn: sqlite3.Connection, job_id: str, owner_pid: Optional[int], owner_token: Optional[str], now: float) -> bool:
+        """Requeue an orphaned job under this process; False if another process claimed it first"""
+        return conn.execute(
+            "UPDATE jobs SET status = 'queued', owner_pid = ?, owner_token = ?, progress = ?, updated_at = ? "
+            "WHERE job_id = ? AND status IN ('queued', 'running') AND owner_pid IS ? AND owner_token IS ?",
+            (os.getpid(), PROCESS_TOKEN, json.dumps({"stage": "queued"}), now, job_id, owner_pid, owner_token)
+        ).rowcount == 1
+
+    def _recover_orphaned_jobs(self) -> List[str]:
+        """Requeue jobs whose worker process died (e.g. the app was restarted) and drop expired ones; returns the claimed job IDs"""
+        now = time.time()
+        with self._connect() as conn:
+            # Take the write lock before reading, so processes starting together cannot both claim a job
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?", (now - self.retention_seconds,))
+            rows = conn.execute("SELECT job_id, owner_pid, owner_token FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+            claimed = [
+                job_id for job_id, owner_pid, owner_token in rows
+                if not owner_alive(owner_pid, owner_token) and self._claim(conn, job_id, owner_pid, owner_token, now)
+            ]
+        for job_id in claimed:
+            print(f"Resuming interrupted story job {job_id}")
+            self._executor.submit(self._run, job_id)
+        return claimed
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs in each status"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in ACTIVE_STATUSES + FINISHED_STATUSES}
+        counts.update(dict(rows))
+        return counts
+
+    def _update_gauges(self):
+        counts = self.counts()
+        telemetry = get_telemetry()
+        telemetry.set_gauge("story_jobs_queued", counts["queued"])
+        telemetry.set_gauge("story_jobs_running", counts["running"])
+        telemetry.set_gauge("story_job_workers", self.workers)
+
+    def stats(self) -> Dict[str, Any]:
+        counts = self.counts()
+        return {"workers": self.workers, "max_queued": self.max_queued, "queue_depth": counts["queued"], **counts}
+
+    def list_jobs(self, statuses: Optional[List[str]] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent jobs, optionally filtered by status"""
+        query = "SELECT job_id FROM jobs"
+        params: List[Any] = []
+        if statuses:
+            query += f" WHERE status IN ({', '.join('?' for _ in statuses)})"
+            params.extend(statuses)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._connect() as conn:
+            job_ids = [row[0] for row in conn.execute(query, params).fetchall()]
+        return [job for job in (self.get(job_id) for job_id in job_ids) if job is not None]
@@ -1,192 +1,40 @@
 import os
-from typing import List, Dict, Any
+from typing import List, Optional
 from dotenv import load_dotenv
 import openai
 from vector_store import VectorStore
+from runtime import get_runtime
+from knowledge_cache import KnowledgeCache
+from telemetry import get_telemetry
+from scheduler import get_scheduler
+from prompt_templates import knowledge_messages
 
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+# Bump whenever the knowledge prompt changes so cached chunks from the old prompt are not reused
+KNOWLEDGE_PROMPT_VERSION = "2"
+
 class KnowledgeBaseSeeder:
-    def __init__(self):
-        self.vector_store = VectorStore()
+    def __init__(self, vector_store: Optional[VectorStore] = None, cache: Optional[KnowledgeCache] = None):
+        # Share one store with the seeder/generator so retrieval sees seeded knowledge
+        self.vector_store = vector_store if vector_store is not None else get_runtime().get_vector_store()
+        self.cache = cache if cache is not None else KnowledgeCache()
         self.llm_model = "gpt-4o"
-        
-        # Detailed grade level guidelines for knowledge complexity for each individual grade
-        self.grade_guidelines = {
-            # Pre-K and Kindergarten
-            "pre_k": {
-                "complexity": "extremely simple concepts directly related to immediate sensory experiences",
-                "vocabulary": "basic words (500-1000 word vocabulary) using concrete nouns and simple action verbs",
-                "chunk_length": "very short paragraphs (30-50 words)",
-                "examples": "examples using familiar objects, animals, and everyday experiences"
-            },
-            "kindergarten": {
-                "complexity": "simple, concrete concepts with clear cause-effect relationships",
-                "vocabulary": "basic vocabulary (2000-3000 words) with new words immediately explained",
-                "chunk_length": "short paragraphs (40-70 words)",
-                "examples": "examples from daily life and familiar experiences"
-            },
-            
-            # Elementary School (Grades 1-5)
-            "grade_1": {
-                "complexity": "basic concepts with simple explanations and immediate relevance",
-                "vocabulary": "common words (4000-5000 vocabulary) with new terms defined simply",
-                "chunk_length": "short paragraphs (50-80 words)",
-                "examples": "examples relating to children's immediate world and experiences"
-            },
-            "grade_2": {
-                "complexity": "straightforward concepts with clear connections to known ideas",
-                "vocabulary": "everyday vocabulary (5000-6000 words) with new terms defined in context",
-                "chunk_length": "short paragraphs (60-90 words)",
-                "examples": "concrete examples from experiences children might have had"
-            },
-            "grade_3": {
-                "complexity": "developing concepts with some connections between ideas",
-                "vocabulary": "expanding vocabulary (6000-9000 words) with subject-specific terms defined",
-                "chunk_length": "developing paragraphs (70-100 words)",
-                "examples": "familiar examples with some new contexts introduced"
-            },
-            "grade_4": {
-                "complexity": "interconnected concepts with some abstract relationships",
-                "vocabulary": "growing vocabulary (9000-11000 words) with academic terms introduced",
-                "chunk_length": "standard paragraphs (80-120 words)",
-                "examples": "examples that connect to broader experiences and some beyond direct experience"
-            },
-            "grade_5": {
-                "complexity": "moderately complex concepts with connections to broader principles",
-                "vocabulary": "richer vocabulary (11000-14000 words) with content-specific terminology",
-                "chunk_length": "developed paragraphs (100-150 words)",
-                "examples": "examples that include phenomena beyond immediate experience"
-            },
-            
-            # Middle School (Grades 6-8)
-            "grade_6": {
-                "complexity": "concepts with multiple factors and relationships between systems",
-                "vocabulary": "expanded vocabulary (14000-17000 words) with technical terms explained",
-                "chunk_length": "full paragraphs (120-170 words)",
-                "examples": "real-world examples that connect to broader systems and processes"
-            },
-            "grade_7": {
-                "complexity": "multi-faceted concepts with cause-effect relationships and system interactions",
-                "vocabulary": "advanced vocabulary (17000-19000 words) with discipline-specific terminology",
-                "chunk_length": "developed paragraphs (150-180 words)",
-                "examples": "examples showing relationships between different systems or concepts"
-            },
-            "grade_8": {
-                "complexity": "complex concepts with interconnections between systems and abstract principles",
-                "vocabulary": "sophisticated vocabulary (19000-21000 words) with specialized terminology",
-                "chunk_length": "substantial paragraphs (150-200 words)",
-                "examples": "examples demonstrating underlying principles and theoretical applications"
-            },
-            
-            # High School (Grades 9-12)
-            "grade_9": {
-                "complexity": "complex concepts with theoretical frameworks and system analysis",
-                "vocabulary": "academic vocabulary (21000-23000 words) with specialized terminology",
-                "chunk_length": "detailed paragraphs (170-220 words)",
-                "examples": "examples illustrating theoretical concepts and practical applications"
-            },
-            "grade_10": {
-                "complexity": "sophisticated concepts with analytical frameworks and critical perspectives",
-                "vocabulary": "advanced academic vocabulary (23000-25000 words) with field-specific terminology",
-                "chunk_length": "comprehensive paragraphs (180-230 words)",
-                "examples": "examples demonstrating analytical principles and theoretical models"
-            },
-            "grade_11": {
-                "complexity": "advanced concepts with theoretical foundations and critical analysis",
-                "vocabulary": "college-preparatory vocabulary (25000-27000 words) with specialized academic language",
-                "chunk_length": "detailed analytical paragraphs (200-250 words)",
-                "examples": "examples with theoretical applications and underlying principles"
-            },
-            "grade_12": {
-                "complexity": "college-level concepts with theoretical depth and critical evaluation",
-                "vocabulary": "college-level vocabulary (27000+ words) with discipline-specific terminology",
-                "chunk_length": "comprehensive academic paragraphs (200-250 words)",
-                "examples": "sophisticated examples showing theoretical frameworks and applications"
-            },
-            
-            # College and Adult
-            "college_freshman": {
-                "complexity": "advanced concepts with theoretical frameworks and methodological approaches",
-                "vocabulary": "college-level academic vocabulary with field-specific terminology",
-                "chunk_length": "substantive academic paragraphs (200-250 words)",
-                "examples": "examples demonstrating theoretical principles and methodological applications"
-            },
-            "college_sophomore": {
-                "complexity": "specialized concepts with theoretical depth and analytical frameworks",
-                "vocabulary": "advanced academic vocabulary with discipline-specific terminology",
-                "chunk_length": "detailed academic paragraphs (200-250 words)",
-                "examples": "examples illustrating theoretical models and analytical approaches"
-            },
-            "college_junior": {
-                "complexity": "specialized concepts with theoretical sophistication and analytical depth",
-                "vocabulary": "specialized academic vocabulary with field-specific theoretical terminology",
-                "chunk_length": "comprehensive academic paragraphs (200-300 words)",
-                "examples": "sophisticated examples demonstrating theoretical principles and applications"
-            },
-            "college_senior": {
-                "complexity": "advanced specialized concepts with theoretical integration and critical analysis",
-                "vocabulary": "sophisticated academic vocabulary with specialized terminology",
-                "chunk_length": "substantive academic paragraphs (200-300 words)",
-                "examples": "examples showing integration of theoretical frameworks and practical applications"
-            },
-            "graduate": {
-                "complexity": "highly specialized concepts with theoretical sophistication and original analysis",
-                "vocabulary": "advanced academic vocabulary with specialized theoretical terminology",
-                "chunk_length": "comprehensive academic paragraphs (250-300 words)",
-                "examples": "sophisticated examples demonstrating theoretical innovation and critical analysis"
-            },
-            "adult": {
-                "complexity": "sophisticated concepts with multiple perspectives and critical analysis",
-                "vocabulary": "advanced vocabulary with specialized terminology for educated adults",
-                "chunk_length": "substantial informative paragraphs (200-250 words)",
-                "examples": "examples illustrating complex relationships and practical applications"
-            },
-            
-            # Default fallback to middle school level
-            "default": {
-                "complexity": "foundational concepts with some detail and real-world connections",
-                "vocabulary": "moderate vocabulary with technical terms defined in context",
-                "chunk_length": "medium paragraphs (100-150 words)",
-                "examples": "examples relevant to students' experiences and broader world understanding"
-            }
-        }
     
     def get_knowledge_chunks(self, subject: str, topic: str, grade: str = "grade_6", curriculum: str = "General", num_chunks: int = 10) -> List[str]:
         """Generate knowledge chunks about the subject and topic appropriate for the grade level and curriculum"""
-        # Get grade-specific guidelines - use the specified grade level or empty dict if not found
-        guidelines = self.grade_guidelines.get(grade, {})
-        
-        # Use the grade values directly if they exist, otherwise use sensible defaults
-        complexity = guidelines.get("complexity", f"appropriate for {grade} level")
-        vocabulary = guidelines.get("vocabulary", f"suitable for {grade} level")
-        chunk_length = guidelines.get("chunk_length", "appropriate length paragraphs")
-        examples = guidelines.get("examples", f"examples suitable for {grade} level")
-        
-        prompt = f"""
-        Generate {num_chunks} detailed knowledge chunks about {subject} focusing on {topic}, tailored for {grade} level students following {curriculum} curriculum.
-        
-        Please follow these grade-appropriate guidelines:
-        - Complexity: {complexity}
-        - Vocabulary: {vocabulary}
-        - Length: {chunk_length}
-        - Examples: {examples}
+        # Grade guidelines and instructions live in a system prompt shared by every request for this grade and curriculum
+        messages = knowledge_messages(subject, topic, grade, curriculum, num_chunks)
         
-        Each chunk should explain a specific aspect of the topic in a way that's educational, factual, and engaging for {grade} level students.
-        Ensure the content aligns with {curriculum} curriculum standards where applicable.
-        
-        Format: Return each chunk as a separate paragraph with a clear focus.
-        """
-        
-        response = openai.chat.completions.create(
-            model=self.llm_model,
-            messages=[
-                {"role": "system", "content": f"You are a knowledgeable educator who can explain complex topics clearly to {grade} level students."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-        )
+        with get_telemetry().span("knowledge_chunks", grade=grade) as span:
+            response = get_scheduler().chat_completion(
+                "knowledge_chunks",
+                model=self.llm_model,
+                messages=messages,
+                temperature=0.3,
+            )
+            span.record_usage(response, self.llm_model)
         
         result = response.choices[0].message.content
         
@@ -208,26 +56,66 @@ class KnowledgeBaseSeeder:
         
         return chunks[:num_chunks]
     
-    def seed_knowledge_base(self, subject: str, topic: str, grade: str = "grade_6", curriculum: str = "General") -> None:
+    def prune_outdated_chunks(self) -> int:
+        """Delete chunks not tagged with the current KNOWLEDGE_PROMPT_VERSION, including untagged ones stored
+        before chunks were versioned; retrieval filters them out, so they only take up space"""
+        deleted = self.vector_store.delete_outdated("prompt_version", KNOWLEDGE_PROMPT_VERSION)
+        print(f"Deleted {deleted} knowledge chunks from earlier prompt versions.")
+        return deleted
+    
+    def seed_knowledge_base(self, subject: str, topic: str, grade: str = "grade_6", curriculum: str = "General", num_chunks: int = 10) -> None:
         """Seed the knowledge base with information about the subject and topic appropriate for the grade level and curriculum"""
         print(f"Seeding knowledge base for {subject} on {topic} at {grade} level following {curriculum} curriculum...")
+        telemetry = get_telemetry()
         
-        # Generate knowledge chunks with the exact grade level provided
-        chunks = self.get_knowledge_chunks(subject, topic, grade, curriculum)
-        
-        # Create metadata for each chunk
-        metadata = [
-            {
-                "subject": subject,
-                "topic": topic,
-                "grade": grade,
-                "curriculum": curriculum,
-                "chunk_index": i
-            }
-            for i in range(len(chunks))
-        ]
-        
-        # Add to vector store
-        self.vector_store.add_texts(chunks, metadata)
+        with telemetry.span("seed", subject=subject, topic=topic, grade=grade, curriculum=curriculum) as span:
+            # Nothing to do if the store already holds this request's chunks, e.g. restored from a
+            # snapshot or persisted by an earlier run
+            partition = {"subject": subject, "topic": topic, "grade": grade, "curriculum": curriculum, "prompt_version": KNOWLEDGE_PROMPT_VERSION}
+            stored = self.vector_store.count(partition)
+            span.set("already_stored", stored)
+            # Stored by another process sharing the collection; make them searchable lexically here too
+            if stored and self.vector_store.lexical_index.count(partition) < stored:
+                self.vector_store.refresh_lexical_index(partition)
+            if stored >= num_chunks:
+                print(f"Knowledge base already holds {stored} chunks for {subject} on {topic}.")
+                return
+            # A partial slice (e.g. a seed interrupted mid-upsert) is completed below from the knowledge
+            # cache where possible; chunks already stored are skipped
+            
+            # Reuse chunks and embeddings seeded earlier for the same request instead of calling GPT-4o again
+            cache_key = KnowledgeCache.make_key(curriculum, subject, topic, grade, num_chunks, KNOWLEDGE_PROMPT_VERSION)
+            cached = self.cache.get(cache_key)
+            telemetry.record_cache("knowledge", cached is not None)
+            span.set("cache_hit", cached is not None)
+            
+            if cached is not None:
+                chunks, vectors = cached
+                print(f"Using {len(chunks)} cached knowledge chunks.")
+            else:
+                # Generate knowledge chunks with the exact grade level provided
+                chunks = self.get_knowledge_chunks(subject, topic, grade, curriculum, num_chunks)
+                with telemetry.span("encode", texts=len(chunks)):
+                    vectors = self.vector_store.encoder.encode(chunks).tolist() if chunks else []
+                if chunks:
+                    self.cache.put(cache_key, chunks, vectors)
+            
+            # Create metadata for each chunk
+            metadata = [
+                {
+                    "subject": subject,
+                    "topic": topic,
+                    "grade": grade,
+                    "curriculum": curriculum,
+                    "prompt_version": KNOWLEDGE_PROMPT_VERSION,
+                    "chunk_index": i
+                }
+                for i in range(len(chunks))
+            ]
+            
+            # Add to vector store - chunks that are already stored are skipped
+            added = self.vector_store.add_texts(chunks, metadata, vectors)
+            span.set("chunks", len(chunks))
+            span.set("added", added)
         
-        print(f"Added {len(chunks)} knowledge chunks to the vector store for {grade} level {curriculum} curriculum.") 
\ No newline at end of file
+        print(f"Added {added} new knowledge chunks ({len(chunks) - added} already present) to the vector store for {grade} level {curriculum} curriculum.")
\ No newline at end of file
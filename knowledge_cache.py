@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "knowledge_cache.sqlite3")
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 500
+
+
+class KnowledgeCache:
+    """Durable on-disk cache of seeded knowledge chunks and their embeddings.
+
+    Entries are keyed by the request fields that shape the seeding prompt, expire
+    after a TTL and are evicted least-recently-used once the cache grows past
+    max_entries. SQLite keeps the cache shared across processes and restarts.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl_seconds: Optional[int] = None, max_entries: Optional[int] = None):
+        self.path = path or os.getenv("KNOWLEDGE_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else int(os.getenv("KNOWLEDGE_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("KNOWLEDGE_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._create_table()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _create_table(self):
+        """Create the cache table if it doesn't exist"""
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS knowledge_chunks (
+                    key TEXT PRIMARY KEY,
+                    chunks TEXT NOT NULL,
+                    embeddings BLOB NOT NULL,
+                    dimension INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_knowledge_chunks_last_accessed ON knowledge_chunks (last_accessed)")
+
+    @staticmethod
+    def make_key(curriculum: str, subject: str, topic: str, grade: str, num_chunks: int, prompt_version: str) -> str:
+        """Build the cache key for a seeding request"""
+        raw = json.dumps([curriculum, subject, topic, grade, num_chunks, prompt_version])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[List[str], List[List[float]]]]:
+        """Return (chunks, embeddings) for a key, or None if missing or expired"""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT chunks, embeddings, dimension, created_at FROM knowledge_chunks WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            chunks_json, embeddings_blob, dimension, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                conn.execute("DELETE FROM knowledge_chunks WHERE key = ?", (key,))
+                return None
+
+            conn.execute("UPDATE knowledge_chunks SET last_accessed = ? WHERE key = ?", (now, key))
+
+        chunks = json.loads(chunks_json)
+        embeddings = np.frombuffer(embeddings_blob, dtype=np.float32).reshape(len(chunks), dimension)
+        return chunks, embeddings.tolist()
+
+    def put(self, key: str, chunks: List[str], embeddings: List[List[float]]):
+        """Store chunks and their embeddings, evicting old entries if needed"""
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        dimension = vectors.shape[1] if vectors.ndim == 2 else 0
+        now = time.time()
+
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO knowledge_chunks (key, chunks, embeddings, dimension, created_at, last_accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, json.dumps(chunks), vectors.tobytes(), dimension, now, now)
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """Drop expired entries, then the least recently used ones beyond max_entries"""
+        if self.ttl_seconds:
+            conn.execute("DELETE FROM knowledge_chunks WHERE created_at < ?", (now - self.ttl_seconds,))
+        if self.max_entries:
+            conn.execute(
+                """
+                DELETE FROM knowledge_chunks WHERE key IN (
+                    SELECT key FROM knowledge_chunks ORDER BY last_accessed DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,)
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        """Return entry count and on-disk size"""
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM knowledge_chunks").fetchone()[0]
+        return {
+            "entries": entries,
+            "size_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
@@ -0,0 +1,112 @@
+import re
+import math
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+# In-memory BM25 index over the texts of a Qdrant collection. VectorStore keeps
+# it in sync as texts are added, rebuilds it from the collection on startup and
+# fills in partitions written by other processes, so exact terms ("Pythagorean
+# theorem", "nuclear fission") can be matched without the encoder, and combined
+# with dense results for hybrid search. Only term counts and the filter fields
+# are held per point; texts and payloads stay in Qdrant.
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how in is it its of on or that the this to was were what when which who why will with".split()
+)
+
+# Standard BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords, with a plural "s" stripped so "proofs" matches "proof" """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class LexicalIndex:
+    """Thread-safe BM25 inverted index of point IDs, with the payload fields searches filter on"""
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._lengths: Dict[str, int] = {}
+        self._fields: Dict[str, Dict[str, Any]] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def __contains__(self, point_id: str) -> bool:
+        return point_id in self._lengths
+
+    def add(self, point_id: str, text: str, fields: Dict[str, Any]):
+        """Index a point's text and filter fields; points already indexed are left as they are"""
+        terms = Counter(tokenize(text))
+        with self._lock:
+            if point_id in self._lengths:
+                return
+            for term, count in terms.items():
+                self._postings.setdefault(term, {})[point_id] = count
+            length = sum(terms.values())
+            self._lengths[point_id] = length
+            self._total_length += length
+            self._fields[point_id] = fields
+
+    def update_fields(self, point_id: str, fields: Dict[str, Any]):
+        """Change filter fields of an indexed point; unknown points are ignored"""
+        with self._lock:
+            if point_id in self._fields:
+                self._fields[point_id] = {**self._fields[point_id], **fields}
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._lengths.clear()
+            self._fields.clear()
+            self._total_length = 0
+
+    def count(self, filters: Optional[Dict[str, Any]] = None) -> int:
+        """Number of indexed points matching the exact-match filters"""
+        conditions = {key: value for key, value in (filters or {}).items() if value is not None}
+        with self._lock:
+            if not conditions:
+                return len(self._lengths)
+            return sum(1 for fields in self._fields.values() if self._matches(fields, conditions))
+
+    @staticmethod
+    def _matches(fields: Dict[str, Any], conditions: Dict[str, Any]) -> bool:
+        return all(fields.get(key) == value for key, value in conditions.items())
+
+    def search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
+        """Return (point_id, BM25 score) pairs for points matching the query terms and the exact-match filters"""
+        terms = set(tokenize(query))
+        conditions = {key: value for key, value in (filters or {}).items() if value is not None}
+        with self._lock:
+            count = len(self._lengths)
+            if not count or not terms:
+                return []
+            average_length = self._total_length / count
+            scores: Dict[str, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for point_id, frequency in postings.items():
+                    if conditions and not self._matches(self._fields[point_id], conditions):
+                        continue
+                    norm = frequency + self.k1 * (1 - self.b + self.b * self._lengths[point_id] / average_length)
+                    scores[point_id] = scores.get(point_id, 0.0) + idf * frequency * (self.k1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
@@ -0,0 +1,367 @@
+import re
+import json
+import time
+import math
+import random
+import hashlib
+import threading
+from collections import deque
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Optional
+from PIL import Image
+
+# Local stand-in for the OpenAI chat completions and image endpoints used by the
+# story generator. It returns deterministic canned outline, scene and knowledge
+# text with configurable latency and error injection, so the pipeline can be
+# benchmarked without spending API credits. Point the openai client at it with
+# OPENAI_BASE_URL=<server.url>/v1. Optional per-endpoint requests-per-minute
+# limits answer excess requests with 429 and Retry-After, like the real API, and
+# usage reports cached_tokens for prompt prefixes it has already seen.
+
+OUTLINE_TEMPLATE = """Title: Exploring {topic}
+
+{scenes}
+
+Conclusion: The characters reflect on what they learned about {topic}."""
+
+SCENE_TEMPLATE = """NARRATIVE: {narrative}
+
+EXPLANATION: {explanation}
+
+IMAGE_PROMPT: {image_prompt}"""
+
+# Provider prompt caching applies to prompts of at least 1024 tokens, in 128-token steps
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_INCREMENT = 128
+
+IMAGE_SUBJECTS = [
+    "a labeled diagram of {topic}",
+    "students observing {topic} in a classroom laboratory",
+    "a close-up illustration showing how {topic} works",
+    "a timeline showing the history of {topic}",
+    "a field trip scene where a guide explains {topic}",
+    "a comparison chart of the key parts of {topic}",
+]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token)"""
+    return max(1, len(text) // 4)
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Keep benchmark output clean
+        pass
+
+    @property
+    def mock(self) -> "MockOpenAIServer":
+        return self.server.mock
+
+    def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_POST(self):
+        body = self._read_json()
+        endpoint = "images" if self.path.endswith("/images/generations") else "chat" if self.path.endswith("/chat/completions") else None
+        if endpoint is None:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        error = self.mock.take_error(endpoint)
+        if error is not None:
+            status, headers = error
+            self._send_json(status, {"error": {"message": "Injected mock error", "type": "mock_error"}}, headers)
+            return
+
+        time.sleep(self.mock.latency(endpoint))
+        if endpoint == "chat":
+            self._handle_chat(body)
+        else:
+            self._handle_image(body)
+
+    def do_GET(self):
+        match = re.match(r"^/images/(\w+)\.png$", self.path)
+        if not match:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        payload = self.mock.image_bytes(match.group(1))
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle_chat(self, body: Dict[str, Any]):
+        messages = body.get("messages", [])
+        prompt = "\n".join(message.get("content", "") for message in messages)
+        json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+        content = self.mock.completion_for(prompt, json_mode)
+        usage = {
+            "prompt_tokens": estimate_tokens(prompt),
+            "completion_tokens": estimate_tokens(content),
+            "total_tokens": estimate_tokens(prompt) + estimate_tokens(content),
+            "prompt_tokens_details": {"cached_tokens": self.mock.cached_prompt_tokens(prompt)},
+        }
+        completion_id = f"chatcmpl-mock-{self.mock.next_id()}"
+        created = int(time.time())
+        model = body.get("model", "gpt-4o")
+
+        if not body.get("stream"):
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        # Server-sent events, delimited by closing the connection
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        pieces = re.findall(r"\S+\s*", content)
+        delay = self.mock.stream_token_delay
+        for i, piece in enumerate(pieces):
+            delta = {"role": "assistant", "content": piece} if i == 0 else {"content": piece}
+            self._send_event({"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                              "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+            if delay:
+                time.sleep(delay)
+        self._send_event({"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                          "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._send_event({"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                              "choices": [], "usage": usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _send_event(self, data: Dict[str, Any]):
+        self.wfile.write(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def _handle_image(self, body: Dict[str, Any]):
+        image_id = hashlib.sha256(f"{body.get('prompt', '')}:{self.mock.next_id()}".encode("utf-8")).hexdigest()[:16]
+        self._send_json(200, {
+            "created": int(time.time()),
+            "data": [{"url": f"{self.mock.url}/images/{image_id}.png", "revised_prompt": body.get("prompt", "")}],
+        })
+
+
+class MockOpenAIServer:
+    """Threaded local HTTP server speaking the subset of the OpenAI API the generator uses"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, text_latency: float = 0.5, image_latency: float = 2.0,
+                 latency_jitter: float = 0.1, error_rate: float = 0.0, scene_count: int = 5, num_chunks: int = 10,
+                 stream_token_delay: float = 0.0, seed: int = 0, chat_rpm: Optional[int] = None, image_rpm: Optional[int] = None,
+                 rate_window: float = 60.0, prompt_cache_min_tokens: int = PROMPT_CACHE_MIN_TOKENS, malformed_rate: float = 0.0):
+        self.text_latency = text_latency
+        self.image_latency = image_latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        # Share of scene responses that come back truncated, to exercise the repair path
+        self.malformed_rate = malformed_rate
+        self.malformed = 0
+        self.scene_count = scene_count
+        self.num_chunks = num_chunks
+        self.stream_token_delay = stream_token_delay
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counter = 0
+        self.requests = {"chat": 0, "images": 0}
+        self.errors = {"chat": 0, "images": 0}
+        # Sliding-window request limits; rate_window can be shortened to test throttling quickly
+        self.rpm_limits = {"chat": chat_rpm, "images": image_rpm}
+        self.rate_window = rate_window
+        self._recent = {"chat": deque(), "images": deque()}
+        self.throttled = {"chat": 0, "images": 0}
+        # Hashes of prompt prefixes seen so far, to report cached tokens like the provider's prompt cache
+        self.prompt_cache_min_tokens = prompt_cache_min_tokens
+        self._prompt_prefixes = set()
+        self.cached_tokens = 0
+
+        self._server = ThreadingHTTPServer((host, port), MockOpenAIHandler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockOpenAIServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def next_id(self) -> int:
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+    def latency(self, endpoint: str) -> float:
+        base = self.text_latency if endpoint == "chat" else self.image_latency
+        with self._lock:
+            jitter = self._random.uniform(-self.latency_jitter, self.latency_jitter) * base
+        return max(0.0, base + jitter)
+
+    def take_error(self, endpoint: str) -> Optional[tuple]:
+        """Decide whether to fail this request; returns (status, headers) or None"""
+        with self._lock:
+            self.requests[endpoint] += 1
+            throttled = self._throttle(endpoint)
+            if throttled is not None:
+                return throttled
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors[endpoint] += 1
+                # Alternate between rate limiting and server errors, as seen in production
+                if self._random.random() < 0.5:
+                    return 429, {"Retry-After": "1"}
+                return 500, {}
+        return None
+
+    def _throttle(self, endpoint: str) -> Optional[tuple]:
+        """Reject the request with 429 if the endpoint is over its limit for the current window"""
+        limit = self.rpm_limits.get(endpoint)
+        if not limit:
+            return None
+        now = time.monotonic()
+        recent = self._recent[endpoint]
+        while recent and now - recent[0] >= self.rate_window:
+            recent.popleft()
+        if len(recent) >= limit:
+            self.throttled[endpoint] += 1
+            retry_after = self.rate_window - (now - recent[0])
+            return 429, {
+                "Retry-After": str(max(1, math.ceil(retry_after))) if self.rate_window >= 1 else f"{retry_after:.3f}",
+                "x-ratelimit-limit-requests": str(limit),
+                "x-ratelimit-remaining-requests": "0",
+            }
+        recent.append(now)
+        return None
+
+    def cached_prompt_tokens(self, prompt: str) -> int:
+        """Tokens of the longest previously seen prompt prefix, counted the way OpenAI's prompt cache does:
+        nothing below prompt_cache_min_tokens, then in PROMPT_CACHE_INCREMENT steps"""
+        block = PROMPT_CACHE_INCREMENT * 4
+        first_end = max(block, self.prompt_cache_min_tokens * 4)
+        prefix_hash = hashlib.sha256(prompt[:first_end - block].encode("utf-8"))
+        digests = []
+        for end in range(first_end, len(prompt) + 1, block):
+            prefix_hash.update(prompt[end - block:end].encode("utf-8"))
+            digests.append(prefix_hash.copy().digest())
+        with self._lock:
+            hits = 0
+            while hits < len(digests) and digests[hits] in self._prompt_prefixes:
+                hits += 1
+            self._prompt_prefixes.update(digests)
+            cached = (first_end // 4) + (hits - 1) * PROMPT_CACHE_INCREMENT if hits else 0
+            self.cached_tokens += cached
+        return cached
+
+    def completion_for(self, prompt: str, json_mode: bool = False) -> str:
+        """Pick a canned response based on which prompt the generator sent"""
+        # The request's own topic comes last; instructions earlier in the prompt may use the phrase too
+        topic_matches = re.findall(r"focusing on (.+?)(?:,|\.?$)", prompt, re.MULTILINE)
+        topic = topic_matches[-1] if topic_matches else "the topic"
+
+        if "repair scene drafts" in prompt:
+            requested = re.search(r"Return JSON with the fields (.+)\.", prompt)
+            fields = re.findall(r'"(\w+)"', requested.group(1)) if requested else []
+            return json.dumps({field: f"Repaired {field.replace('_', ' ')} about {topic}." for field in fields})
+
+        # Scene prompts in fast mode quote the full story outline, so check for them first
+        if "detailed scene" in prompt:
+            description = re.search(r"Scene description: (.+)", prompt)
+            scene_number = re.search(r"Part (\d+)", description.group(1)) if description else None
+            index = int(scene_number.group(1)) - 1 if scene_number else 0
+            narrative = " ".join(
+                f"In this part of the story the friends explore {topic} and learn something new."
+                for _ in range(25)
+            )
+            explanation = f"This scene shows how {topic} works, step by step, using everyday examples."
+            image_prompt = IMAGE_SUBJECTS[index % len(IMAGE_SUBJECTS)].format(topic=topic)
+            if json_mode:
+                content = json.dumps({"narrative": narrative, "explanation": explanation, "image_prompt": image_prompt})
+            else:
+                content = SCENE_TEMPLATE.format(narrative=narrative, explanation=explanation, image_prompt=image_prompt)
+            if self.malformed_rate:
+                with self._lock:
+                    malformed = self._random.random() < self.malformed_rate
+                    cut = self._random.uniform(0.5, 0.99)
+                    if malformed:
+                        self.malformed += 1
+                if malformed:
+                    # Cut the response off part-way through, as when it runs out of tokens
+                    content = content[:int(len(content) * cut)]
+            return content
+
+        if "story outline" in prompt:
+            if json_mode:
+                return json.dumps({
+                    "title": f"Exploring {topic}",
+                    "introduction": f"A group of friends sets out to understand {topic}.",
+                    "scenes": [
+                        {"title": f"Part {i+1} of the journey through {topic}",
+                         "description": f"The characters discover idea number {i+1} about {topic} and discuss why it matters."}
+                        for i in range(self.scene_count)
+                    ],
+                    "conclusion": f"The characters reflect on what they learned about {topic}.",
+                })
+            scenes = "\n\n".join(
+                f"Scene {i+1}: Part {i+1} of the journey through {topic}.\n"
+                f"The characters discover idea number {i+1} about {topic} and discuss why it matters."
+                for i in range(self.scene_count)
+            )
+            return OUTLINE_TEMPLATE.format(topic=topic, scenes=scenes)
+
+        if "knowledge chunks" in prompt:
+            return "\n\n".join(
+                f"Fact {i+1} about {topic}: this paragraph explains one specific aspect of {topic} "
+                f"with a concrete example that students can relate to. It is chunk number {i+1}."
+                for i in range(self.num_chunks)
+            )
+
+        return f"This is a mock response about {topic}."
+
+    def image_bytes(self, image_id: str) -> bytes:
+        """Render a small deterministic PNG for an image ID"""
+        digest = hashlib.sha256(image_id.encode("utf-8")).digest()
+        output = BytesIO()
+        Image.new("RGB", (256, 256), tuple(digest[:3])).save(output, format="PNG")
+        return output.getvalue()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"requests": dict(self.requests), "errors": dict(self.errors), "throttled": dict(self.throttled),
+                    "cached_prompt_tokens": self.cached_tokens, "malformed_scenes": self.malformed}
@@ -0,0 +1,268 @@
+import os
+import re
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from prompt_templates import scene_system_prompt
+from scheduler import DEFAULT_COMPLETION_ESTIMATE
+
+# Turns an outline completion into the list of scenes to write, and checks the
+# story against a scene count range and a token/cost budget before any scene is
+# generated. Outlines are requested as JSON; text outlines (including markdown
+# headings such as "**Scene 1**" or "### Chapter 2") are segmented as a fallback.
+
+load_dotenv()
+
+DEFAULT_MIN_SCENES = 3
+DEFAULT_MAX_SCENES = 8
+# Per story, for the scene and image requests that follow the outline
+DEFAULT_TOKEN_BUDGET = 60_000
+DEFAULT_COST_BUDGET_USD = 1.00
+
+# USD per million input and output tokens, and per image; override with STORY_MODEL_PRICES
+DEFAULT_MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "dall-e-3": (0.04, None),
+}
+
+# Prompt tokens the scene prompt spends on retrieved background at most (RETRIEVAL_TOKEN_BUDGET)
+BACKGROUND_TOKENS = 450
+# Each earlier scene is summarised in 200 characters in sequential mode
+PREVIOUS_SCENE_TOKENS = 55
+
+# "Scene 1: ...", "**Scene 1**", "### Chapter 2 - ...", "3. Part III: ..."; a bare "Part of ..." line is not a heading
+HEADING_PATTERN = re.compile(
+    r"^\s*((?:#{1,6}|[*_]{1,2}|\d+[.)])\s*)*(Scene|Chapter|Part)\b\s*(\d+\b|[IVX]+\b)?\s*(:|\.|-|–|—)?\s*[*_]{0,2}\s*(.*)$",
+    re.IGNORECASE,
+)
+# Where a scene description may be split into two scenes
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+# A closing section after the last scene, which is not part of it
+CLOSING_PATTERN = re.compile(r"^\s*(?:#{1,6}|[*_]{1,2})?\s*(Conclusion|Summary|Epilogue|Key Takeaways)\b", re.IGNORECASE)
+
+
+class StoryBudgetExceeded(Exception):
+    """The story would cost more than the configured budget even at the minimum scene count"""
+
+
+class StoryOutlineTooShort(Exception):
+    """The outline has fewer scenes than the minimum and too little text to split into more"""
+
+
+def parse_model_prices(spec: str) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+    """Parse "gpt-4o=2.5:10,dall-e-3=0.04" into {model: (input or per-image price, output price)}"""
+    prices = dict(DEFAULT_MODEL_PRICES)
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, values = entry.partition("=")
+        first, _, second = values.partition(":")
+        prices[model.strip()] = (float(first) if first else None, float(second) if second else None)
+    return prices
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token)"""
+    return len(text) // 4
+
+
+def clean_heading_text(text: str) -> str:
+    return text.strip().strip("*_#").strip()
+
+
+def parse_json_outline(text: str) -> Optional[Dict[str, Any]]:
+    """Read a structured outline, tolerating a ```json fence; returns None if it is not one"""
+    stripped = text.strip()
+    if stripped.startswith("```"):
+        stripped = stripped.split("\n", 1)[1] if "\n" in stripped else ""
+        stripped = stripped.rsplit("```", 1)[0]
+    try:
+        data = json.loads(stripped)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("scenes"), list):
+        return None
+
+    scenes = []
+    for scene in data["scenes"]:
+        if isinstance(scene, dict):
+            title = str(scene.get("title") or "").strip()
+            description = str(scene.get("description") or scene.get("summary") or "").strip()
+        else:
+            title, description = "", str(scene).strip()
+        if title or description:
+            scenes.append({"title": title, "description": description})
+    return {
+        "title": str(data.get("title") or "").strip(),
+        "introduction": str(data.get("introduction") or "").strip(),
+        "conclusion": str(data.get("conclusion") or "").strip(),
+        "scenes": scenes,
+        "format": "json",
+    }
+
+
+def segment_text_outline(text: str) -> List[Dict[str, str]]:
+    """Split a free-text outline on Scene/Chapter/Part headings, in plain or markdown form"""
+    scenes = []
+    in_scene = False
+    for line in text.split("\n"):
+        match = HEADING_PATTERN.match(line)
+        if match and (match.group(1) or match.group(3) or match.group(4) == ":"):
+            scenes.append({"title": clean_heading_text(match.group(5)), "lines": []})
+            in_scene = True
+        elif CLOSING_PATTERN.match(line):
+            in_scene = False
+        elif in_scene and line.strip():
+            scenes[-1]["lines"].append(clean_heading_text(line) if line.lstrip().startswith("#") else line.strip())
+    return [{"title": scene["title"], "description": "\n".join(scene["lines"])} for scene in scenes]
+
+
+def parse_outline(text: str) -> Dict[str, Any]:
+    """Return {"title", "introduction", "conclusion", "scenes", "format"} from a JSON or text outline"""
+    structured = parse_json_outline(text)
+    if structured is not None:
+        return structured
+    scenes = segment_text_outline(text)
+    if scenes:
+        return {"title": "", "introduction": "", "conclusion": "", "scenes": scenes, "format": "headings"}
+    # No headings at all - treat each paragraph as a scene and let the analyzer merge them
+    paragraphs = [{"title": "", "description": p.strip()} for p in re.split(r"\n\s*\n", text) if p.strip()]
+    return {"title": "", "introduction": "", "conclusion": "", "scenes": paragraphs, "format": "paragraphs"}
+
+
+def merge_scenes(scenes: List[Dict[str, str]], count: int) -> List[Dict[str, str]]:
+    """Merge adjacent scenes into `count` evenly sized groups"""
+    if len(scenes) <= count:
+        return list(scenes)
+    groups = []
+    for i in range(count):
+        group = scenes[len(scenes) * i // count:len(scenes) * (i + 1) // count]
+        groups.append({
+            "title": " / ".join(scene["title"] for scene in group if scene["title"]),
+            "description": "\n".join(scene["description"] for scene in group if scene["description"]),
+        })
+    return groups
+
+
+def split_scenes(scenes: List[Dict[str, str]], count: int) -> List[Dict[str, str]]:
+    """Split the scenes with the most sentences in half until there are `count`; stops early if no scene has two sentences"""
+    scenes = list(scenes)
+    while len(scenes) < count:
+        sentences = [SENTENCE_BOUNDARY.split(scene["description"].strip()) if scene["description"].strip() else [] for scene in scenes]
+        longest = max(range(len(scenes)), key=lambda i: len(sentences[i]))
+        if len(sentences[longest]) < 2:
+            break
+        middle = len(sentences[longest]) // 2
+        title = scenes[longest]["title"]
+        scenes[longest:longest + 1] = [
+            {"title": title, "description": " ".join(sentences[longest][:middle])},
+            {"title": f"{title} (continued)" if title else "", "description": " ".join(sentences[longest][middle:])},
+        ]
+    return scenes
+
+
+def scene_description(index: int, scene: Dict[str, str]) -> str:
+    """The text a scene is written from: its numbered heading and description"""
+    heading = f"Scene {index+1}: {scene['title']}" if scene["title"] else f"Scene {index+1}"
+    return f"{heading}\n{scene['description']}" if scene["description"] else heading
+
+
+def render_outline(outline: Dict[str, Any]) -> str:
+    """Markdown text of a parsed outline, as stored in the story and shown in the app"""
+    parts = []
+    if outline["title"]:
+        parts.append(f"## {outline['title']}")
+    if outline["introduction"]:
+        parts.append(outline["introduction"])
+    for i, scene in enumerate(outline["scenes"]):
+        heading, _, body = scene_description(i, scene).partition("\n")
+        parts.append(f"**{heading}**" + (f"\n{body}" if body else ""))
+    if outline["conclusion"]:
+        parts.append(f"**Conclusion:** {outline['conclusion']}")
+    return "\n\n".join(parts)
+
+
+class OutlineAnalyzer:
+    """Fits an outline to the scene count range and per-story budget, estimating its cost up front"""
+
+    def __init__(self, min_scenes: Optional[int] = None, max_scenes: Optional[int] = None, token_budget: Optional[int] = None,
+                 cost_budget: Optional[float] = None, prices: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None):
+        self.min_scenes = min_scenes if min_scenes is not None else int(os.getenv("STORY_MIN_SCENES", DEFAULT_MIN_SCENES))
+        self.max_scenes = max_scenes if max_scenes is not None else int(os.getenv("STORY_MAX_SCENES", DEFAULT_MAX_SCENES))
+        self.token_budget = token_budget if token_budget is not None else int(os.getenv("STORY_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET))
+        self.cost_budget = cost_budget if cost_budget is not None else float(os.getenv("STORY_COST_BUDGET_USD", DEFAULT_COST_BUDGET_USD))
+        self.prices = prices if prices is not None else parse_model_prices(os.getenv("STORY_MODEL_PRICES", ""))
+        self.background_tokens = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", BACKGROUND_TOKENS))
+
+    def estimate(self, scenes: List[str], outline_text: str, grade: str, curriculum: str, mode: str,
+                 text_model: str = "gpt-4o", image_model: str = "dall-e-3") -> Dict[str, Any]:
+        """Estimate the tokens and cost of writing and illustrating scenes from these descriptions"""
+        fixed = estimate_tokens(scene_system_prompt(grade, curriculum)) + self.background_tokens + 30
+        outline_tokens = estimate_tokens(outline_text)
+        prompt_tokens = 0
+        for i, scene in enumerate(scenes):
+            prompt_tokens += fixed + estimate_tokens(scene)
+            if mode == "fast":
+                # The full outline plus the neighbouring scene descriptions
+                prompt_tokens += outline_tokens + sum(estimate_tokens(s) for s in [scenes[j] for j in (i - 1, i + 1) if 0 <= j < len(scenes)])
+            else:
+                prompt_tokens += i * PREVIOUS_SCENE_TOKENS
+        completion_tokens = len(scenes) * DEFAULT_COMPLETION_ESTIMATE
+
+        input_price, output_price = self.prices.get(text_model, (None, None))
+        image_price = self.prices.get(image_model, (None, None))[0]
+        cost = (prompt_tokens * (input_price or 0) + completion_tokens * (output_price or 0)) / 1_000_000
+        cost += len(scenes) * (image_price or 0)
+        return {
+            "scenes": len(scenes),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "images": len(scenes),
+            "cost_usd": round(cost, 4),
+        }
+
+    def within_budget(self, estimate: Dict[str, Any]) -> bool:
+        return estimate["total_tokens"] <= self.token_budget and estimate["cost_usd"] <= self.cost_budget
+
+    def analyze(self, outline_text: str, grade: str, curriculum: str, mode: str, text_model: str = "gpt-4o", image_model: str = "dall-e-3") -> Dict[str, Any]:
+        """Parse an outline and fit it to the scene range and budget.
+
+        Returns {"outline": markdown text, "scenes": [scene descriptions], "format", "adjustments", "estimate"}.
+        Raises StoryOutlineTooShort if the outline cannot be split into min_scenes scenes and
+        StoryBudgetExceeded if even min_scenes scenes would go over budget.
+        """
+        parsed = parse_outline(outline_text)
+        scenes = parsed["scenes"] or [{"title": "", "description": outline_text.strip()}]
+        adjustments = []
+
+        if len(scenes) > self.max_scenes:
+            adjustments.append(f"merged {len(scenes)} scenes into {self.max_scenes}")
+            scenes = merge_scenes(scenes, self.max_scenes)
+        elif len(scenes) < self.min_scenes:
+            split = split_scenes(scenes, self.min_scenes)
+            if len(split) < self.min_scenes:
+                raise StoryOutlineTooShort(
+                    f"Outline has {len(scenes)} scenes and too little text to split into the minimum of {self.min_scenes}"
+                )
+            adjustments.append(f"split {len(scenes)} scenes into {self.min_scenes}")
+            scenes = split
+
+        while True:
+            # Keep the model's own text unless it is structured or its scenes were regrouped
+            if parsed["format"] == "json" or len(scenes) != len(parsed["scenes"]):
+                rendered = render_outline(dict(parsed, scenes=scenes))
+            else:
+                rendered = outline_text.strip()
+            descriptions = [scene_description(i, scene) for i, scene in enumerate(scenes)]
+            estimate = self.estimate(descriptions, rendered, grade, curriculum, mode, text_model, image_model)
+            if self.within_budget(estimate) or len(scenes) <= self.min_scenes:
+                break
+            adjustments.append(f"merged {len(scenes)} scenes into {len(scenes) - 1} to fit the budget")
+            scenes = merge_scenes(scenes, len(scenes) - 1)
+
+        if not self.within_budget(estimate):
+            raise StoryBudgetExceeded(
+                f"Estimated {estimate['total_tokens']} tokens / ${estimate['cost_usd']:.2f} for {len(scenes)} scenes "
+                f"exceeds the story budget of {self.token_budget} tokens / ${self.cost_budget:.2f}"
+            )
+        return {"outline": rendered, "scenes": descriptions, "format": parsed["format"], "adjustments": adjustments, "estimate": estimate}
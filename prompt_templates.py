@@ -0,0 +1,450 @@
+from functools import lru_cache
+from typing import Dict, List
+
+# Prompt templates for the outline, scene and knowledge requests. Everything that
+# depends only on (grade, curriculum) - the role, grade guidelines, instructions and
+# output format - is built once into a system message, and the per-request parts
+# (subject, topic, story context, background, scene description) follow in the user
+# message, most stable first. Requests for the same grade and curriculum then share
+# a byte-identical prefix. OpenAI only caches prefixes of 1024 tokens or more, and
+# these system prompts (about 200-470 tokens) are below that on their own; a request
+# gets cached_tokens only when the part it shares with an earlier one, story context
+# included, is long enough. The benchmark reports the prompt sizes and cached share.
+
+# Shortest prompt prefix OpenAI caches, in tokens
+STATIC_PREFIX_TOKENS_MIN = 1024
+
+# Story writing guidelines for each specific grade
+STORY_GRADE_GUIDELINES = {
+    # Pre-K and Kindergarten
+    "pre_k": {
+        "vocabulary": "very simple words (around 500-1000 word vocabulary), primarily concrete nouns and basic verbs",
+        "sentence_structure": "very short, simple sentences (3-5 words), present tense, active voice",
+        "narrative_style": "highly repetitive, concrete concepts only, strong visual support needed, focus on familiar objects and experiences",
+        "explanation_depth": "extremely basic concepts with immediate relevance to child's experience, heavy use of visual analogies",
+        "image_style": "bright, simple illustrations with minimal details, bold colors, exaggerated features, friendly characters"
+    },
+    "kindergarten": {
+        "vocabulary": "simple, everyday words (around 2000-3000 word vocabulary), concrete nouns and basic action verbs",
+        "sentence_structure": "short, simple sentences (5-7 words), mainly present tense, active voice",
+        "narrative_style": "repetitive patterns, familiar settings, concrete concepts, character-focused stories with clear emotions",
+        "explanation_depth": "very basic concepts connected to daily experiences, simple cause-and-effect relationships",
+        "image_style": "colorful, engaging illustrations with some details, friendly characters, clear action sequences"
+    },
+
+    # Elementary School (Grades 1-5)
+    "grade_1": {
+        "vocabulary": "familiar, everyday words with gradual introduction of new terms (around 4000-5000 word vocabulary)",
+        "sentence_structure": "simple sentences (5-8 words) with occasional compound sentences, primarily present tense",
+        "narrative_style": "simple storylines with clear beginning-middle-end, familiar settings, concrete problems and solutions",
+        "explanation_depth": "basic concepts with real-world examples from child's experience, simple step-by-step explanations",
+        "image_style": "colorful illustrations with increased detail, clear expressions on characters, visual support for new concepts"
+    },
+    "grade_2": {
+        "vocabulary": "expanding vocabulary (around 5000-6000 words) with new terms defined in context",
+        "sentence_structure": "a mix of simple and compound sentences (7-10 words), introduction to past tense",
+        "narrative_style": "sequential stories with minor conflicts and resolutions, introduction to character motivation",
+        "explanation_depth": "concrete explanations with familiar analogies, beginning to connect related concepts",
+        "image_style": "detailed illustrations that support text comprehension, visual representations of processes or sequences"
+    },
+    "grade_3": {
+        "vocabulary": "broader vocabulary (6000-9000 words) with subject-specific terms defined clearly",
+        "sentence_structure": "varied sentence types and lengths (8-12 words), introduction to paragraphing",
+        "narrative_style": "more developed plots with multiple events, character development, introduction to different perspectives",
+        "explanation_depth": "expanded explanations with cause and effect, beginning to connect to broader concepts",
+        "image_style": "detailed illustrations with multiple elements, diagrams introduced to explain processes, realistic depictions"
+    },
+    "grade_4": {
+        "vocabulary": "rich vocabulary (9000-11000 words) with academic terms, figurative language introduced",
+        "sentence_structure": "complex and compound sentences (10-14 words), varied paragraph structures",
+        "narrative_style": "multi-faceted plots, character development with internal motivations, introduction to themes",
+        "explanation_depth": "detailed explanations with multiple examples, beginning to explore abstract concepts",
+        "image_style": "detailed, accurate illustrations, introduction of charts and diagrams, visual metaphors"
+    },
+    "grade_5": {
+        "vocabulary": "sophisticated vocabulary (11000-14000 words) with technical terms and figurative language",
+        "sentence_structure": "varied sentence structures (12-15 words), well-developed paragraphs with supporting details",
+        "narrative_style": "layered plots with subplots, nuanced character development, exploration of themes",
+        "explanation_depth": "in-depth explanations connecting to prior knowledge, introduction to theoretical concepts",
+        "image_style": "detailed illustrations with scientific accuracy, labeled diagrams, visual analogies for complex concepts"
+    },
+
+    # Middle School (Grades 6-8)
+    "grade_6": {
+        "vocabulary": "advanced vocabulary (14000-17000 words) with domain-specific terminology and abstract concepts",
+        "sentence_structure": "complex sentence structures (12-18 words), variety of transition words, well-organized paragraphs",
+        "narrative_style": "developed plots with complications, character growth and change, exploration of themes and messages",
+        "explanation_depth": "comprehensive explanations with real-world applications, connections between concepts",
+        "image_style": "detailed educational illustrations, more sophisticated diagrams, visual representations of complex relationships"
+    },
+    "grade_7": {
+        "vocabulary": "extensive vocabulary (17000-19000 words) with specialized terminology and figurative expressions",
+        "sentence_structure": "sophisticated sentence patterns (15-20 words), argument structures, varied paragraph organization",
+        "narrative_style": "complex plots with conflict development, deeper character psychology, multiple themes",
+        "explanation_depth": "detailed analysis with examples and counterexamples, exploration of underlying principles",
+        "image_style": "scientifically accurate illustrations, detailed cross-sections, process diagrams, comparative visuals"
+    },
+    "grade_8": {
+        "vocabulary": "sophisticated vocabulary (19000-21000 words) with abstract terminology and nuanced meanings",
+        "sentence_structure": "varied, complex sentences (15-22 words), well-structured arguments, cohesive paragraphs",
+        "narrative_style": "multi-layered plots, complex character motivations and relationships, thematic depth",
+        "explanation_depth": "in-depth explanations with theoretical frameworks, connections to broader systems",
+        "image_style": "detailed technical illustrations, complex diagrams with multiple elements, visual analysis of systems"
+    },
+
+    # High School (Grades 9-12)
+    "grade_9": {
+        "vocabulary": "advanced academic vocabulary (21000-23000 words) with specialized terminology",
+        "sentence_structure": "sophisticated syntax (18-25 words), rhetorical devices, logical organization of complex ideas",
+        "narrative_style": "exploration of complex issues, character development showing internal conflicts, thematic analysis",
+        "explanation_depth": "detailed analysis with theoretical models, introduction to competing perspectives",
+        "image_style": "professional-quality diagrams, models showing interactions between systems, analytical visuals"
+    },
+    "grade_10": {
+        "vocabulary": "extensive academic vocabulary (23000-25000 words) with discipline-specific terminology",
+        "sentence_structure": "complex syntactic structures (20-25 words), sophisticated transitions, logical development of arguments",
+        "narrative_style": "multifaceted plots with subtle development, psychological depth in characters, thematic complexity",
+        "explanation_depth": "sophisticated analysis with theoretical foundations, exploration of implications and applications",
+        "image_style": "detailed scientific or technical visuals, complex systems diagrams, conceptual models with multiple layers"
+    },
+    "grade_11": {
+        "vocabulary": "college-preparatory vocabulary (25000-27000 words) with specialized academic language",
+        "sentence_structure": "varied, sophisticated syntax (20-30 words), nuanced argumentation, cohesive extended discourse",
+        "narrative_style": "complex, multi-layered narratives, deep character analysis, sophisticated thematic development",
+        "explanation_depth": "comprehensive analysis with theoretical frameworks, evaluation of different approaches",
+        "image_style": "sophisticated visual representations of complex concepts, detailed analytical diagrams, visual models with annotations"
+    },
+    "grade_12": {
+        "vocabulary": "college-level vocabulary (27000+ words) with field-specific terminology and academic discourse",
+        "sentence_structure": "highly sophisticated syntax (20-35 words), complex argumentation, cohesive extended prose",
+        "narrative_style": "nuanced narratives examining complex human experiences, sophisticated thematic exploration",
+        "explanation_depth": "in-depth analysis with theoretical frameworks, critical evaluation of concepts and applications",
+        "image_style": "college-level visual representations, complex models with detailed annotations, sophisticated visual analysis"
+    },
+
+    # College and Adult
+    "college_freshman": {
+        "vocabulary": "sophisticated academic vocabulary with field-specific terminology and theoretical concepts",
+        "sentence_structure": "complex academic prose with varied rhetorical structures, logical argumentation",
+        "narrative_style": "sophisticated exploration of complex ideas and human experiences, multiple layers of meaning",
+        "explanation_depth": "rigorous analysis with theoretical frameworks, critical evaluation of concepts and methodologies",
+        "image_style": "professional-grade visuals with precise detail, complex conceptual models, analytical diagrams with detailed annotations"
+    },
+    "college_sophomore": {
+        "vocabulary": "advanced academic and discipline-specific vocabulary with theoretical terminology",
+        "sentence_structure": "sophisticated academic discourse with complex logical structures and arguments",
+        "narrative_style": "nuanced exploration of complex ideas with multiple perspectives and theoretical foundations",
+        "explanation_depth": "detailed analysis with theoretical frameworks, critical evaluation and application of concepts",
+        "image_style": "sophisticated visualizations with detailed technical elements, complex systems models, professional-level diagrams"
+    },
+    "college_junior": {
+        "vocabulary": "specialized academic vocabulary with theoretical terminology specific to major fields",
+        "sentence_structure": "advanced academic prose with discipline-specific conventions and argumentative structures",
+        "narrative_style": "sophisticated exploration of complex ideas with integration of theoretical perspectives",
+        "explanation_depth": "in-depth analysis with theoretical foundations, critical evaluation of competing frameworks",
+        "image_style": "professional visualizations with field-specific conventions, complex analytical models, research-quality diagrams"
+    },
+    "college_senior": {
+        "vocabulary": "specialized academic and professional vocabulary with advanced theoretical terminology",
+        "sentence_structure": "sophisticated academic and professional discourse with field-specific conventions",
+        "narrative_style": "complex exploration of ideas with integration of multiple theoretical perspectives",
+        "explanation_depth": "comprehensive analysis with advanced theoretical frameworks, critical synthesis of concepts",
+        "image_style": "professional-grade visualizations meeting field standards, complex analytical models, research-quality visuals"
+    },
+    "graduate": {
+        "vocabulary": "highly specialized academic and professional vocabulary with advanced theoretical terminology",
+        "sentence_structure": "sophisticated academic discourse with field-specific conventions and advanced argumentation",
+        "narrative_style": "complex exploration of ideas with critical analysis of theoretical perspectives",
+        "explanation_depth": "advanced analysis with sophisticated theoretical frameworks, original synthesis of concepts",
+        "image_style": "publication-quality visualizations, complex theoretical models, research-level analytical diagrams"
+    },
+    "adult": {
+        "vocabulary": "sophisticated vocabulary with domain-specific terminology appropriate for educated adults",
+        "sentence_structure": "varied and complex structures appropriate for educated adult readers",
+        "narrative_style": "mature themes with nuanced exploration of complex ideas",
+        "explanation_depth": "comprehensive explanations with diverse perspectives and critical analysis",
+        "image_style": "refined, detailed visualizations that capture complex relationships and subtle nuances"
+    },
+
+    # Default fallback to middle school level
+    "default": {
+        "vocabulary": "expanded vocabulary with new terms clearly defined within context",
+        "sentence_structure": "mix of simple and compound sentences with some complexity",
+        "narrative_style": "engaging stories with some nuance and character development",
+        "explanation_depth": "moderate depth with connections to familiar concepts and practical examples",
+        "image_style": "detailed illustrations that balance educational content with engaging visuals"
+    }}
+
+# Guidelines for knowledge complexity for each individual grade
+KNOWLEDGE_GRADE_GUIDELINES = {
+    # Pre-K and Kindergarten
+    "pre_k": {
+        "complexity": "extremely simple concepts directly related to immediate sensory experiences",
+        "vocabulary": "basic words (500-1000 word vocabulary) using concrete nouns and simple action verbs",
+        "chunk_length": "very short paragraphs (30-50 words)",
+        "examples": "examples using familiar objects, animals, and everyday experiences"
+    },
+    "kindergarten": {
+        "complexity": "simple, concrete concepts with clear cause-effect relationships",
+        "vocabulary": "basic vocabulary (2000-3000 words) with new words immediately explained",
+        "chunk_length": "short paragraphs (40-70 words)",
+        "examples": "examples from daily life and familiar experiences"
+    },
+
+    # Elementary School (Grades 1-5)
+    "grade_1": {
+        "complexity": "basic concepts with simple explanations and immediate relevance",
+        "vocabulary": "common words (4000-5000 vocabulary) with new terms defined simply",
+        "chunk_length": "short paragraphs (50-80 words)",
+        "examples": "examples relating to children's immediate world and experiences"
+    },
+    "grade_2": {
+        "complexity": "straightforward concepts with clear connections to known ideas",
+        "vocabulary": "everyday vocabulary (5000-6000 words) with new terms defined in context",
+        "chunk_length": "short paragraphs (60-90 words)",
+        "examples": "concrete examples from experiences children might have had"
+    },
+    "grade_3": {
+        "complexity": "developing concepts with some connections between ideas",
+        "vocabulary": "expanding vocabulary (6000-9000 words) with subject-specific terms defined",
+        "chunk_length": "developing paragraphs (70-100 words)",
+        "examples": "familiar examples with some new contexts introduced"
+    },
+    "grade_4": {
+        "complexity": "interconnected concepts with some abstract relationships",
+        "vocabulary": "growing vocabulary (9000-11000 words) with academic terms introduced",
+        "chunk_length": "standard paragraphs (80-120 words)",
+        "examples": "examples that connect to broader experiences and some beyond direct experience"
+    },
+    "grade_5": {
+        "complexity": "moderately complex concepts with connections to broader principles",
+        "vocabulary": "richer vocabulary (11000-14000 words) with content-specific terminology",
+        "chunk_length": "developed paragraphs (100-150 words)",
+        "examples": "examples that include phenomena beyond immediate experience"
+    },
+
+    # Middle School (Grades 6-8)
+    "grade_6": {
+        "complexity": "concepts with multiple factors and relationships between systems",
+        "vocabulary": "expanded vocabulary (14000-17000 words) with technical terms explained",
+        "chunk_length": "full paragraphs (120-170 words)",
+        "examples": "real-world examples that connect to broader systems and processes"
+    },
+    "grade_7": {
+        "complexity": "multi-faceted concepts with cause-effect relationships and system interactions",
+        "vocabulary": "advanced vocabulary (17000-19000 words) with discipline-specific terminology",
+        "chunk_length": "developed paragraphs (150-180 words)",
+        "examples": "examples showing relationships between different systems or concepts"
+    },
+    "grade_8": {
+        "complexity": "complex concepts with interconnections between systems and abstract principles",
+        "vocabulary": "sophisticated vocabulary (19000-21000 words) with specialized terminology",
+        "chunk_length": "substantial paragraphs (150-200 words)",
+        "examples": "examples demonstrating underlying principles and theoretical applications"
+    },
+
+    # High School (Grades 9-12)
+    "grade_9": {
+        "complexity": "complex concepts with theoretical frameworks and system analysis",
+        "vocabulary": "academic vocabulary (21000-23000 words) with specialized terminology",
+        "chunk_length": "detailed paragraphs (170-220 words)",
+        "examples": "examples illustrating theoretical concepts and practical applications"
+    },
+    "grade_10": {
+        "complexity": "sophisticated concepts with analytical frameworks and critical perspectives",
+        "vocabulary": "advanced academic vocabulary (23000-25000 words) with field-specific terminology",
+        "chunk_length": "comprehensive paragraphs (180-230 words)",
+        "examples": "examples demonstrating analytical principles and theoretical models"
+    },
+    "grade_11": {
+        "complexity": "advanced concepts with theoretical foundations and critical analysis",
+        "vocabulary": "college-preparatory vocabulary (25000-27000 words) with specialized academic language",
+        "chunk_length": "detailed analytical paragraphs (200-250 words)",
+        "examples": "examples with theoretical applications and underlying principles"
+    },
+    "grade_12": {
+        "complexity": "college-level concepts with theoretical depth and critical evaluation",
+        "vocabulary": "college-level vocabulary (27000+ words) with discipline-specific terminology",
+        "chunk_length": "comprehensive academic paragraphs (200-250 words)",
+        "examples": "sophisticated examples showing theoretical frameworks and applications"
+    },
+
+    # College and Adult
+    "college_freshman": {
+        "complexity": "advanced concepts with theoretical frameworks and methodological approaches",
+        "vocabulary": "college-level academic vocabulary with field-specific terminology",
+        "chunk_length": "substantive academic paragraphs (200-250 words)",
+        "examples": "examples demonstrating theoretical principles and methodological applications"
+    },
+    "college_sophomore": {
+        "complexity": "specialized concepts with theoretical depth and analytical frameworks",
+        "vocabulary": "advanced academic vocabulary with discipline-specific terminology",
+        "chunk_length": "detailed academic paragraphs (200-250 words)",
+        "examples": "examples illustrating theoretical models and analytical approaches"
+    },
+    "college_junior": {
+        "complexity": "specialized concepts with theoretical sophistication and analytical depth",
+        "vocabulary": "specialized academic vocabulary with field-specific theoretical terminology",
+        "chunk_length": "comprehensive academic paragraphs (200-300 words)",
+        "examples": "sophisticated examples demonstrating theoretical principles and applications"
+    },
+    "college_senior": {
+        "complexity": "advanced specialized concepts with theoretical integration and critical analysis",
+        "vocabulary": "sophisticated academic vocabulary with specialized terminology",
+        "chunk_length": "substantive academic paragraphs (200-300 words)",
+        "examples": "examples showing integration of theoretical frameworks and practical applications"
+    },
+    "graduate": {
+        "complexity": "highly specialized concepts with theoretical sophistication and original analysis",
+        "vocabulary": "advanced academic vocabulary with specialized theoretical terminology",
+        "chunk_length": "comprehensive academic paragraphs (250-300 words)",
+        "examples": "sophisticated examples demonstrating theoretical innovation and critical analysis"
+    },
+    "adult": {
+        "complexity": "sophisticated concepts with multiple perspectives and critical analysis",
+        "vocabulary": "advanced vocabulary with specialized terminology for educated adults",
+        "chunk_length": "substantial informative paragraphs (200-250 words)",
+        "examples": "examples illustrating complex relationships and practical applications"
+    },
+
+    # Default fallback to middle school level
+    "default": {
+        "complexity": "foundational concepts with some detail and real-world connections",
+        "vocabulary": "moderate vocabulary with technical terms defined in context",
+        "chunk_length": "medium paragraphs (100-150 words)",
+        "examples": "examples relevant to students' experiences and broader world understanding"
+    }}
+
+
+def story_guidelines(grade: str) -> Dict[str, str]:
+    """Story guidelines for a grade, with generic wording for grades not listed"""
+    guidelines = STORY_GRADE_GUIDELINES.get(grade, {})
+    return {
+        "vocabulary": guidelines.get("vocabulary", f"appropriate for {grade} level"),
+        "sentence_structure": guidelines.get("sentence_structure", f"suitable for {grade} level"),
+        "narrative_style": guidelines.get("narrative_style", f"engaging for {grade} level"),
+        "explanation_depth": guidelines.get("explanation_depth", f"appropriate for {grade} level"),
+        "image_style": guidelines.get("image_style", f"visuals appropriate for {grade} level"),
+    }
+
+
+def image_style(grade: str) -> str:
+    """Return the illustration style for a grade level"""
+    return story_guidelines(grade)["image_style"]
+
+
+@lru_cache(maxsize=256)
+def outline_system_prompt(grade: str, curriculum: str, min_scenes: int, max_scenes: int) -> str:
+    guidelines = story_guidelines(grade)
+    return f"""You are a creative storyteller who creates educational and engaging stories tailored to specific grade levels.
+
+You write story outlines for {grade} level students following the {curriculum} curriculum.
+
+Please follow these grade-appropriate guidelines:
+- Vocabulary: {guidelines["vocabulary"]}
+- Sentence structure: {guidelines["sentence_structure"]}
+- Narrative style: {guidelines["narrative_style"]}
+- Explanation depth: {guidelines["explanation_depth"]}
+
+The outline should include:
+1. A clear introduction to the subject
+2. Between {min_scenes} and {max_scenes} key scenes that each explore a different aspect of the topic
+3. A logical flow between scenes
+4. A conclusion that summarizes the key learnings
+
+Ensure the content aligns with {curriculum} curriculum standards for {grade} level.
+
+Respond with a JSON object in this form:
+{{"title": "[story title]", "introduction": "[introduction]", "scenes": [{{"title": "[scene title]", "description": "[what happens and what it teaches]"}}], "conclusion": "[conclusion]"}}"""
+
+
+@lru_cache(maxsize=256)
+def scene_system_prompt(grade: str, curriculum: str) -> str:
+    guidelines = story_guidelines(grade)
+    return f"""You are a creative storyteller who creates educational and engaging stories with vivid descriptions tailored for {grade} level students.
+
+You write one detailed scene at a time for stories aimed at {grade} level students following the {curriculum} curriculum.
+
+Please follow these grade-appropriate guidelines:
+- Vocabulary: {guidelines["vocabulary"]}
+- Sentence structure: {guidelines["sentence_structure"]}
+- Narrative style: {guidelines["narrative_style"]}
+- Explanation depth: {guidelines["explanation_depth"]}
+
+For each scene, provide:
+1. A narrative text (300-500 words) that is engaging, educational, and explains concepts clearly at a {grade} level
+2. An explanatory section that elaborates on the key concepts or facts presented in this scene, appropriate for {grade} level students
+3. An image prompt that describes what should be visualized for this scene (detailed description for image generation) with a style appropriate for {grade} level: {guidelines["image_style"]}
+
+For the image prompt, follow these guidelines:
+- Keep text in the image to an absolute minimum (3-5 words maximum)
+- Any text should be simple labels or short titles only
+- Don't request decorative or stylized text
+- Be specific about what content should be visualized rather than focusing on text elements
+
+Ensure the content aligns with {curriculum} curriculum standards for {grade} level.
+
+Respond with a JSON object with exactly these string fields:
+{{"narrative": "[narrative text]", "explanation": "[explanatory text]", "image_prompt": "[detailed image prompt]"}}"""
+
+
+@lru_cache(maxsize=256)
+def knowledge_system_prompt(grade: str, curriculum: str) -> str:
+    guidelines = KNOWLEDGE_GRADE_GUIDELINES.get(grade, {})
+    return f"""You are a knowledgeable educator who can explain complex topics clearly to {grade} level students.
+
+You write knowledge chunks for {grade} level students following the {curriculum} curriculum.
+
+Please follow these grade-appropriate guidelines:
+- Complexity: {guidelines.get("complexity", f"appropriate for {grade} level")}
+- Vocabulary: {guidelines.get("vocabulary", f"suitable for {grade} level")}
+- Length: {guidelines.get("chunk_length", "appropriate length paragraphs")}
+- Examples: {guidelines.get("examples", f"examples suitable for {grade} level")}
+
+Each chunk should explain a specific aspect of the topic in a way that's educational, factual, and engaging for {grade} level students.
+Ensure the content aligns with {curriculum} curriculum standards where applicable.
+
+Format: Return each chunk as a separate paragraph with a clear focus."""
+
+
+def outline_messages(subject: str, topic: str, grade: str, curriculum: str, min_scenes: int, max_scenes: int) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": outline_system_prompt(grade, curriculum, min_scenes, max_scenes)},
+        {"role": "user", "content": f"Create a detailed story outline about {subject} focusing on {topic}."},
+    ]
+
+
+def scene_messages(subject: str, topic: str, grade: str, curriculum: str, scene_description: str, story_context: str, related_info_text: str) -> List[Dict[str, str]]:
+    """Messages for one scene; story_context is the outline or previous scenes, which only grow between scenes"""
+    user_parts = [f"Write a scene for the story about {subject} focusing on {topic}."]
+    if story_context:
+        user_parts.append(story_context)
+    if related_info_text:
+        user_parts.append(f"Related background information:\n{related_info_text}")
+    user_parts.append(f"Scene description: {scene_description}")
+    return [
+        {"role": "system", "content": scene_system_prompt(grade, curriculum)},
+        {"role": "user", "content": "\n\n".join(user_parts)},
+    ]
+
+
+def knowledge_messages(subject: str, topic: str, grade: str, curriculum: str, num_chunks: int) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": knowledge_system_prompt(grade, curriculum)},
+        {"role": "user", "content": f"Generate {num_chunks} detailed knowledge chunks about {subject} focusing on {topic}."},
+    ]
+
+
+def scene_repair_messages(scene_description: str, draft: str, missing: List[str]) -> List[Dict[str, str]]:
+    """Messages for a cheap follow-up call that fills in only the fields a scene completion lacked"""
+    fields = ", ".join(f'"{field}"' for field in missing)
+    return [
+        {"role": "system", "content": "You repair scene drafts for an educational story generator. "
+                                      "Respond with a JSON object containing only the requested string fields."},
+        {"role": "user", "content": f"Scene description: {scene_description}\n\n"
+                                    f"Draft response:\n{draft}\n\n"
+                                    f"The draft is missing or has cut-off fields: {fields}. Extract them from the draft if present; "
+                                    f"otherwise write them to match the draft. The narrative is 300-500 words, the explanation "
+                                    f"elaborates the scene's key concepts and the image_prompt describes one illustration with minimal text. "
+                                    f"Return JSON with the fields {fields}."},
+    ]
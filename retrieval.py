@@ -0,0 +1,120 @@
+import os
+from typing import Any, Dict, List, Optional
+import numpy as np
+from dotenv import load_dotenv
+from vector_store import VectorStore
+from telemetry import get_telemetry
+from outline_analyzer import BACKGROUND_TOKENS, estimate_tokens
+from knowledge_base import KNOWLEDGE_PROMPT_VERSION
+
+# Picks the background chunks that go into a scene prompt. Candidates come from
+# the request's curriculum/subject/topic/grade slice of the knowledge base (by
+# hybrid dense + BM25 search unless RETRIEVAL_SEARCH_MODE=dense); ones
+# below a similarity cutoff are dropped, the rest are chosen by maximal marginal
+# relevance (so near-duplicate chunks do not fill the prompt twice) and packed
+# until the context token budget is spent.
+
+load_dotenv()
+
+# Chunks fetched per query before filtering and diversification
+DEFAULT_CANDIDATES = 8
+# Chunks kept per scene at most
+DEFAULT_MAX_CHUNKS = 3
+# Cosine similarity below which a chunk is not considered related to the scene
+DEFAULT_MIN_SCORE = 0.25
+# Weight of relevance against novelty in MMR (1.0 ranks by relevance alone)
+DEFAULT_MMR_LAMBDA = 0.7
+# Chunks at least this similar to one already chosen are dropped as duplicates
+DEFAULT_DUPLICATE_THRESHOLD = 0.95
+# Vector store search mode for candidates; "dense" or "hybrid" (dense plus BM25)
+DEFAULT_SEARCH_MODE = "hybrid"
+
+
+def partition_filter(subject: str, topic: str, grade: str, curriculum: str) -> Dict[str, str]:
+    """Payload filter restricting a search to the chunks seeded for one request by the current knowledge prompt"""
+    return {"curriculum": curriculum, "subject": subject, "topic": topic, "grade": grade, "prompt_version": KNOWLEDGE_PROMPT_VERSION}
+
+
+def cosine_matrix(vectors: List[List[float]]) -> np.ndarray:
+    """Pairwise cosine similarity of the given vectors"""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = matrix / np.where(norms == 0, 1, norms)
+    return matrix @ matrix.T
+
+
+class ContextRetriever:
+    """Relevance-filtered, diversified and token-budgeted background retrieval for scene prompts"""
+
+    def __init__(self, vector_store: VectorStore, candidates: Optional[int] = None, max_chunks: Optional[int] = None,
+                 min_score: Optional[float] = None, mmr_lambda: Optional[float] = None,
+                 duplicate_threshold: Optional[float] = None, token_budget: Optional[int] = None, search_mode: Optional[str] = None):
+        self.vector_store = vector_store
+        self.candidates = candidates if candidates is not None else int(os.getenv("RETRIEVAL_CANDIDATES", DEFAULT_CANDIDATES))
+        self.max_chunks = max_chunks if max_chunks is not None else int(os.getenv("RETRIEVAL_MAX_CHUNKS", DEFAULT_MAX_CHUNKS))
+        self.min_score = min_score if min_score is not None else float(os.getenv("RETRIEVAL_MIN_SCORE", DEFAULT_MIN_SCORE))
+        self.mmr_lambda = mmr_lambda if mmr_lambda is not None else float(os.getenv("RETRIEVAL_MMR_LAMBDA", DEFAULT_MMR_LAMBDA))
+        self.duplicate_threshold = duplicate_threshold if duplicate_threshold is not None else float(os.getenv("RETRIEVAL_DUPLICATE_THRESHOLD", DEFAULT_DUPLICATE_THRESHOLD))
+        self.token_budget = token_budget if token_budget is not None else int(os.getenv("RETRIEVAL_TOKEN_BUDGET", BACKGROUND_TOKENS))
+        self.search_mode = search_mode if search_mode is not None else os.getenv("RETRIEVAL_SEARCH_MODE", DEFAULT_SEARCH_MODE)
+        # The cosine cutoff and MMR need a similarity score for every candidate, which lexical results lack
+        if self.search_mode not in ("dense", "hybrid"):
+            raise ValueError(f"Unknown retrieval search mode {self.search_mode!r}, expected 'dense' or 'hybrid'")
+
+    def retrieve(self, query: str, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Background chunks for one query"""
+        return self.retrieve_batch([query], filters)[0]
+
+    def retrieve_batch(self, queries: List[str], filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """Background chunks for several queries, fetched in one batched search"""
+        if not queries:
+            return []
+        candidates = self.vector_store.search_batch(queries, limit=max(self.candidates, self.max_chunks), filters=filters, with_vectors=True, mode=self.search_mode)
+        return [self.select(results) for results in candidates]
+
+    def select(self, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Choose chunks from scored search results; the returned chunks carry no vectors"""
+        telemetry = get_telemetry()
+        relevant = [candidate for candidate in candidates if candidate["score"] >= self.min_score]
+        telemetry.increment("retrieval_chunks_total", len(candidates) - len(relevant), outcome="below_min_score")
+        if not relevant:
+            return []
+
+        similarity = cosine_matrix([candidate["vector"] for candidate in relevant])
+        # Hybrid results are ranked by fused rank rather than cosine; scale that so the top one is 1
+        if all("rrf_score" in candidate for candidate in relevant):
+            top = max(candidate["rrf_score"] for candidate in relevant)
+            relevance = [candidate["rrf_score"] / top for candidate in relevant]
+        else:
+            relevance = [candidate["score"] for candidate in relevant]
+        remaining = list(range(len(relevant)))
+        chosen: List[int] = []
+        tokens = 0
+        duplicates = 0
+        over_budget = 0
+        while remaining and len(chosen) < self.max_chunks:
+            # Maximal marginal relevance: similar to the query, unlike what is already chosen
+            best = max(
+                remaining,
+                key=lambda i: self.mmr_lambda * relevance[i]
+                - (1 - self.mmr_lambda) * max((similarity[i][j] for j in chosen), default=0.0),
+            )
+            remaining.remove(best)
+            if chosen and max(similarity[best][j] for j in chosen) >= self.duplicate_threshold:
+                duplicates += 1
+                continue
+            chunk_tokens = estimate_tokens(relevant[best]["text"])
+            if tokens + chunk_tokens > self.token_budget:
+                # A shorter chunk further down may still fit
+                over_budget += 1
+                continue
+            chosen.append(best)
+            tokens += chunk_tokens
+
+        telemetry.increment("retrieval_chunks_total", duplicates, outcome="duplicate")
+        telemetry.increment("retrieval_chunks_total", over_budget, outcome="over_budget")
+        telemetry.increment("retrieval_chunks_total", len(chosen), outcome="selected")
+        telemetry.increment("retrieval_context_tokens_total", tokens)
+        # Most relevant first in the prompt
+        chosen.sort(key=lambda i: relevance[i], reverse=True)
+        return [{key: value for key, value in relevant[i].items() if key not in ("vector", "rrf_score", "lexical_score")} for i in chosen]
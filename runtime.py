@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+import resource
+from typing import Any, Dict, Optional, Sequence, TYPE_CHECKING
+from dotenv import load_dotenv
+from encoders import Encoder, create_encoder, DEFAULT_MODEL_NAME
+
+if TYPE_CHECKING:
+    from qdrant_client import QdrantClient
+
+# Process-wide registry for the heavy objects shared by every generator.
+# Streamlit re-executes app.py on every interaction, so anything created here is
+# built once per process and handed out to VectorStore, StoryGenerator and
+# KnowledgeBaseSeeder instead of being reconstructed on each rerun. The heavy
+# libraries (torch via the encoder backend, qdrant_client) are imported on first
+# use rather than at module import, so the app can paint before they load.
+
+load_dotenv()
+
+ENCODER_MODEL_NAME = DEFAULT_MODEL_NAME
+
+
+def _current_rss_mb() -> float:
+    """Return the resident set size of this process in MB"""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # Not on Linux - fall back to peak RSS (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if peak > 10 ** 9 else peak / 1024
+
+
+class RuntimeRegistry:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._encoder = None
+        self._qdrant_client = None
+        self._vector_stores: Dict[str, Any] = {}
+        self._stats: Dict[str, Any] = {
+            "created_at": time.time(),
+            "encoder_backend": None,
+            "encoder_load_seconds": None,
+            "encoder_rss_delta_mb": None,
+            "qdrant_init_seconds": None,
+            "qdrant_mode": None,
+            "encoder_requests": 0,
+            "qdrant_requests": 0,
+        }
+
+    def get_encoder(self) -> Encoder:
+        """Return the shared sentence encoder (backend from ENCODER_BACKEND), loading it on first use"""
+        with self._lock:
+            self._stats["encoder_requests"] += 1
+            if self._encoder is None:
+                rss_before = _current_rss_mb()
+                start = time.perf_counter()
+                backend = os.getenv("ENCODER_BACKEND", "torch").lower()
+                self._encoder = create_encoder(backend, ENCODER_MODEL_NAME)
+                self._stats["encoder_backend"] = backend
+                self._stats["encoder_load_seconds"] = time.perf_counter() - start
+                self._stats["encoder_rss_delta_mb"] = _current_rss_mb() - rss_before
+                print(f"Loaded encoder {ENCODER_MODEL_NAME} ({backend}) in {self._stats['encoder_load_seconds']:.2f}s "
+                      f"(+{self._stats['encoder_rss_delta_mb']:.0f} MB RSS)")
+
+                # Serve repeated texts from the on-disk embedding cache shared by all workers
+                if os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() in ("1", "true", "yes"):
+                    from embedding_cache import CachedEncoder
+                    self._encoder = CachedEncoder(self._encoder, f"{ENCODER_MODEL_NAME}@{backend}")
+            return self._encoder
+
+    def get_qdrant_client(self) -> "QdrantClient":
+        """Return the shared Qdrant client, connecting on first use"""
+        with self._lock:
+            self._stats["qdrant_requests"] += 1
+            if self._qdrant_client is None:
+                qdrant_url = os.getenv("QDRANT_URL")
+                qdrant_api_key = os.getenv("QDRANT_API_KEY")
+                start = time.perf_counter()
+                from qdrant_client import QdrantClient
+
+                qdrant_path = os.getenv("QDRANT_PATH")
+                if qdrant_url:
+                    self._qdrant_client = QdrantClient(url=qdrant_url, api_key=qdrant_api_key)
+                    self._stats["qdrant_mode"] = "remote"
+                elif qdrant_path and qdrant_path != ":memory:":
+                    # Embedded Qdrant persisted on disk, so the knowledge base survives restarts.
+                    # The directory is locked by one process at a time.
+                    os.makedirs(qdrant_path, exist_ok=True)
+                    self._qdrant_client = QdrantClient(path=qdrant_path)
+                    self._stats["qdrant_mode"] = "local"
+                else:
+                    # Use local Qdrant instance
+                    self._qdrant_client = QdrantClient(":memory:")
+                    self._stats["qdrant_mode"] = "memory"
+                self._stats["qdrant_init_seconds"] = time.perf_counter() - start
+            return self._qdrant_client
+
+    def get_qdrant_mode(self, client: Any = None) -> Optional[str]:
+        """How the shared Qdrant client connects: "remote", "local" (embedded, on disk) or "memory" (embedded).
+        
+        None before it connects, or for a client that was not created here.
+        """
+        with self._lock:
+            if client is None or client is self._qdrant_client:
+                return self._stats["qdrant_mode"]
+            return None
+
+    def get_vector_store(self, collection_name: str = "story_knowledge_base", index_fields: Optional[Sequence[str]] = None):
+        """Return the shared VectorStore for a collection so seeding and retrieval see the same data"""
+        # Imported here because vector_store depends on this module
+        from vector_store import VectorStore, PARTITION_FIELDS
+
+        with self._lock:
+            if collection_name not in self._vector_stores:
+                store = VectorStore(
+                    collection_name,
+                    encoder=self.get_encoder(),
+                    client=self.get_qdrant_client(),
+                    index_fields=index_fields if index_fields is not None else PARTITION_FIELDS,
+                )
+                self._preload(store)
+                self._vector_stores[collection_name] = store
+            return self._vector_stores[collection_name]
+    
+    def _preload(self, store):
+        """Load a prebuilt corpus for the store's collection from QDRANT_PRELOAD_DIR, if there is one"""
+        preload_dir = os.getenv("QDRANT_PRELOAD_DIR")
+        path = os.path.join(preload_dir, f"{store.collection_name}.jsonl.gz") if preload_dir else None
+        if not path or not os.path.exists(path):
+            return
+        start = time.perf_counter()
+        added = store.import_snapshot(path)
+        seconds = time.perf_counter() - start
+        self._stats.setdefault("qdrant_preload", {})[store.collection_name] = {"points_added": added, "seconds": seconds}
+        print(f"Preloaded {added} new points into {store.collection_name} from {path} in {seconds:.2f}s")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return load timings, request counters and current memory usage"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["encoder_loaded"] = self._encoder is not None
+        stats["qdrant_connected"] = self._qdrant_client is not None
+        stats["vector_stores"] = sorted(self._vector_stores)
+        if hasattr(self._encoder, "stats"):
+            stats["embedding_cache"] = self._encoder.stats()
+        stats["rss_mb"] = _current_rss_mb()
+        stats["uptime_seconds"] = time.time() - stats["created_at"]
+        return stats
+
+
+_registry: Optional[RuntimeRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_runtime() -> RuntimeRegistry:
+    """Return the process-wide runtime registry"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = RuntimeRegistry()
+    return _registry
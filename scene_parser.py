@@ -0,0 +1,211 @@
+import re
+import json
+from typing import Dict, List, Optional
+
+# Single-pass parser for scene completions. Scenes are requested as a JSON object
+# with "narrative", "explanation" and "image_prompt" strings, but the parser also
+# accepts the older NARRATIVE: / EXPLANATION: / IMAGE_PROMPT: sections in any
+# order. Text is fed in as it streams, each character is looked at once, and the
+# narrative so far can be read at any point for live previews.
+
+SCENE_FIELDS = ("narrative", "explanation", "image_prompt")
+
+# Section markers, tolerating markdown bold and "IMAGE PROMPT" spelled with a space
+MARKER_PATTERN = re.compile(r"\**[ \t]*(NARRATIVE|EXPLANATION|IMAGE[ _]PROMPT)[ \t]*\**[ \t]*:[ \t]*\**")
+# Longest text a marker can span, held back between feeds in case a marker is split across chunks
+MARKER_HOLDBACK = 24
+
+JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class SceneStreamParser:
+    """Incrementally extracts scene fields from a JSON object or marker-delimited completion"""
+
+    def __init__(self):
+        self.parts: Dict[str, List[str]] = {field: [] for field in SCENE_FIELDS}
+        self.format: Optional[str] = None
+        self._lead = ""
+        # Marker format
+        self._pending = ""
+        self._section: Optional[str] = None
+        # JSON format
+        self._state = "object"
+        self._key: List[str] = []
+        self._field: Optional[str] = None
+        self._depth = 0
+        self._unicode = ""
+        # A \uD800-\uDBFF escape waiting for the low surrogate that completes the character
+        self._high_surrogate: Optional[int] = None
+
+    def feed(self, text: str):
+        if self.format is None:
+            text = self._detect_format(text)
+            if self.format is None:
+                return
+        if self.format == "json":
+            self._feed_json(text)
+        else:
+            self._feed_markers(text, final=False)
+
+    def close(self) -> Dict[str, str]:
+        """Finish parsing and return the fields (missing ones are empty strings)"""
+        if self.format is None and self._lead.strip():
+            # Too short to tell - treat it as marker text
+            self.format = "markers"
+            self._pending, self._lead = self._lead, ""
+        if self.format == "markers":
+            self._feed_markers("", final=True)
+        return self.result()
+
+    def value(self, field: str) -> str:
+        return "".join(self.parts[field]).strip().strip("*").strip()
+
+    def result(self) -> Dict[str, str]:
+        return {field: self.value(field) for field in SCENE_FIELDS}
+
+    def missing(self) -> List[str]:
+        """Fields that are empty, or were cut off mid-string by a truncated JSON completion"""
+        cut_off = self._field if self.format == "json" and self._state in ("string", "escape", "unicode") else None
+        return [field for field in SCENE_FIELDS if not self.value(field) or field == cut_off]
+
+    def _detect_format(self, text: str) -> str:
+        """Buffer leading text until the first meaningful character shows the format; returns the unconsumed text"""
+        self._lead += text
+        stripped = self._lead.lstrip()
+        if stripped.startswith("```"):
+            # Skip a ```json code fence
+            if "\n" not in stripped:
+                return ""
+            stripped = stripped.split("\n", 1)[1].lstrip()
+        if not stripped:
+            return ""
+        self.format = "json" if stripped[0] == "{" else "markers"
+        self._lead = ""
+        return stripped
+
+    def _feed_markers(self, text: str, final: bool):
+        buffer = self._pending + text
+        position = 0
+        for match in MARKER_PATTERN.finditer(buffer):
+            if self._section:
+                self.parts[self._section].append(buffer[position:match.start()])
+            self._section = match.group(1).lower().replace(" ", "_")
+            position = match.end()
+        # Keep a tail that might be the start of a marker split across feeds
+        keep_from = len(buffer) if final else max(position, len(buffer) - MARKER_HOLDBACK)
+        if self._section:
+            self.parts[self._section].append(buffer[position:keep_from])
+        self._pending = buffer[keep_from:]
+
+    def _append(self, text: str):
+        """Add decoded text to the current field; an unpaired high surrogate becomes U+FFFD"""
+        if self._high_surrogate is not None:
+            self._high_surrogate = None
+            if self._field:
+                self.parts[self._field].append("\ufffd")
+        if self._field and text:
+            self.parts[self._field].append(text)
+
+    def _append_code_point(self, code: int):
+        """Decode one \\uXXXX escape, joining UTF-16 surrogate pairs such as \\ud83d\\ude00 into one character"""
+        if 0xDC00 <= code <= 0xDFFF:
+            if self._high_surrogate is not None:
+                high, self._high_surrogate = self._high_surrogate, None
+                self._append(chr(0x10000 + ((high - 0xD800) << 10) + (code - 0xDC00)))
+            else:
+                self._append("\ufffd")
+        elif 0xD800 <= code <= 0xDBFF:
+            self._append("")
+            self._high_surrogate = code
+        else:
+            self._append(chr(code))
+
+    def _feed_json(self, text: str):
+        for char in text:
+            state = self._state
+            if state == "string":
+                if char == "\\":
+                    self._state = "escape"
+                elif char == '"':
+                    self._append("")
+                    self._state = "object"
+                else:
+                    self._append(char)
+            elif state == "escape":
+                if char == "u":
+                    self._state, self._unicode = "unicode", ""
+                else:
+                    self._append(JSON_ESCAPES.get(char, char))
+                    self._state = "string"
+            elif state == "unicode":
+                self._unicode += char
+                if len(self._unicode) == 4:
+                    try:
+                        self._append_code_point(int(self._unicode, 16))
+                    except ValueError:
+                        self._append("\ufffd")
+                    self._state = "string"
+            elif state == "object":
+                if char == '"':
+                    self._state, self._key = "key", []
+                elif char == "}":
+                    self._state = "done"
+            elif state == "key":
+                if char == '"':
+                    self._state = "colon"
+                else:
+                    self._key.append(char)
+            elif state == "colon":
+                if char == ":":
+                    self._state = "value"
+            elif state == "value":
+                if char == '"':
+                    key = "".join(self._key).strip().lower().replace(" ", "_")
+                    self._field = key if key in self.parts else None
+                    self._state = "string"
+                elif char in "{[":
+                    self._state, self._depth = "nested", 1
+                elif not char.isspace():
+                    # A number, boolean or null we have no use for
+                    self._state = "scalar"
+            elif state == "nested":
+                # Skip a nested value, including any strings inside it
+                if char == '"':
+                    self._state = "nested_string"
+                elif char in "{[":
+                    self._depth += 1
+                elif char in "}]":
+                    self._depth -= 1
+                    if not self._depth:
+                        self._state = "object"
+            elif state == "nested_string":
+                if char == "\\":
+                    self._state = "nested_escape"
+                elif char == '"':
+                    self._state = "nested"
+            elif state == "nested_escape":
+                self._state = "nested_string"
+            elif state == "scalar":
+                if char == ",":
+                    self._state = "object"
+                elif char == "}":
+                    self._state = "done"
+
+
+def parse_scene_text(text: str) -> SceneStreamParser:
+    """Parse a complete scene completion; read the fields with result() and the gaps with missing()"""
+    parser = SceneStreamParser()
+    parser.feed(text)
+    parser.close()
+    return parser
+
+
+def parse_repair_response(text: str) -> Dict[str, str]:
+    """Read the fields returned by a repair call, ignoring anything that is not a non-empty string"""
+    try:
+        data = json.loads(text)
+    except (TypeError, json.JSONDecodeError):
+        return parse_scene_text(text or "").result()
+    if not isinstance(data, dict):
+        return {}
+    return {field: data[field].strip() for field in SCENE_FIELDS if isinstance(data.get(field), str) and data[field].strip()}
@@ -0,0 +1,338 @@
+import os
+import time
+import random
+import itertools
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+import openai
+from telemetry import get_telemetry, usage_value
+
+# Central scheduler for every OpenAI request. Requests wait in one priority
+# queue (text ahead of images) for a concurrency slot and for their model's
+# request/token budget, and failed requests are retried here with jittered
+# exponential backoff, honouring Retry-After on 429s.
+
+load_dotenv()
+
+# Retries are handled by the scheduler, not inside the client
+openai.max_retries = 0
+
+PRIORITY_TEXT = 0
+PRIORITY_IMAGE = 1
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_MAX_RETRIES = 5
+# Completion tokens assumed for a chat request before its usage is known
+DEFAULT_COMPLETION_ESTIMATE = 1000
+
+RETRYABLE_STATUS = (408, 409, 429, 500, 502, 503, 504)
+
+
+def parse_rate_limits(spec: str) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+    """Parse "gpt-4o=500:30000,dall-e-3=5" into {model: (requests per minute, tokens per minute)}"""
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, values = entry.partition("=")
+        rpm, _, tpm = values.partition(":")
+        limits[model.strip()] = (float(rpm) if rpm else None, float(tpm) if tpm else None)
+    return limits
+
+
+def estimate_chat_tokens(messages: List[Dict[str, str]], max_tokens: Optional[int] = None) -> int:
+    """Rough prompt plus completion token count (about four characters per token)"""
+    prompt_tokens = sum(len(message.get("content") or "") for message in messages) // 4
+    return prompt_tokens + (max_tokens or DEFAULT_COMPLETION_ESTIMATE)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read the server's requested wait from a failed response, if it sent one"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS
+
+
+class TokenBucket:
+    """Refills `per_minute` units evenly over a minute, holding at most a minute's worth"""
+
+    def __init__(self, per_minute: float, clock: Callable[[], float] = time.monotonic):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = clock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # A request bigger than the bucket goes through once the bucket is full
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self.tokens -= amount
+
+
+class ModelLimiter:
+    """Request and token budgets for one model, plus a pause after the server rate-limits us"""
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.requests = TokenBucket(rpm, clock) if rpm else None
+        self.tokens = TokenBucket(tpm, clock) if tpm else None
+        self.paused_until = 0.0
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        waits = [self.paused_until - now]
+        if self.requests:
+            waits.append(self.requests.wait_time(1, now))
+        if self.tokens and tokens:
+            waits.append(self.tokens.wait_time(tokens, now))
+        return max(0.0, *waits)
+
+    def take(self, tokens: int):
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens and tokens:
+            self.tokens.take(tokens)
+
+    def correct_tokens(self, delta: int):
+        """Charge (or refund) the difference between estimated and actual token usage"""
+        if self.tokens and delta:
+            self.tokens.take(delta)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+
+class ScheduledStream:
+    """A streamed response that keeps its scheduler slot until it is exhausted or closed.
+
+    Usage from the final chunk (sent with stream_options include_usage) is passed to on_close,
+    so the model's token budget can be corrected once the stream is done.
+    """
+
+    def __init__(self, stream: Any, on_close: Callable[[Any], None]):
+        self._stream = stream
+        self._on_close = on_close
+        self._usage = None
+        self._closed = False
+        self._close_lock = threading.Lock()
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                usage = getattr(chunk, "usage", None)
+                if usage is not None:
+                    self._usage = usage
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+        try:
+            if hasattr(self._stream, "close"):
+                self._stream.close()
+        finally:
+            self._on_close(self._usage)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        # A stream that was dropped without being read must not hold its slot forever
+        if not getattr(self, "_closed", True):
+            self.close()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+
+class RequestScheduler:
+    """Admits OpenAI requests by priority within per-model rate limits and retries transient failures"""
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None, max_concurrency: Optional[int] = None,
+                 max_retries: Optional[int] = None, base_delay: float = 1.0, max_delay: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.limits = limits if limits is not None else parse_rate_limits(os.getenv("OPENAI_RATE_LIMITS", ""))
+        self.max_concurrency = max_concurrency if max_concurrency is not None else int(os.getenv("OPENAI_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("OPENAI_MAX_RETRIES", DEFAULT_MAX_RETRIES))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Injectable so tests can step through budgets and backoff without waiting
+        self.clock = clock
+        self.sleep = sleep
+
+        self._cond = threading.Condition()
+        self._limiters: Dict[str, ModelLimiter] = {}
+        self._waiting: List[Dict[str, Any]] = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._stats = {"requests": 0, "retries": 0, "failures": 0, "queue_wait_seconds": 0.0, "max_queue_depth": 0}
+
+    def _limiter(self, model: str) -> ModelLimiter:
+        # _cond's lock is reentrant, so this is safe from inside _dispatch too
+        with self._cond:
+            if model not in self._limiters:
+                self._limiters[model] = ModelLimiter(*self.limits.get(model, (None, None)), clock=self.clock)
+            return self._limiters[model]
+
+    def _dispatch(self) -> Optional[float]:
+        """Admit waiting requests in priority order; returns how long until a blocked one could go"""
+        now = self.clock()
+        next_wait = None
+        admitted = False
+        for ticket in sorted(self._waiting, key=lambda t: (t["priority"], t["sequence"])):
+            if self._in_flight >= self.max_concurrency:
+                break
+            limiter = self._limiter(ticket["model"])
+            wait = limiter.wait_time(ticket["tokens"], now)
+            if wait > 0:
+                next_wait = wait if next_wait is None else min(next_wait, wait)
+                continue
+            limiter.take(ticket["tokens"])
+            ticket["admitted"] = True
+            self._waiting.remove(ticket)
+            self._in_flight += 1
+            admitted = True
+        if admitted:
+            self._cond.notify_all()
+        return next_wait
+
+    def _acquire(self, model: str, priority: int, tokens: int):
+        with self._cond:
+            ticket = {"model": model, "priority": priority, "tokens": tokens, "sequence": next(self._sequence), "admitted": False}
+            self._waiting.append(ticket)
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], len(self._waiting))
+            while not ticket["admitted"]:
+                wait = self._dispatch()
+                if not ticket["admitted"]:
+                    self._cond.wait(timeout=wait)
+
+    def _release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _finish(self, limiter: ModelLimiter, estimated_tokens: int, usage: Any):
+        """Correct the token charge from the response's usage and free the request's slot"""
+        try:
+            if usage is not None and estimated_tokens:
+                with self._cond:
+                    limiter.correct_tokens((usage_value(usage, "total_tokens", 0) or 0) - estimated_tokens)
+        finally:
+            self._release()
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Full-jitter exponential backoff, never shorter than the server's Retry-After"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, self.base_delay / 2)
+        return delay
+
+    def call(self, operation: str, fn: Callable, model: str, priority: int = PRIORITY_TEXT, estimated_tokens: int = 0, **request) -> Any:
+        """Run fn(model=model, **request) once the scheduler admits it, retrying transient failures"""
+        telemetry = get_telemetry()
+        limiter = self._limiter(model)
+        for attempt in itertools.count():
+            queued = time.perf_counter()
+            self._acquire(model, priority, estimated_tokens)
+            waited = time.perf_counter() - queued
+            telemetry.observe("openai_queue_wait_seconds", waited, operation=operation)
+            with self._cond:
+                self._stats["requests"] += 1
+                self._stats["queue_wait_seconds"] += waited
+
+            release = True
+            try:
+                response = fn(model=model, **request)
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    with self._cond:
+                        self._stats["failures"] += 1
+                    raise
+                retry_after = retry_after_seconds(e)
+                delay = self.backoff_delay(attempt, retry_after)
+                if getattr(e, "status_code", None) == 429:
+                    # Hold back every request for this model, not just this one
+                    with self._cond:
+                        limiter.pause(delay)
+                with self._cond:
+                    self._stats["retries"] += 1
+                telemetry.record_retry(operation)
+                print(f"Retrying {operation} in {delay:.1f}s after {type(e).__name__} (attempt {attempt + 1}/{self.max_retries})")
+            else:
+                release = False
+                if request.get("stream"):
+                    # The request is still running until the last chunk arrives, so the stream keeps the slot
+                    return ScheduledStream(response, lambda usage: self._finish(limiter, estimated_tokens, usage))
+                self._finish(limiter, estimated_tokens, getattr(response, "usage", None))
+                return response
+            finally:
+                if release:
+                    self._release()
+            self.sleep(delay)
+
+    def chat_completion(self, operation: str, model: str, messages: List[Dict[str, str]], priority: int = PRIORITY_TEXT, **kwargs) -> Any:
+        """Scheduled openai.chat.completions.create.
+
+        Streams are retried only until the stream opens, and hold their concurrency slot until
+        they are read to the end or closed.
+        """
+        return self.call(operation, openai.chat.completions.create, model, priority,
+                         estimate_chat_tokens(messages, kwargs.get("max_tokens")), messages=messages, **kwargs)
+
+    def image_generation(self, operation: str, model: str, prompt: str, priority: int = PRIORITY_IMAGE, **kwargs) -> Any:
+        """Scheduled openai.images.generate"""
+        return self.call(operation, openai.images.generate, model, priority, 0, prompt=prompt, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queue_depth"] = len(self._waiting)
+            stats["in_flight"] = self._in_flight
+            stats["paused_models"] = sorted(model for model, limiter in self._limiters.items() if limiter.paused_until > self.clock())
+        return stats
+
+
+_scheduler: Optional[RequestScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    """Return the process-wide request scheduler"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = RequestScheduler()
+    return _scheduler
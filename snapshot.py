@@ -0,0 +1,91 @@
+"""Export and import knowledge base snapshots.
+
+A snapshot is a gzipped JSONL file of every point in a collection (ID, vector
+and payload), readable by any Qdrant deployment: embedded in memory, embedded on
+disk (QDRANT_PATH) or a server (QDRANT_URL). Put one in QDRANT_PRELOAD_DIR as
+<collection>.jsonl.gz and it is loaded when the app, API or batch CLI first
+opens that collection, so a new instance starts with a seeded knowledge base.
+
+Build a prebuilt corpus by seeding the topics in a request file (same format as
+cli.py) and exporting the result:
+
+    python snapshot.py export --seed requests.jsonl --output corpus/story_knowledge_base.jsonl.gz
+    python snapshot.py import corpus/story_knowledge_base.jsonl.gz
+
+Collections written before chunks were tagged with the knowledge prompt version
+hold chunks retrieval no longer returns; delete them (and chunks of earlier
+versions) once with:
+
+    python snapshot.py prune
+"""
+import os
+import sys
+import time
+import argparse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_COLLECTION = "story_knowledge_base"
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Export or import a knowledge base snapshot")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Write the collection to a snapshot file")
+    export.add_argument("--collection", default=DEFAULT_COLLECTION)
+    export.add_argument("--output", default=None, help="Snapshot path (default <collection>.jsonl.gz)")
+    export.add_argument("--seed", default=None, help="JSONL request file whose topics are seeded before exporting")
+
+    restore = commands.add_parser("import", help="Load a snapshot file into the collection")
+    restore.add_argument("path")
+    restore.add_argument("--collection", default=DEFAULT_COLLECTION)
+
+    prune = commands.add_parser("prune", help="Delete chunks not tagged with the current knowledge prompt version")
+    prune.add_argument("--collection", default=DEFAULT_COLLECTION)
+    return parser.parse_args(argv)
+
+
+def seed_requests(path: str):
+    """Seed the knowledge base for every distinct topic in a request file"""
+    from cli import load_requests
+    from knowledge_base import KnowledgeBaseSeeder
+
+    seeder = KnowledgeBaseSeeder()
+    seen = set()
+    for request in load_requests(path, "sequential"):
+        full_topic = f"{request['topic']} - {request['specific_area']}" if request["specific_area"] else request["topic"]
+        key = (request["subject"], full_topic, request["grade"], request["curriculum"])
+        if key not in seen:
+            seen.add(key)
+            seeder.seed_knowledge_base(*key)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    from runtime import get_runtime
+
+    if args.command == "export" and args.seed:
+        seed_requests(args.seed)
+    store = get_runtime().get_vector_store(args.collection)
+
+    start = time.perf_counter()
+    if args.command == "export":
+        output = args.output or f"{args.collection}.jsonl.gz"
+        if os.path.dirname(output):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+        count = store.export_snapshot(output)
+        print(f"Exported {count} points from {args.collection} to {output} in {time.perf_counter() - start:.2f}s")
+    elif args.command == "prune":
+        from knowledge_base import KnowledgeBaseSeeder
+        KnowledgeBaseSeeder(store).prune_outdated_chunks()
+        print(f"{store.count()} points left in {args.collection}")
+    else:
+        added = store.import_snapshot(args.path)
+        print(f"Imported {added} new points into {args.collection} ({store.count()} total) in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,429 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Callable, Iterator
+from dotenv import load_dotenv
+from telemetry import get_telemetry
+
+load_dotenv()
+
+DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 1000
+# How long a generation lock is held before other workers assume its owner died.
+# Locks record their owner's host and pid, so a lock left by a dead process on
+# this host is broken straight away instead of waiting this long.
+DEFAULT_LOCK_SECONDS = 15 * 60
+
+
+def pid_alive(pid: Optional[int]) -> bool:
+    """Whether a process with this pid exists on this host"""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def lock_owner_dead(token: str) -> bool:
+    """Whether a "host:pid:nonce" lock token belongs to a process on this host that has exited"""
+    parts = token.split(":")
+    if len(parts) != 3 or parts[0] != socket.gethostname() or not parts[1].isdigit():
+        # Another host's lock (or an old token format) can only expire
+        return False
+    return not pid_alive(int(parts[1]))
+
+
+def normalize_story_request(curriculum: str, subject: str, topic: str, specific_area: Optional[str], grade: str, mode: str, model: str, prompt_version: str) -> Dict[str, str]:
+    """Normalize the fields that determine a story so equivalent requests share a cache entry"""
+    def clean(value: Optional[str]) -> str:
+        return re.sub(r"\s+", " ", (value or "").strip()).casefold()
+
+    return {
+        "curriculum": clean(curriculum),
+        "subject": clean(subject),
+        "topic": clean(topic),
+        "specific_area": clean(specific_area),
+        "grade": clean(grade),
+        "mode": clean(mode),
+        "model": model,
+        "prompt_version": prompt_version,
+    }
+
+
+def make_story_key(curriculum: str, subject: str, topic: str, specific_area: Optional[str], grade: str, mode: str, model: str, prompt_version: str) -> str:
+    """Build the cache key for a story request"""
+    normalized = normalize_story_request(curriculum, subject, topic, specific_area, grade, mode, model, prompt_version)
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def story_download_name(curriculum: str, subject: str, topic: str, specific_area: Optional[str], grade: str) -> str:
+    """File name for a downloaded or exported story"""
+    filename = f"{curriculum}_{subject}_{topic}"
+    if specific_area:
+        filename += f"_{specific_area}"
+    filename += f"_{grade}_story.json"
+    # Keep subjects like "AC/DC circuits" from turning into directories
+    return filename.replace("/", "-").replace(os.sep, "-")
+
+
+class SQLiteStoryBackend:
+    """Stores stories in a local SQLite file shared by every process on the host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stories (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, last_accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_stories_last_accessed ON stories (last_accessed)")
+            conn.execute("CREATE TABLE IF NOT EXISTS story_locks (key TEXT PRIMARY KEY, token TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key: str, ttl_seconds: int) -> Optional[str]:
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, created_at FROM stories WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if ttl_seconds and now - row[1] > ttl_seconds:
+                conn.execute("DELETE FROM stories WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE stories SET last_accessed = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: str, ttl_seconds: int, max_entries: int):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO stories (key, value, created_at, last_accessed) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            if ttl_seconds:
+                conn.execute("DELETE FROM stories WHERE created_at < ?", (now - ttl_seconds,))
+            if max_entries:
+                conn.execute(
+                    "DELETE FROM stories WHERE key IN (SELECT key FROM stories ORDER BY last_accessed DESC LIMIT -1 OFFSET ?)",
+                    (max_entries,)
+                )
+
+    def delete(self, key: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM stories WHERE key = ?", (key,))
+
+    def try_lock(self, key: str, token: str, lock_seconds: int) -> bool:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM story_locks WHERE key = ? AND expires_at < ?", (key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO story_locks (key, token, expires_at) VALUES (?, ?, ?)",
+                (key, token, now + lock_seconds)
+            )
+            return cursor.rowcount == 1
+
+    def unlock(self, key: str, token: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM story_locks WHERE key = ? AND token = ?", (key, token))
+
+    def lock_token(self, key: str) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT token FROM story_locks WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def count(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM stories").fetchone()[0]
+
+
+class FileSystemStoryBackend:
+    """Stores each story as a JSON file; file mtime tracks last access for LRU eviction"""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def _lock_path(self, key: str) -> str:
+        return os.path.join(self.root, "locks", f"{key}.lock")
+
+    def _entries(self) -> Iterator[str]:
+        for directory, _, files in os.walk(self.root):
+            if os.path.basename(directory) == "locks":
+                continue
+            for name in files:
+                if name.endswith(".json"):
+                    yield os.path.join(directory, name)
+
+    def get(self, key: str, ttl_seconds: int) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if ttl_seconds and time.time() - record["created_at"] > ttl_seconds:
+            self.delete(key)
+            return None
+        os.utime(path)
+        return record["value"]
+
+    def set(self, key: str, value: str, ttl_seconds: int, max_entries: int):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a partial file
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"created_at": time.time(), "value": value}, f)
+        os.replace(tmp_path, path)
+        self._evict(ttl_seconds, max_entries)
+
+    def _evict(self, ttl_seconds: int, max_entries: int):
+        now = time.time()
+        entries = []
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            # ctime is close enough to creation time for files that are only written once
+            if ttl_seconds and now - stat.st_ctime > ttl_seconds:
+                self._remove(path)
+            else:
+                entries.append((stat.st_mtime, path))
+        if max_entries and len(entries) > max_entries:
+            entries.sort(reverse=True)
+            for _, path in entries[max_entries:]:
+                self._remove(path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def delete(self, key: str):
+        self._remove(self._path(key))
+
+    def try_lock(self, key: str, token: str, lock_seconds: int) -> bool:
+        path = self._lock_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        now = time.time()
+        # The lock file's mtime holds its expiry, so the holder's lock_seconds applies rather than the waiter's
+        try:
+            if now > os.stat(path).st_mtime:
+                self._remove(path)
+        except OSError:
+            pass
+        # Written in full first, then linked into place, which fails if another holder got there first
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(token)
+        os.utime(tmp_path, (now + lock_seconds, now + lock_seconds))
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            return False
+        finally:
+            self._remove(tmp_path)
+        return True
+
+    def unlock(self, key: str, token: str):
+        path = self._lock_path(key)
+        try:
+            with open(path) as f:
+                if f.read() != token:
+                    return
+        except OSError:
+            return
+        self._remove(path)
+
+    def lock_token(self, key: str) -> Optional[str]:
+        try:
+            with open(self._lock_path(key)) as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def count(self) -> int:
+        return sum(1 for _ in self._entries())
+
+
+class RedisStoryBackend:
+    """Stores stories in Redis so several hosts share one cache.
+
+    Any client exposing the redis-py get/set/delete/zadd/zcard/zrange/zrem/eval
+    methods works, so a local stand-in can replace a real server in tests.
+    """
+
+    UNLOCK_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    def __init__(self, client: Any = None, url: Optional[str] = None, prefix: str = "story_cache:"):
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise ImportError("The redis story cache backend requires the 'redis' package (pip install redis)") from e
+            client = redis.Redis.from_url(url or os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+        self.client = client
+        self.prefix = prefix
+        self.index_key = f"{prefix}index"
+
+    def get(self, key: str, ttl_seconds: int) -> Optional[str]:
+        value = self.client.get(f"{self.prefix}{key}")
+        if value is None:
+            self.client.zrem(self.index_key, key)
+            return None
+        self.client.zadd(self.index_key, {key: time.time()})
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def set(self, key: str, value: str, ttl_seconds: int, max_entries: int):
+        self.client.set(f"{self.prefix}{key}", value, ex=ttl_seconds or None)
+        self.client.zadd(self.index_key, {key: time.time()})
+        if max_entries:
+            overflow = self.client.zcard(self.index_key) - max_entries
+            if overflow > 0:
+                for old_key in self.client.zrange(self.index_key, 0, overflow - 1):
+                    old_key = old_key.decode("utf-8") if isinstance(old_key, bytes) else old_key
+                    self.delete(old_key)
+
+    def delete(self, key: str):
+        self.client.delete(f"{self.prefix}{key}")
+        self.client.zrem(self.index_key, key)
+
+    def try_lock(self, key: str, token: str, lock_seconds: int) -> bool:
+        return bool(self.client.set(f"{self.prefix}lock:{key}", token, nx=True, ex=lock_seconds))
+
+    def unlock(self, key: str, token: str):
+        self.client.eval(self.UNLOCK_SCRIPT, 1, f"{self.prefix}lock:{key}", token)
+
+    def lock_token(self, key: str) -> Optional[str]:
+        value = self.client.get(f"{self.prefix}lock:{key}")
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def count(self) -> int:
+        return self.client.zcard(self.index_key)
+
+
+class StoryCache:
+    """Shared cache of finished stories with TTL/size eviction and single-flight generation"""
+
+    def __init__(self, backend: Any, ttl_seconds: int = DEFAULT_TTL_SECONDS, max_entries: int = DEFAULT_MAX_ENTRIES, lock_seconds: int = DEFAULT_LOCK_SECONDS, poll_interval: float = 0.5):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lock_seconds = lock_seconds
+        self.poll_interval = poll_interval
+        # key -> [lock, number of callers holding or waiting for it]; removed when the count drops to zero
+        self._local_locks: Dict[str, List[Any]] = {}
+        self._local_locks_guard = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached story for a key, or None"""
+        value = self.backend.get(key, self.ttl_seconds)
+        get_telemetry().record_cache("story", value is not None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    def put(self, key: str, story: Dict[str, Any]):
+        """Store a finished story"""
+        self.backend.set(key, json.dumps(story), self.ttl_seconds, self.max_entries)
+
+    def delete(self, key: str):
+        self.backend.delete(key)
+
+    @contextmanager
+    def single_flight(self, key: str):
+        """Hold the generation lock for a key.
+
+        Threads in this process queue on a local lock, and other processes on the
+        backend lock, so only one caller generates a given story at a time. Callers
+        should check the cache again once inside, since the previous holder has
+        usually just stored the story.
+        """
+        with self._local_locks_guard:
+            entry = self._local_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+
+        try:
+            with entry[0]:
+                token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+                while not self.backend.try_lock(key, token, self.lock_seconds):
+                    held_by = self.backend.lock_token(key)
+                    if held_by and lock_owner_dead(held_by):
+                        # Left behind by a crashed process; unlock only removes that exact token
+                        print(f"Breaking story lock {key[:12]} held by exited process {held_by.split(':')[1]}")
+                        self.backend.unlock(key, held_by)
+                        continue
+                    time.sleep(self.poll_interval)
+                try:
+                    yield
+                finally:
+                    self.backend.unlock(key, token)
+        finally:
+            with self._local_locks_guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._local_locks[key]
+
+    def get_or_create(self, key: str, factory: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Return the cached story, generating it once with factory() if missing"""
+        story = self.get(key)
+        if story is not None:
+            return story
+        with self.single_flight(key):
+            story = self.get(key)
+            if story is None:
+                story = factory()
+                self.put(key, story)
+        return story
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": self.backend.count(),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def create_story_cache() -> StoryCache:
+    """Build the story cache configured by STORY_CACHE_BACKEND (sqlite, filesystem or redis)"""
+    backend_name = os.getenv("STORY_CACHE_BACKEND", "sqlite").lower()
+    if backend_name == "redis":
+        backend = RedisStoryBackend(url=os.getenv("REDIS_URL"))
+    elif backend_name == "filesystem":
+        backend = FileSystemStoryBackend(os.getenv("STORY_CACHE_PATH", os.path.join(".cache", "stories")))
+    elif backend_name == "sqlite":
+        backend = SQLiteStoryBackend(os.getenv("STORY_CACHE_PATH", os.path.join(".cache", "stories.sqlite3")))
+    else:
+        raise ValueError(f"Unknown STORY_CACHE_BACKEND {backend_name!r}, expected sqlite, filesystem or redis")
+
+    return StoryCache(
+        backend,
+        ttl_seconds=int(os.getenv("STORY_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+        max_entries=int(os.getenv("STORY_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+    )
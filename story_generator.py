@@ -1,8 +1,19 @@
 import os
-from typing import List, Dict, Any, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Dict, Any, Optional, Iterator, Tuple
 from dotenv import load_dotenv
 import openai
 from vector_store import VectorStore
+from retrieval import ContextRetriever, partition_filter
+from runtime import get_runtime
+from image_store import ImageStore
+from image_cache import SemanticImageCache
+from telemetry import COST_BUCKETS, COUNT_BUCKETS, get_telemetry, submit_in_context
+from scheduler import get_scheduler
+from prompt_templates import image_style as grade_image_style, outline_messages, scene_messages, scene_repair_messages
+from scene_parser import SceneStreamParser, parse_scene_text, parse_repair_response
+from outline_analyzer import OutlineAnalyzer, parse_outline, scene_description
 
 # Updated image generation to create simple, high-clarity images without any text elements
 # Uses HD quality setting for better resolution and clean visual presentation
@@ -10,228 +21,77 @@ from vector_store import VectorStore
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+# Bump whenever the outline or scene prompts change so cached stories from the old prompts are not reused
+STORY_PROMPT_VERSION = "4"
+# Chat model for outlines and scenes; also part of the story cache key
+LLM_MODEL = "gpt-4o"
+# Image model for scene illustrations
+IMAGE_MODEL = "dall-e-3"
+# Cheaper model that fills in fields missing from a malformed scene response
+SCENE_REPAIR_MODEL = os.getenv("SCENE_REPAIR_MODEL", "gpt-4o-mini")
+# Completion budget per repaired field
+REPAIR_MAX_TOKENS = {"narrative": 900, "explanation": 400, "image_prompt": 200}
+
+# "sequential" writes each scene after the previous one; "fast" writes every scene at once from the outline
+GENERATION_MODES = ("sequential", "fast")
+
 class StoryGenerator:
-    def __init__(self):
-        self.vector_store = VectorStore()
-        self.llm_model = "gpt-4o"
+    def __init__(self, vector_store: Optional[VectorStore] = None, image_store: Optional[ImageStore] = None, image_cache: Optional[SemanticImageCache] = None, outline_analyzer: Optional[OutlineAnalyzer] = None, retriever: Optional[ContextRetriever] = None):
+        # Share one store with the seeder/generator so retrieval sees seeded knowledge
+        self.vector_store = vector_store if vector_store is not None else get_runtime().get_vector_store()
+        self.image_store = image_store if image_store is not None else ImageStore()
+        self.image_cache = image_cache if image_cache is not None else SemanticImageCache()
+        self.outline_analyzer = outline_analyzer if outline_analyzer is not None else OutlineAnalyzer()
+        # Filters, deduplicates and budgets the background chunks that go into scene prompts
+        self.retriever = retriever if retriever is not None else ContextRetriever(self.vector_store)
+        self.llm_model = LLM_MODEL
+        self.repair_model = SCENE_REPAIR_MODEL
         
-        # Detailed grade level vocabulary and complexity guidelines for each specific grade
-        self.grade_guidelines = {
-            # Pre-K and Kindergarten
-            "pre_k": {
-                "vocabulary": "very simple words (around 500-1000 word vocabulary), primarily concrete nouns and basic verbs",
-                "sentence_structure": "very short, simple sentences (3-5 words), present tense, active voice",
-                "narrative_style": "highly repetitive, concrete concepts only, strong visual support needed, focus on familiar objects and experiences",
-                "explanation_depth": "extremely basic concepts with immediate relevance to child's experience, heavy use of visual analogies",
-                "image_style": "bright, simple illustrations with minimal details, bold colors, exaggerated features, friendly characters"
-            },
-            "kindergarten": {
-                "vocabulary": "simple, everyday words (around 2000-3000 word vocabulary), concrete nouns and basic action verbs",
-                "sentence_structure": "short, simple sentences (5-7 words), mainly present tense, active voice",
-                "narrative_style": "repetitive patterns, familiar settings, concrete concepts, character-focused stories with clear emotions",
-                "explanation_depth": "very basic concepts connected to daily experiences, simple cause-and-effect relationships",
-                "image_style": "colorful, engaging illustrations with some details, friendly characters, clear action sequences"
-            },
-            
-            # Elementary School (Grades 1-5)
-            "grade_1": {
-                "vocabulary": "familiar, everyday words with gradual introduction of new terms (around 4000-5000 word vocabulary)",
-                "sentence_structure": "simple sentences (5-8 words) with occasional compound sentences, primarily present tense",
-                "narrative_style": "simple storylines with clear beginning-middle-end, familiar settings, concrete problems and solutions",
-                "explanation_depth": "basic concepts with real-world examples from child's experience, simple step-by-step explanations",
-                "image_style": "colorful illustrations with increased detail, clear expressions on characters, visual support for new concepts"
-            },
-            "grade_2": {
-                "vocabulary": "expanding vocabulary (around 5000-6000 words) with new terms defined in context",
-                "sentence_structure": "a mix of simple and compound sentences (7-10 words), introduction to past tense",
-                "narrative_style": "sequential stories with minor conflicts and resolutions, introduction to character motivation",
-                "explanation_depth": "concrete explanations with familiar analogies, beginning to connect related concepts",
-                "image_style": "detailed illustrations that support text comprehension, visual representations of processes or sequences"
-            },
-            "grade_3": {
-                "vocabulary": "broader vocabulary (6000-9000 words) with subject-specific terms defined clearly",
-                "sentence_structure": "varied sentence types and lengths (8-12 words), introduction to paragraphing",
-                "narrative_style": "more developed plots with multiple events, character development, introduction to different perspectives",
-                "explanation_depth": "expanded explanations with cause and effect, beginning to connect to broader concepts",
-                "image_style": "detailed illustrations with multiple elements, diagrams introduced to explain processes, realistic depictions"
-            },
-            "grade_4": {
-                "vocabulary": "rich vocabulary (9000-11000 words) with academic terms, figurative language introduced",
-                "sentence_structure": "complex and compound sentences (10-14 words), varied paragraph structures",
-                "narrative_style": "multi-faceted plots, character development with internal motivations, introduction to themes",
-                "explanation_depth": "detailed explanations with multiple examples, beginning to explore abstract concepts",
-                "image_style": "detailed, accurate illustrations, introduction of charts and diagrams, visual metaphors"
-            },
-            "grade_5": {
-                "vocabulary": "sophisticated vocabulary (11000-14000 words) with technical terms and figurative language",
-                "sentence_structure": "varied sentence structures (12-15 words), well-developed paragraphs with supporting details",
-                "narrative_style": "layered plots with subplots, nuanced character development, exploration of themes",
-                "explanation_depth": "in-depth explanations connecting to prior knowledge, introduction to theoretical concepts",
-                "image_style": "detailed illustrations with scientific accuracy, labeled diagrams, visual analogies for complex concepts"
-            },
-            
-            # Middle School (Grades 6-8)
-            "grade_6": {
-                "vocabulary": "advanced vocabulary (14000-17000 words) with domain-specific terminology and abstract concepts",
-                "sentence_structure": "complex sentence structures (12-18 words), variety of transition words, well-organized paragraphs",
-                "narrative_style": "developed plots with complications, character growth and change, exploration of themes and messages",
-                "explanation_depth": "comprehensive explanations with real-world applications, connections between concepts",
-                "image_style": "detailed educational illustrations, more sophisticated diagrams, visual representations of complex relationships"
-            },
-            "grade_7": {
-                "vocabulary": "extensive vocabulary (17000-19000 words) with specialized terminology and figurative expressions",
-                "sentence_structure": "sophisticated sentence patterns (15-20 words), argument structures, varied paragraph organization",
-                "narrative_style": "complex plots with conflict development, deeper character psychology, multiple themes",
-                "explanation_depth": "detailed analysis with examples and counterexamples, exploration of underlying principles",
-                "image_style": "scientifically accurate illustrations, detailed cross-sections, process diagrams, comparative visuals"
-            },
-            "grade_8": {
-                "vocabulary": "sophisticated vocabulary (19000-21000 words) with abstract terminology and nuanced meanings",
-                "sentence_structure": "varied, complex sentences (15-22 words), well-structured arguments, cohesive paragraphs",
-                "narrative_style": "multi-layered plots, complex character motivations and relationships, thematic depth",
-                "explanation_depth": "in-depth explanations with theoretical frameworks, connections to broader systems",
-                "image_style": "detailed technical illustrations, complex diagrams with multiple elements, visual analysis of systems"
-            },
-            
-            # High School (Grades 9-12)
-            "grade_9": {
-                "vocabulary": "advanced academic vocabulary (21000-23000 words) with specialized terminology",
-                "sentence_structure": "sophisticated syntax (18-25 words), rhetorical devices, logical organization of complex ideas",
-                "narrative_style": "exploration of complex issues, character development showing internal conflicts, thematic analysis",
-                "explanation_depth": "detailed analysis with theoretical models, introduction to competing perspectives",
-                "image_style": "professional-quality diagrams, models showing interactions between systems, analytical visuals"
-            },
-            "grade_10": {
-                "vocabulary": "extensive academic vocabulary (23000-25000 words) with discipline-specific terminology",
-                "sentence_structure": "complex syntactic structures (20-25 words), sophisticated transitions, logical development of arguments",
-                "narrative_style": "multifaceted plots with subtle development, psychological depth in characters, thematic complexity",
-                "explanation_depth": "sophisticated analysis with theoretical foundations, exploration of implications and applications",
-                "image_style": "detailed scientific or technical visuals, complex systems diagrams, conceptual models with multiple layers"
-            },
-            "grade_11": {
-                "vocabulary": "college-preparatory vocabulary (25000-27000 words) with specialized academic language",
-                "sentence_structure": "varied, sophisticated syntax (20-30 words), nuanced argumentation, cohesive extended discourse",
-                "narrative_style": "complex, multi-layered narratives, deep character analysis, sophisticated thematic development",
-                "explanation_depth": "comprehensive analysis with theoretical frameworks, evaluation of different approaches",
-                "image_style": "sophisticated visual representations of complex concepts, detailed analytical diagrams, visual models with annotations"
-            },
-            "grade_12": {
-                "vocabulary": "college-level vocabulary (27000+ words) with field-specific terminology and academic discourse",
-                "sentence_structure": "highly sophisticated syntax (20-35 words), complex argumentation, cohesive extended prose",
-                "narrative_style": "nuanced narratives examining complex human experiences, sophisticated thematic exploration",
-                "explanation_depth": "in-depth analysis with theoretical frameworks, critical evaluation of concepts and applications",
-                "image_style": "college-level visual representations, complex models with detailed annotations, sophisticated visual analysis"
-            },
-            
-            # College and Adult
-            "college_freshman": {
-                "vocabulary": "sophisticated academic vocabulary with field-specific terminology and theoretical concepts",
-                "sentence_structure": "complex academic prose with varied rhetorical structures, logical argumentation",
-                "narrative_style": "sophisticated exploration of complex ideas and human experiences, multiple layers of meaning",
-                "explanation_depth": "rigorous analysis with theoretical frameworks, critical evaluation of concepts and methodologies",
-                "image_style": "professional-grade visuals with precise detail, complex conceptual models, analytical diagrams with detailed annotations"
-            },
-            "college_sophomore": {
-                "vocabulary": "advanced academic and discipline-specific vocabulary with theoretical terminology",
-                "sentence_structure": "sophisticated academic discourse with complex logical structures and arguments",
-                "narrative_style": "nuanced exploration of complex ideas with multiple perspectives and theoretical foundations",
-                "explanation_depth": "detailed analysis with theoretical frameworks, critical evaluation and application of concepts",
-                "image_style": "sophisticated visualizations with detailed technical elements, complex systems models, professional-level diagrams"
-            },
-            "college_junior": {
-                "vocabulary": "specialized academic vocabulary with theoretical terminology specific to major fields",
-                "sentence_structure": "advanced academic prose with discipline-specific conventions and argumentative structures",
-                "narrative_style": "sophisticated exploration of complex ideas with integration of theoretical perspectives",
-                "explanation_depth": "in-depth analysis with theoretical foundations, critical evaluation of competing frameworks",
-                "image_style": "professional visualizations with field-specific conventions, complex analytical models, research-quality diagrams"
-            },
-            "college_senior": {
-                "vocabulary": "specialized academic and professional vocabulary with advanced theoretical terminology",
-                "sentence_structure": "sophisticated academic and professional discourse with field-specific conventions",
-                "narrative_style": "complex exploration of ideas with integration of multiple theoretical perspectives",
-                "explanation_depth": "comprehensive analysis with advanced theoretical frameworks, critical synthesis of concepts",
-                "image_style": "professional-grade visualizations meeting field standards, complex analytical models, research-quality visuals"
-            },
-            "graduate": {
-                "vocabulary": "highly specialized academic and professional vocabulary with advanced theoretical terminology",
-                "sentence_structure": "sophisticated academic discourse with field-specific conventions and advanced argumentation",
-                "narrative_style": "complex exploration of ideas with critical analysis of theoretical perspectives",
-                "explanation_depth": "advanced analysis with sophisticated theoretical frameworks, original synthesis of concepts",
-                "image_style": "publication-quality visualizations, complex theoretical models, research-level analytical diagrams"
-            },
-            "adult": {
-                "vocabulary": "sophisticated vocabulary with domain-specific terminology appropriate for educated adults",
-                "sentence_structure": "varied and complex structures appropriate for educated adult readers",
-                "narrative_style": "mature themes with nuanced exploration of complex ideas",
-                "explanation_depth": "comprehensive explanations with diverse perspectives and critical analysis",
-                "image_style": "refined, detailed visualizations that capture complex relationships and subtle nuances"
-            },
-            
-            # Default fallback to middle school level
-            "default": {
-                "vocabulary": "expanded vocabulary with new terms clearly defined within context",
-                "sentence_structure": "mix of simple and compound sentences with some complexity",
-                "narrative_style": "engaging stories with some nuance and character development",
-                "explanation_depth": "moderate depth with connections to familiar concepts and practical examples",
-                "image_style": "detailed illustrations that balance educational content with engaging visuals"
-            }
-        }
+        # Shared pool that caps concurrent DALL-E requests across every story this generator serves
+        self.image_concurrency = int(os.getenv("IMAGE_CONCURRENCY", "3"))
+        self.image_executor = ThreadPoolExecutor(max_workers=self.image_concurrency, thread_name_prefix="image")
+        
+        # Same for scene text in fast mode, where all scenes of a story are requested together
+        self.text_concurrency = int(os.getenv("TEXT_CONCURRENCY", "4"))
+        self.text_executor = ThreadPoolExecutor(max_workers=self.text_concurrency, thread_name_prefix="scene")
+    
+    def retrieval_query(self, subject: str, topic: str, scene_description: str) -> str:
+        """Build the vector store query for a scene"""
+        return f"{subject} {topic} {scene_description}"
+    
+    def prefetch_related_info(self, subject: str, topic: str, grade: str, curriculum: str, scenes_descriptions: List[str]) -> List[List[Dict[str, Any]]]:
+        """Retrieve background chunks for every scene of an outline in one batched search"""
+        queries = [self.retrieval_query(subject, topic, scene_desc) for scene_desc in scenes_descriptions]
+        with get_telemetry().span("retrieval", queries=len(queries)) as span:
+            related = self.retriever.retrieve_batch(queries, filters=partition_filter(subject, topic, grade, curriculum))
+            span.set("results", sum(len(results) for results in related))
+        return related
+    
+    def image_style(self, grade: str) -> str:
+        """Return the illustration style for a grade level"""
+        return grade_image_style(grade)
     
     def generate_story_outline(self, subject: str, topic: str, grade: str = "grade_6", curriculum: str = "General") -> str:
         """Generate a story outline based on the subject and topic appropriate for the grade level and curriculum"""
-        # Get grade-specific guidelines without fallback to default
-        guidelines = self.grade_guidelines.get(grade, {})
-        
-        # Use values directly if they exist, otherwise use sensible defaults
-        vocabulary = guidelines.get("vocabulary", f"appropriate for {grade} level")
-        sentence_structure = guidelines.get("sentence_structure", f"suitable for {grade} level")
-        narrative_style = guidelines.get("narrative_style", f"engaging for {grade} level")
-        explanation_depth = guidelines.get("explanation_depth", f"appropriate for {grade} level")
-        
-        prompt = f"""
-        Create a detailed story outline about {subject} focusing on {topic}, tailored for {grade} level students following the {curriculum} curriculum.
-        
-        Please follow these grade-appropriate guidelines:
-        - Vocabulary: {vocabulary}
-        - Sentence structure: {sentence_structure}
-        - Narrative style: {narrative_style}
-        - Explanation depth: {explanation_depth}
-
-        The outline should include:
-        1. A clear introduction to the subject
-        2. Key scenes or chapters that will explore different aspects of the topic
-        3. A logical flow between scenes
-        4. A conclusion that summarizes the key learnings
-        
-        Ensure the content aligns with {curriculum} curriculum standards for {grade} level.
-        Format the outline with clear scene divisions.
-        """
-        
-        response = openai.chat.completions.create(
-            model=self.llm_model,
-            messages=[
-                {"role": "system", "content": "You are a creative storyteller who creates educational and engaging stories tailored to specific grade levels."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-        )
+        with get_telemetry().span("outline", grade=grade) as span:
+            response = get_scheduler().chat_completion(
+                "outline",
+                model=self.llm_model,
+                messages=outline_messages(subject, topic, grade, curriculum, self.outline_analyzer.min_scenes, self.outline_analyzer.max_scenes),
+                temperature=0.7,
+                response_format={"type": "json_object"},
+            )
+            span.record_usage(response, self.llm_model)
         
         return response.choices[0].message.content
     
-    def generate_scene(self, subject: str, topic: str, scene_description: str, grade: str = "grade_6", previous_scenes: Optional[List[Dict[str, Any]]] = None, curriculum: str = "General") -> Dict[str, Any]:
-        """Generate a single scene with narrative text and image prompt appropriate for the grade level and curriculum"""
-        # Get grade-specific guidelines without fallback
-        guidelines = self.grade_guidelines.get(grade, {})
-        
-        # Use values directly if they exist, otherwise use sensible defaults
-        vocabulary = guidelines.get("vocabulary", f"appropriate for {grade} level")
-        sentence_structure = guidelines.get("sentence_structure", f"suitable for {grade} level")
-        narrative_style = guidelines.get("narrative_style", f"engaging for {grade} level")
-        explanation_depth = guidelines.get("explanation_depth", f"appropriate for {grade} level")
-        image_style = guidelines.get("image_style", f"visuals appropriate for {grade} level")
-        
-        # Get relevant information from vector store if available
-        related_info = self.vector_store.search(f"{subject} {topic} {scene_description}", limit=3)
+    def _build_scene_messages(self, subject: str, topic: str, scene_description: str, grade: str, previous_scenes: Optional[List[Dict[str, Any]]], curriculum: str, outline_context: Optional[str], related_info: Optional[List[Dict[str, Any]]] = None) -> Tuple[List[Dict[str, str]], str]:
+        """Build the chat messages for a scene and return them with the grade's image style"""
+        # Get relevant information from vector store if available, unless it was prefetched for the whole story
+        if related_info is None:
+            with get_telemetry().span("retrieval") as span:
+                related_info = self.retriever.retrieve(self.retrieval_query(subject, topic, scene_description), filters=partition_filter(subject, topic, grade, curriculum))
+                span.set("results", len(related_info))
         related_info_text = "\n".join([item["text"] for item in related_info]) if related_info else ""
         
         # Context from previous scenes
@@ -241,198 +101,351 @@ class StoryGenerator:
                 f"Scene {i+1}: {scene['narrative'][:200]}..." 
                 for i, scene in enumerate(previous_scenes)
             ])
+        elif outline_context:
+            previous_context = outline_context
         
-        prompt = f"""
-        Create a detailed scene for a story about {subject} focusing on {topic}, tailored for {grade} level students following the {curriculum} curriculum.
-        
-        Please follow these grade-appropriate guidelines:
-        - Vocabulary: {vocabulary}
-        - Sentence structure: {sentence_structure}
-        - Narrative style: {narrative_style}
-        - Explanation depth: {explanation_depth}
+        # The static instructions come first (system prompt) and the parts that change most come last,
+        # so scenes and stories for the same grade and curriculum share a cacheable prompt prefix
+        messages = scene_messages(subject, topic, grade, curriculum, scene_description, previous_context, related_info_text)
         
-        Scene description: {scene_description}
-        
-        {previous_context}
+        return messages, self.image_style(grade)
+    
+    def generate_scene(self, subject: str, topic: str, scene_description: str, grade: str = "grade_6", previous_scenes: Optional[List[Dict[str, Any]]] = None, curriculum: str = "General", outline_context: Optional[str] = None, related_info: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """Generate a single scene with narrative text and image prompt appropriate for the grade level and curriculum.
         
-        Related background information:
-        {related_info_text}
+        The scene is conditioned on previous_scenes (sequential mode) or on outline_context (fast mode).
+        related_info skips the vector store lookup when background chunks were already retrieved.
+        """
+        return self._write_scene(subject, topic, scene_description, grade, previous_scenes, curriculum, outline_context, related_info)[0]
+    
+    def _write_scene(self, subject: str, topic: str, scene_description: str, grade: str, previous_scenes: Optional[List[Dict[str, Any]]], curriculum: str, outline_context: Optional[str], related_info: Optional[List[Dict[str, Any]]]) -> Tuple[Dict[str, Any], int]:
+        """generate_scene, also returning how many completions were wasted on it"""
+        messages, image_style = self._build_scene_messages(subject, topic, scene_description, grade, previous_scenes, curriculum, outline_context, related_info)
         
-        For this scene, provide:
-        1. A narrative text (300-500 words) that is engaging, educational, and explains concepts clearly at a {grade} level
-        2. An explanatory section that elaborates on the key concepts or facts presented in this scene, appropriate for {grade} level students
-        3. An image prompt that describes what should be visualized for this scene (detailed description for image generation) with a style appropriate for {grade} level: {image_style}
+        with get_telemetry().span("scene", streamed=False) as span:
+            response = get_scheduler().chat_completion(
+                "scene",
+                model=self.llm_model,
+                messages=messages,
+                temperature=0.7,
+                response_format={"type": "json_object"},
+            )
+            span.record_usage(response, self.llm_model)
         
-        For the image prompt, follow these guidelines:
-        - Keep text in the image to an absolute minimum (3-5 words maximum)
-        - Any text should be simple labels or short titles only
-        - Don't request decorative or stylized text
-        - Be specific about what content should be visualized rather than focusing on text elements
+        result = response.choices[0].message.content or ""
         
-        Ensure the content aligns with {curriculum} curriculum standards for {grade} level.
+        return self._finish_scene(parse_scene_text(result), result, subject, topic, scene_description, image_style)
+    
+    def stream_scene(self, subject: str, topic: str, scene_description: str, grade: str = "grade_6", previous_scenes: Optional[List[Dict[str, Any]]] = None, curriculum: str = "General", outline_context: Optional[str] = None, related_info: Optional[List[Dict[str, Any]]] = None) -> Iterator[Dict[str, Any]]:
+        """Like generate_scene, but stream the completion.
         
-        Format your response as:
-        NARRATIVE: [narrative text]
-        EXPLANATION: [explanatory text]
-        IMAGE_PROMPT: [detailed image prompt]
+        Yields {"type": "delta", "text": ...} for each token chunk, then {"type": "scene", "scene": ..., "wasted": int} once parsed.
         """
+        messages, image_style = self._build_scene_messages(subject, topic, scene_description, grade, previous_scenes, curriculum, outline_context, related_info)
+        started = time.perf_counter()
         
-        response = openai.chat.completions.create(
-            model=self.llm_model,
-            messages=[
-                {"role": "system", "content": f"You are a creative storyteller who creates educational and engaging stories with vivid descriptions tailored for {grade} level students."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-        )
+        # Parse while the text streams in, so the completion is only read once
+        parser = SceneStreamParser()
+        parts = []
+        with get_telemetry().span("scene", streamed=True) as span:
+            stream = get_scheduler().chat_completion(
+                "scene",
+                model=self.llm_model,
+                messages=messages,
+                temperature=0.7,
+                stream=True,
+                response_format={"type": "json_object"},
+                # Ask for a final usage chunk so streamed scenes report (cached) token counts too
+                extra_body={"stream_options": {"include_usage": True}},
+            )
+            
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    span.record_usage(chunk, self.llm_model)
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if not parts:
+                        span.set("first_token_seconds", time.perf_counter() - started)
+                    parts.append(delta)
+                    parser.feed(delta)
+                    yield {"type": "delta", "text": delta}
+            span.set("chunks", len(parts))
         
-        result = response.choices[0].message.content
+        parser.close()
+        scene, wasted = self._finish_scene(parser, "".join(parts), subject, topic, scene_description, image_style)
+        yield {"type": "scene", "scene": scene, "wasted": wasted}
+    
+    def _finish_scene(self, parser: SceneStreamParser, draft: str, subject: str, topic: str, scene_description: str, image_style: str) -> Tuple[Dict[str, Any], int]:
+        """Build the scene from a parsed completion, filling any missing or cut-off fields with a repair call.
         
-        # Parse the response - Fixed parsing to handle multi-line sections
-        narrative = ""
-        explanation = ""
-        image_prompt = ""
+        Returns the scene and the number of completions whose output could not be used.
+        """
+        telemetry = get_telemetry()
+        scene = parser.result()
+        missing = parser.missing()
+        wasted = 0
         
-        # Split into sections by markers
-        if "NARRATIVE:" in result and "EXPLANATION:" in result and "IMAGE_PROMPT:" in result:
-            # Get positions of each marker
-            narrative_pos = result.find("NARRATIVE:")
-            explanation_pos = result.find("EXPLANATION:")
-            image_prompt_pos = result.find("IMAGE_PROMPT:")
-            
-            # Extract sections based on their positions
-            if narrative_pos < explanation_pos < image_prompt_pos:
-                narrative = result[narrative_pos + len("NARRATIVE:"):explanation_pos].strip()
-                explanation = result[explanation_pos + len("EXPLANATION:"):image_prompt_pos].strip()
-                image_prompt = result[image_prompt_pos + len("IMAGE_PROMPT:"):].strip()
-            elif narrative_pos < image_prompt_pos < explanation_pos:
-                narrative = result[narrative_pos + len("NARRATIVE:"):image_prompt_pos].strip()
-                image_prompt = result[image_prompt_pos + len("IMAGE_PROMPT:"):explanation_pos].strip()
-                explanation = result[explanation_pos + len("EXPLANATION:"):].strip()
-            elif explanation_pos < narrative_pos < image_prompt_pos:
-                explanation = result[explanation_pos + len("EXPLANATION:"):narrative_pos].strip()
-                narrative = result[narrative_pos + len("NARRATIVE:"):image_prompt_pos].strip()
-                image_prompt = result[image_prompt_pos + len("IMAGE_PROMPT:"):].strip()
-            # Add other possible orderings as needed
-        else:
-            # Fallback to the original line-by-line parsing method
-            sections = result.split("\n")
-            current_section = None
-            
-            for section in sections:
-                if section.startswith("NARRATIVE:"):
-                    current_section = "narrative"
-                    narrative = section.replace("NARRATIVE:", "").strip()
-                elif section.startswith("EXPLANATION:"):
-                    current_section = "explanation"
-                    explanation = section.replace("EXPLANATION:", "").strip()
-                elif section.startswith("IMAGE_PROMPT:"):
-                    current_section = "image_prompt"
-                    image_prompt = section.replace("IMAGE_PROMPT:", "").strip()
-                elif current_section == "narrative" and section:
-                    narrative += "\n" + section
-                elif current_section == "explanation" and section:
-                    explanation += "\n" + section
-                elif current_section == "image_prompt" and section:
-                    image_prompt += "\n" + section
+        if missing:
+            telemetry.increment("scene_parse_failures_total", format=parser.format or "empty")
+            print(f"Scene response is missing {', '.join(missing)} - requesting a repair")
+            if len(missing) == len(scene):
+                # Nothing in the completion was usable
+                wasted += 1
+            repaired = self.repair_scene(scene_description, draft, missing)
+            scene.update(repaired)
+            if len(repaired) == len(missing):
+                telemetry.increment("scene_repairs_total", result="repaired")
+            else:
+                telemetry.increment("scene_repairs_total", result="failed" if not repaired else "partial")
+                if not repaired:
+                    wasted += 1
+        
+        if wasted:
+            telemetry.increment("scene_completions_wasted_total", wasted)
         
         # If image prompt is still empty, generate a default one
-        if not image_prompt:
-            image_prompt = f"A {image_style} depicting {subject} focusing on {topic}, specifically {scene_description[:100]}"
+        if not scene["image_prompt"]:
+            scene["image_prompt"] = f"A {image_style} depicting {subject} focusing on {topic}, specifically {scene_description[:100]}"
         
-        return {
-            "narrative": narrative,
-            "explanation": explanation,
-            "image_prompt": image_prompt
-        }
+        return scene, wasted
+    
+    def repair_scene(self, scene_description: str, draft: str, missing: List[str]) -> Dict[str, str]:
+        """Ask the cheaper repair model for just the missing scene fields; returns the ones it supplied"""
+        with get_telemetry().span("scene_repair", missing=",".join(missing)) as span:
+            try:
+                response = get_scheduler().chat_completion(
+                    "scene_repair",
+                    model=self.repair_model,
+                    messages=scene_repair_messages(scene_description, draft, missing),
+                    temperature=0,
+                    max_tokens=sum(REPAIR_MAX_TOKENS[field] for field in missing),
+                    response_format={"type": "json_object"},
+                )
+            except Exception as e:
+                print(f"Error repairing scene: {e}")
+                span.set("error", repr(e))
+                return {}
+            span.record_usage(response, self.repair_model)
+        
+        repaired = parse_repair_response(response.choices[0].message.content)
+        return {field: repaired[field] for field in missing if repaired.get(field)}
     
     def generate_image(self, prompt: str) -> str:
-        """Generate an image based on the prompt using OpenAI's DALL-E"""
-        try:
-            # Add a safety check to ensure prompt is not empty
-            if not prompt or len(prompt.strip()) == 0:
-                default_prompt = "An educational illustration with a blank canvas, representing a missing image prompt."
-                print(f"Warning: Empty image prompt detected. Using default prompt instead.")
-                prompt = default_prompt
-            
-            # Add specific instructions for text clarity
-            text_clarity_instructions = """
-            IMPORTANT INSTRUCTIONS FOR TEXT RENDERING:
-            - Any text in the image must be crystal clear, large, and easily readable
-            - Use a clear, bold font with high contrast against the background
-            - Avoid stylized or decorative text that might be difficult to read
-            - Maintain adequate spacing between letters and words
-            - Keep text simple and minimal - only include essential labels or titles
-            - Position text in uncluttered areas of the image
-            - Text should be perfectly horizontal (not curved, angled, or distorted)
-            """
-            
-            enhanced_prompt = f"{text_clarity_instructions}\n\n{prompt}"
-            
-            response = openai.images.generate(
-                model="dall-e-3",
+        """Generate an image based on the prompt using OpenAI's DALL-E.
+        
+        Rate limits and transient errors are retried by the scheduler; anything that still fails is raised.
+        """
+        # Add a safety check to ensure prompt is not empty
+        if not prompt or len(prompt.strip()) == 0:
+            default_prompt = "An educational illustration with a blank canvas, representing a missing image prompt."
+            print(f"Warning: Empty image prompt detected. Using default prompt instead.")
+            prompt = default_prompt
+        
+        # Add specific instructions for text clarity
+        text_clarity_instructions = """
+        IMPORTANT INSTRUCTIONS FOR TEXT RENDERING:
+        - Any text in the image must be crystal clear, large, and easily readable
+        - Use a clear, bold font with high contrast against the background
+        - Avoid stylized or decorative text that might be difficult to read
+        - Maintain adequate spacing between letters and words
+        - Keep text simple and minimal - only include essential labels or titles
+        - Position text in uncluttered areas of the image
+        - Text should be perfectly horizontal (not curved, angled, or distorted)
+        """
+        
+        enhanced_prompt = f"{text_clarity_instructions}\n\n{prompt}"
+        
+        with get_telemetry().span("image", model=IMAGE_MODEL):
+            # Queued behind scene text, which readers are waiting on
+            response = get_scheduler().image_generation(
+                "image",
+                model=IMAGE_MODEL,
                 prompt=enhanced_prompt,
                 size="1024x1024",
                 quality="standard",
                 n=1,
             )
+        
+        return response.data[0].url
+    
+    def illustrate_scene(self, prompt: str, image_style: str) -> Dict[str, Optional[str]]:
+        """Get an image for a scene, reusing a stored one for a near-identical prompt in the same style.
+        
+        New images are kept locally, since DALL-E URLs expire.
+        """
+        with get_telemetry().span("illustrate") as span:
+            cached = self.image_cache.lookup(prompt, image_style)
+            span.set("cache_hit", cached is not None)
+            if cached is not None:
+                print(f"Reusing cached image (similarity {cached['score']:.3f})")
+                return {"image_url": cached["image_url"], "image_path": cached["image_path"]}
             
-            return response.data[0].url
-        except Exception as e:
-            print(f"Error generating image: {e}")
-            return None
+            try:
+                image_url = self.generate_image(prompt)
+            except Exception as e:
+                # Out of retries (or rejected, e.g. by the content filter) - the scene keeps its text
+                print(f"Error generating image: {e}")
+                span.set("error", repr(e))
+                return {"image_url": None, "image_path": None}
+            with get_telemetry().span("image_store"):
+                image_path = self.image_store.save_from_url(image_url) if image_url else None
+            self.image_cache.add(prompt, image_style, image_url, image_path)
+            return {"image_url": image_url, "image_path": image_path}
+    
+    def split_outline(self, outline: str) -> List[str]:
+        """Split an outline (JSON, or text with plain or markdown scene headings) into scene descriptions"""
+        return [scene_description(i, scene) for i, scene in enumerate(parse_outline(outline)["scenes"])]
+    
+    def build_outline_context(self, outline: str, scenes_descriptions: List[str], index: int) -> str:
+        """Describe where a scene sits in the outline so it can be written without the previous scenes' text"""
+        context = f"Full story outline:\n{outline}\n\nThis is scene {index+1} of {len(scenes_descriptions)}."
+        if index > 0:
+            context += f"\n\nThe previous scene covers:\n{scenes_descriptions[index-1]}"
+        if index < len(scenes_descriptions) - 1:
+            context += f"\n\nThe next scene covers:\n{scenes_descriptions[index+1]}"
+        return context
     
-    def generate_complete_story(self, subject: str, topic: str, grade: str = "grade_6", curriculum: str = "General") -> Dict[str, Any]:
+    def generate_complete_story(self, subject: str, topic: str, grade: str = "grade_6", curriculum: str = "General", mode: str = "sequential") -> Dict[str, Any]:
         """Generate a complete story with multiple scenes, each with narrative, explanation, and image appropriate for the grade level and curriculum"""
-        # Generate the story outline
-        outline = self.generate_story_outline(subject, topic, grade, curriculum)
-        
-        # Parse outline to extract scenes
-        scenes_descriptions = []
-        current_scene = ""
-        
-        for line in outline.split("\n"):
-            line = line.strip()
-            if line.startswith("Scene") or line.startswith("Chapter") or line.startswith("Part"):
-                if current_scene:
-                    scenes_descriptions.append(current_scene)
-                current_scene = line
-            elif current_scene and line:
-                current_scene += "\n" + line
+        story = None
+        for event in self.iter_story_events(subject, topic, grade, curriculum, mode, stream_text=False):
+            if event["type"] == "story":
+                story = event["story"]
+        return story
+    
+    def iter_story_events(self, subject: str, topic: str, grade: str = "grade_6", curriculum: str = "General", mode: str = "sequential", stream_text: bool = True) -> Iterator[Dict[str, Any]]:
+        """Generate a complete story, yielding each piece as soon as it is available.
         
-        if current_scene:
-            scenes_descriptions.append(current_scene)
+        Events, in order of arrival:
+        - {"type": "outline", "outline": str, "scene_count": int, "estimate": dict} - estimate is the scenes' projected tokens and cost
+        - {"type": "scene_delta", "index": int, "text": str} - streamed narrative tokens (sequential mode with stream_text)
+        - {"type": "scene", "index": int, "scene": dict, "wasted": int} - parsed scene text and completions wasted on it
+        - {"type": "image", "index": int, "image_url": str or None, "image_path": str or None}
+        - {"type": "story", "story": dict} - the complete story, last
+        """
+        if mode not in GENERATION_MODES:
+            raise ValueError(f"Unknown generation mode {mode!r}, expected one of {GENERATION_MODES}")
         
-        # If no clear scene divisions, create some
-        if not scenes_descriptions:
-            # Split the outline into approximately 3-5 scenes
-            lines = outline.split("\n")
-            chunk_size = max(1, len(lines) // 4)
-            scenes_descriptions = [
-                "\n".join(lines[i:i+chunk_size])
-                for i in range(0, len(lines), chunk_size)
-            ]
+        with get_telemetry().span("story", subject=subject, topic=topic, grade=grade, curriculum=curriculum, mode=mode) as span:
+            # Generate the story outline
+            outline = self.generate_story_outline(subject, topic, grade, curriculum)
+            
+            # Parse the outline into scenes within the configured range, and check the story's
+            # estimated cost against the budget before any scene is written
+            plan = self.outline_analyzer.analyze(outline, grade, curriculum, mode, self.llm_model, IMAGE_MODEL)
+            outline = plan["outline"]
+            scenes_descriptions = plan["scenes"]
+            estimate = plan["estimate"]
+            for adjustment in plan["adjustments"]:
+                print(f"Outline: {adjustment}")
+            print(f"Estimated {estimate['total_tokens']} tokens and ${estimate['cost_usd']:.2f} for {len(scenes_descriptions)} scenes")
+            span.set("scenes", len(scenes_descriptions))
+            span.set("outline_format", plan["format"])
+            span.set("estimated_tokens", estimate["total_tokens"])
+            span.set("estimated_cost_usd", estimate["cost_usd"])
+            get_telemetry().observe("story_estimated_cost_usd", estimate["cost_usd"], buckets=COST_BUCKETS)
+            yield {"type": "outline", "outline": outline, "scene_count": len(scenes_descriptions), "estimate": estimate}
+            
+            # Retrieve background for every scene up front with a single encoder pass
+            related = self.prefetch_related_info(subject, topic, grade, curriculum, scenes_descriptions)
+            
+            scenes = [None] * len(scenes_descriptions)
+            wasted = 0
+            if mode == "fast":
+                events = self._iter_scenes_fast(subject, topic, grade, curriculum, outline, scenes_descriptions, related)
+            else:
+                events = self._iter_scenes_sequential(subject, topic, grade, curriculum, scenes_descriptions, related, stream_text)
+            
+            for event in events:
+                if event["type"] == "scene":
+                    scenes[event["index"]] = event["scene"]
+                    wasted += event["wasted"]
+                elif event["type"] == "image":
+                    scenes[event["index"]]["image_url"] = event["image_url"]
+                    scenes[event["index"]]["image_path"] = event["image_path"]
+                yield event
+            
+            # Completions per story whose output had to be thrown away
+            span.set("wasted_completions", wasted)
+            get_telemetry().observe("story_wasted_completions", wasted, buckets=COUNT_BUCKETS)
         
-        # Generate each scene
+        yield {
+            "type": "story",
+            "story": {
+                "subject": subject,
+                "topic": topic,
+                "grade": grade,
+                "curriculum": curriculum,
+                "mode": mode,
+                "outline": outline,
+                "scenes": scenes
+            }
+        }
+    
+    def _drain_images(self, image_futures: Dict[Any, int], block: bool) -> Iterator[Dict[str, Any]]:
+        """Yield image events for finished image futures, waiting for all of them if block is set"""
+        while image_futures:
+            done, _ = wait(list(image_futures), timeout=None if block else 0, return_when=FIRST_COMPLETED)
+            if not done:
+                return
+            for image_future in done:
+                yield {"type": "image", "index": image_futures.pop(image_future), **image_future.result()}
+    
+    def _iter_scenes_sequential(self, subject: str, topic: str, grade: str, curriculum: str, scenes_descriptions: List[str], related: List[List[Dict[str, Any]]], stream_text: bool) -> Iterator[Dict[str, Any]]:
+        """Write scenes one after another, each conditioned on the ones before it"""
+        # Generate each scene's text in order (each one sees the previous scenes), and hand
+        # its image prompt to the image pool straight away so DALL-E runs while the next
+        # scene's text is being written
         scenes = []
+        image_futures = {}
         for i, scene_desc in enumerate(scenes_descriptions):
             print(f"Generating scene {i+1}/{len(scenes_descriptions)}...")
-            scene = self.generate_scene(subject, topic, scene_desc, grade, scenes, curriculum)
+            if stream_text:
+                for event in self.stream_scene(subject, topic, scene_desc, grade, scenes, curriculum, related_info=related[i]):
+                    if event["type"] == "delta":
+                        yield {"type": "scene_delta", "index": i, "text": event["text"]}
+                    else:
+                        scene, wasted = event["scene"], event["wasted"]
+            else:
+                scene, wasted = self._write_scene(subject, topic, scene_desc, grade, scenes, curriculum, None, related[i])
             
             # Debug print to check the image prompt
             print(f"Image prompt for scene {i+1}: {scene['image_prompt'][:100]}...")
             
-            # Generate image for the scene
-            image_url = self.generate_image(scene["image_prompt"])
-            scene["image_url"] = image_url
+            # Start generating the image for the scene
+            image_futures[submit_in_context(self.image_executor, self.illustrate_scene, scene["image_prompt"], self.image_style(grade))] = i
             
             scenes.append(scene)
+            yield {"type": "scene", "index": i, "scene": scene, "wasted": wasted}
+            
+            # Report images that finished while this scene was being written
+            yield from self._drain_images(image_futures, block=False)
+        
+        # Wait for the outstanding images
+        yield from self._drain_images(image_futures, block=True)
+    
+    def _iter_scenes_fast(self, subject: str, topic: str, grade: str, curriculum: str, outline: str, scenes_descriptions: List[str], related: List[List[Dict[str, Any]]]) -> Iterator[Dict[str, Any]]:
+        """Write all scenes concurrently, each conditioned on the outline and its neighbouring scene descriptions"""
+        print(f"Generating {len(scenes_descriptions)} scenes concurrently from the outline...")
+        text_futures = {
+            submit_in_context(
+                self.text_executor, self._write_scene, subject, topic, scene_desc, grade, None, curriculum,
+                self.build_outline_context(outline, scenes_descriptions, i), related[i]
+            ): i
+            for i, scene_desc in enumerate(scenes_descriptions)
+        }
+        
+        # Start each image as soon as its scene text arrives, reporting whichever finishes first
+        image_futures = {}
+        while text_futures:
+            done, _ = wait(list(text_futures) + list(image_futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in text_futures:
+                    i = text_futures.pop(future)
+                    scene, wasted = future.result()
+                    image_futures[submit_in_context(self.image_executor, self.illustrate_scene, scene["image_prompt"], self.image_style(grade))] = i
+                    yield {"type": "scene", "index": i, "scene": scene, "wasted": wasted}
+                else:
+                    yield {"type": "image", "index": image_futures.pop(future), **future.result()}
         
-        return {
-            "subject": subject,
-            "topic": topic,
-            "grade": grade,
-            "curriculum": curriculum,
-            "outline": outline,
-            "scenes": scenes
-        } 
\ No newline at end of file
+        yield from self._drain_images(image_futures, block=True)
\ No newline at end of file
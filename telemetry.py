@@ -0,0 +1,263 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+from dotenv import load_dotenv
+
+# Span tracing and Prometheus-style metrics for the generation pipeline.
+# Finished spans are aggregated into duration histograms and counters, can be
+# appended to a JSONL trace file (TRACE_FILE) and are served as Prometheus text
+# from a small local HTTP endpoint (METRICS_PORT).
+
+load_dotenv()
+
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# For small whole-number counts such as completions per story
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20)
+# For estimated story costs in USD, around the default STORY_COST_BUDGET_USD of 1.00
+COST_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0)
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+def usage_value(usage: Any, name: str, default: Any = 0) -> Any:
+    """Read a usage field from a typed object or, for fields newer than the client, a plain dict"""
+    value = usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+    return default if value is None else value
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start_time = time.time()
+        self.duration: Optional[float] = None
+        self.status = "ok"
+        self.error: Optional[str] = None
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_usage(self, response: Any, model: Optional[str] = None):
+        """Copy token counts from an OpenAI response's usage block onto the span"""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        self.attributes["model"] = model or getattr(response, "model", None)
+        self.attributes["prompt_tokens"] = usage_value(usage, "prompt_tokens")
+        self.attributes["completion_tokens"] = usage_value(usage, "completion_tokens")
+        details = usage_value(usage, "prompt_tokens_details", None)
+        self.attributes["cached_tokens"] = usage_value(details, "cached_tokens") if details is not None else 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration": self.duration,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class Telemetry:
+    def __init__(self, trace_file: Optional[str] = None):
+        self.trace_file = trace_file if trace_file is not None else os.getenv("TRACE_FILE")
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = defaultdict(float)
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Dict[str, Any]] = {}
+        self._gauges: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._metrics_server = None
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """Time a block of work as a span nested under the current span"""
+        parent = _current_span.get()
+        span = Span(name, parent.trace_id if parent else uuid.uuid4().hex, parent.span_id if parent else None, attributes)
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.error = repr(e)
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # The span was closed from a different context (e.g. an abandoned generator)
+                pass
+            self._finish(span)
+
+    def _finish(self, span: Span):
+        self.observe("story_span_duration_seconds", span.duration, span=span.name)
+        self.increment("story_spans_total", span=span.name, status=span.status)
+
+        model = span.attributes.get("model")
+        if model:
+            for kind in ("prompt", "completion", "cached"):
+                tokens = span.attributes.get(f"{kind}_tokens")
+                if tokens:
+                    self.increment("openai_tokens_total", tokens, model=model, type=kind)
+
+        if self.trace_file:
+            line = json.dumps(span.to_dict(), default=str)
+            with self._lock:
+                with open(self.trace_file, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+
+    def increment(self, name: str, value: float = 1, **labels):
+        """Add to a counter"""
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """Set a gauge to its current value"""
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = DURATION_BUCKETS, **labels):
+        """Record a value in a histogram; buckets are upper bounds, fixed by the first observation of the series"""
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            histogram = self._histograms.setdefault(key, {"bounds": tuple(buckets), "buckets": [0] * len(buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(histogram["bounds"]):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def record_cache(self, cache: str, hit: bool, count: int = 1):
+        if count:
+            self.increment("cache_requests_total", count, cache=cache, result="hit" if hit else "miss")
+
+    def record_retry(self, operation: str):
+        self.increment("openai_retries_total", operation=operation)
+
+    def counter_values(self, name: str) -> Dict[str, float]:
+        """Return a counter's values keyed by their labels, e.g. {"result=repaired": 3}"""
+        with self._lock:
+            return {",".join(f"{k}={v}" for k, v in labels): value for (counter, labels), value in self._counters.items() if counter == name}
+
+    def token_totals(self) -> Dict[str, Dict[str, float]]:
+        """Return prompt, completion and cached token totals per model, with the share of prompt tokens served from cache"""
+        totals: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                if name == "openai_tokens_total":
+                    labels = dict(labels)
+                    totals.setdefault(labels["model"], {"prompt": 0, "completion": 0, "cached": 0})[labels["type"]] += value
+        for model_totals in totals.values():
+            model_totals["cached_ratio"] = model_totals["cached"] / model_totals["prompt"] if model_totals["prompt"] else 0.0
+        return totals
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Return count and mean duration per span name"""
+        with self._lock:
+            return {
+                dict(labels)["span"]: {"count": h["count"], "mean_seconds": h["sum"] / h["count"] if h["count"] else 0.0}
+                for (name, labels), h in self._histograms.items()
+                if name == "story_span_duration_seconds"
+            }
+
+    def render_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+            return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} counter")
+                    seen.add(name)
+                lines.append(f"{name}{label_text(labels)} {value:g}")
+
+            for (name, labels), value in sorted(self._gauges.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} gauge")
+                    seen.add(name)
+                lines.append(f"{name}{label_text(labels)} {value:g}")
+
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} histogram")
+                    seen.add(name)
+                for bound, count in zip(histogram["bounds"], histogram["buckets"]):
+                    lines.append(f"{name}_bucket{label_text(labels, [('le', f'{bound:g}')])} {count}")
+                lines.append(f"{name}_bucket{label_text(labels, [('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{name}_sum{label_text(labels)} {histogram['sum']:.6f}")
+                lines.append(f"{name}_count{label_text(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def start_metrics_server(self, port: Optional[int] = None, host: str = "127.0.0.1") -> Optional[int]:
+        """Serve /metrics on a background thread; returns the bound port (METRICS_PORT if not given)"""
+        if self._metrics_server is not None:
+            return self._metrics_server.server_address[1]
+        if port is None:
+            if not os.getenv("METRICS_PORT"):
+                return None
+            port = int(os.getenv("METRICS_PORT"))
+
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                payload = telemetry.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self._metrics_server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self._metrics_server.daemon_threads = True
+        threading.Thread(target=self._metrics_server.serve_forever, name="metrics", daemon=True).start()
+        return self._metrics_server.server_address[1]
+
+
+def submit_in_context(executor, fn: Callable, *args, **kwargs):
+    """Submit work to an executor so its spans nest under the caller's current span"""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+_telemetry: Optional[Telemetry] = None
+_telemetry_lock = threading.Lock()
+
+
+def get_telemetry() -> Telemetry:
+    """Return the process-wide telemetry instance"""
+    global _telemetry
+    if _telemetry is None:
+        with _telemetry_lock:
+            if _telemetry is None:
+                _telemetry = Telemetry()
+    return _telemetry
@@ -0,0 +1,116 @@
+import multiprocessing
+import os
+import numpy as np
+from embedding_cache import INDEX_RECORD, CachedEncoder, EmbeddingCache
+
+DIMENSION = 8
+
+
+def vector_for(text):
+    """Deterministic embedding, so any row read back can be checked against its text"""
+    seed = int.from_bytes(text.encode("utf-8")[-4:].rjust(4, b"\0"), "little")
+    return np.random.default_rng(seed).standard_normal(DIMENSION).astype(np.float32)
+
+
+class FakeEncoder:
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, sentences, **kwargs):
+        self.encoded.extend(sentences)
+        return np.stack([vector_for(text) for text in sentences])
+
+    def get_sentence_embedding_dimension(self):
+        return DIMENSION
+
+
+def test_cached_encoder_encodes_each_text_once_across_instances(tmp_path):
+    base = FakeEncoder()
+    encoder = CachedEncoder(base, "fake/model", root=str(tmp_path))
+    vectors = encoder.encode(["a", "b", "a"])
+    assert base.encoded == ["a", "b"]
+    assert np.array_equal(vectors, np.stack([vector_for("a"), vector_for("b"), vector_for("a")]))
+    assert np.array_equal(encoder.encode("b"), vector_for("b"))
+
+    # A second process on the host opens the same files and finds what the first wrote
+    other_base = FakeEncoder()
+    other = CachedEncoder(other_base, "fake/model", root=str(tmp_path))
+    assert np.array_equal(other.encode(["b", "c"]), np.stack([vector_for("b"), vector_for("c")]))
+    assert other_base.encoded == ["c"]
+    assert encoder.cache.get_many(["c"])[1] == []
+    assert encoder.stats()["stored"] == 3
+    assert encoder.stats()["hits"] == 1 and encoder.stats()["misses"] == 3
+
+
+def test_vectors_are_memory_mapped_and_grow_with_appends(tmp_path):
+    cache = EmbeddingCache("fake", DIMENSION, root=str(tmp_path))
+    assert cache.put_many(["a", "b"], np.stack([vector_for("a"), vector_for("b")])) == 2
+    assert cache.put_many(["a"], vector_for("a")[None]) == 0
+    assert cache.get_many(["a"])[1] == []
+    assert isinstance(cache._vectors, np.memmap) and len(cache._vectors) == 2
+
+    cache.put_many(["c"], vector_for("c")[None])
+    vectors, missing = cache.get_many(["c", "x"])
+    assert missing == [1]
+    assert np.array_equal(vectors[0], vector_for("c")) and not vectors[1].any()
+    assert len(cache._vectors) == 3
+
+
+def test_partial_writes_are_ignored_and_truncated(tmp_path):
+    cache = EmbeddingCache("fake", DIMENSION, root=str(tmp_path))
+    cache.put_many(["a"], vector_for("a")[None])
+    # A writer that crashed mid-append left half a row and half an index record
+    with open(cache.vectors_path, "ab") as f:
+        f.write(b"\1" * (cache.row_bytes // 2))
+    with open(cache.index_path, "ab") as f:
+        f.write(b"\1" * (INDEX_RECORD.itemsize // 2))
+
+    reopened = EmbeddingCache("fake", DIMENSION, root=str(tmp_path))
+    assert len(reopened) == 1
+    reopened.put_many(["b"], vector_for("b")[None])
+    assert os.path.getsize(cache.index_path) == 2 * INDEX_RECORD.itemsize
+    assert os.path.getsize(cache.vectors_path) == 2 * cache.row_bytes
+    vectors, missing = cache.get_many(["a", "b"])
+    assert missing == []
+    assert np.array_equal(vectors, np.stack([vector_for("a"), vector_for("b")]))
+
+
+def test_writes_stop_at_max_rows(tmp_path):
+    cache = EmbeddingCache("fake", DIMENSION, root=str(tmp_path), max_rows=2)
+    assert cache.put_many(["a", "b"], np.stack([vector_for("a"), vector_for("b")])) == 2
+    assert cache.put_many(["c"], vector_for("c")[None]) == 0
+    assert cache.get_many(["c"])[1] == [0]
+
+
+def append_batches(root, batches, size):
+    cache = EmbeddingCache("fake", DIMENSION, root=root)
+    for batch in range(batches):
+        texts = [f"text {batch * size + i}" for i in range(size)]
+        cache.put_many(texts, np.stack([vector_for(text) for text in texts]))
+
+
+def test_reads_while_other_processes_append(tmp_path):
+    root = str(tmp_path)
+    texts = [f"text {i}" for i in range(400)]
+    reader = EmbeddingCache("fake", DIMENSION, root=root)
+    context = multiprocessing.get_context("fork")
+    writers = [context.Process(target=append_batches, args=(root, 20, 20)) for _ in range(2)]
+    for writer in writers:
+        writer.start()
+    while any(writer.is_alive() for writer in writers):
+        vectors, missing = reader.get_many(texts)
+        missed = set(missing)
+        # Every row seen is complete and belongs to its text; unwritten ones are reported as misses
+        for i, text in enumerate(texts):
+            if i not in missed:
+                assert np.array_equal(vectors[i], vector_for(text))
+    for writer in writers:
+        writer.join()
+        assert writer.exitcode == 0
+
+    vectors, missing = reader.get_many(texts)
+    assert missing == []
+    assert np.array_equal(vectors, np.stack([vector_for(text) for text in texts]))
+    # Both writers appended the same texts, and each was stored once
+    assert len(reader) == 400
+    assert os.path.getsize(reader.vectors_path) == 400 * reader.row_bytes
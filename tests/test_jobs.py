@@ -0,0 +1,122 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import jobs
+from jobs import JobManager
+from story_cache import SQLiteStoryBackend, StoryCache
+
+REQUEST = {"curriculum": "General", "subject": "Physics", "topic": "Atoms", "specific_area": None, "grade": "grade_6", "mode": "fast"}
+# Above the kernel's pid_max, so no process can have it
+DEAD_PID = 2 ** 22 + 1
+
+
+class FakeSeeder:
+    def seed_knowledge_base(self, *args):
+        pass
+
+
+class FakeGenerator:
+    def __init__(self):
+        self.runs = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def iter_story_events(self, subject, topic, grade, curriculum, mode):
+        self.runs += 1
+        self.release.wait(10)
+        yield {"type": "outline", "outline": "outline", "scene_count": 1, "estimate": {"cost_usd": 0.0, "total_tokens": 0}}
+        yield {"type": "scene", "index": 0, "scene": {"narrative": "n", "explanation": "e", "image_prompt": "p"}, "wasted": 0}
+        yield {"type": "story", "story": {"subject": subject, "topic": topic, "scenes": [{"narrative": "n"}]}}
+
+
+def make_manager(tmp_path, generator):
+    return JobManager(story_cache=StoryCache(SQLiteStoryBackend(str(tmp_path / "stories.sqlite3"))),
+                      generator_factory=lambda: generator, seeder_factory=FakeSeeder,
+                      path=str(tmp_path / "jobs.sqlite3"), workers=2)
+
+
+def insert_orphan(tmp_path, owner_pid, owner_token=None):
+    """Leave a running job behind, as a worker process that crashed would"""
+    make_manager(tmp_path, FakeGenerator())
+    now = time.time()
+    with sqlite3.connect(str(tmp_path / "jobs.sqlite3")) as conn:
+        conn.execute(
+            "INSERT INTO jobs (job_id, story_key, request, status, progress, partial, owner_pid, owner_token, created_at, updated_at) "
+            "VALUES ('orphan', ?, ?, 'running', ?, NULL, ?, ?, ?, ?)",
+            (JobManager.story_key(REQUEST), json.dumps(REQUEST), json.dumps({"stage": "scenes"}), owner_pid, owner_token, now, now)
+        )
+
+
+def record_claims(monkeypatch):
+    claims = []
+    recover = JobManager._recover_orphaned_jobs
+
+    def recording(self):
+        claimed = recover(self)
+        claims.extend(claimed)
+        return claimed
+
+    monkeypatch.setattr(JobManager, "_recover_orphaned_jobs", recording)
+    return claims
+
+
+def test_job_of_dead_process_is_resumed(tmp_path):
+    insert_orphan(tmp_path, DEAD_PID)
+    generator = FakeGenerator()
+    manager = make_manager(tmp_path, generator)
+    job = manager.wait("orphan", timeout=10, poll_interval=0.05)
+    assert job["status"] == "succeeded"
+    assert generator.runs == 1
+
+
+def test_restarted_process_with_the_same_pid_resumes_its_jobs(tmp_path):
+    # e.g. a container whose app always runs as PID 1
+    insert_orphan(tmp_path, os.getpid(), "token-of-the-previous-process")
+    manager = make_manager(tmp_path, FakeGenerator())
+    assert manager.wait("orphan", timeout=10, poll_interval=0.05)["status"] == "succeeded"
+
+
+def test_job_of_live_process_is_left_alone(tmp_path, monkeypatch):
+    insert_orphan(tmp_path, os.getppid())
+    claims = record_claims(monkeypatch)
+    manager = make_manager(tmp_path, FakeGenerator())
+    assert claims == []
+    assert manager.get("orphan")["status"] == "running"
+
+
+def test_managers_sharing_a_database_claim_an_orphan_once(tmp_path, monkeypatch):
+    insert_orphan(tmp_path, DEAD_PID)
+    claims = record_claims(monkeypatch)
+    generator = FakeGenerator()
+    barrier = threading.Barrier(4)
+    managers = []
+
+    def start():
+        barrier.wait()
+        managers.append(make_manager(tmp_path, generator))
+
+    threads = [threading.Thread(target=start) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # A manager created later in the same process does not take the job from the first
+    managers.append(make_manager(tmp_path, generator))
+
+    assert claims == ["orphan"]
+    assert managers[0].wait("orphan", timeout=10, poll_interval=0.05)["status"] == "succeeded"
+    assert generator.runs == 1
+
+
+def test_managers_sharing_a_database_queue_a_story_once(tmp_path):
+    generator = FakeGenerator()
+    generator.release.clear()
+    first, second = make_manager(tmp_path, generator), make_manager(tmp_path, generator)
+    job_id = first.submit(REQUEST)
+    assert second.submit(REQUEST) == job_id
+    generator.release.set()
+    assert second.wait(job_id, timeout=10, poll_interval=0.05)["status"] == "succeeded"
+    assert generator.runs == 1
+    assert jobs.owner_alive(os.getpid(), jobs.PROCESS_TOKEN)
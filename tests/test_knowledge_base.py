@@ -0,0 +1,66 @@
+import numpy as np
+from qdrant_client import QdrantClient
+from knowledge_base import KNOWLEDGE_PROMPT_VERSION, KnowledgeBaseSeeder
+from knowledge_cache import KnowledgeCache
+from vector_store import VectorStore
+
+PARTITION = {"subject": "Physics", "topic": "Atoms", "grade": "grade_6", "curriculum": "General"}
+
+
+class FakeEncoder:
+    def encode(self, sentences, **kwargs):
+        return np.asarray([[len(text), 1.0, 0.0] for text in sentences], dtype=np.float32)
+
+    def get_sentence_embedding_dimension(self):
+        return 3
+
+
+class FakeSeeder(KnowledgeBaseSeeder):
+    """Seeder whose knowledge completion returns fixed chunks and is counted"""
+
+    def __init__(self, store, cache, chunks):
+        super().__init__(store, cache)
+        self.chunks = chunks
+        self.completions = 0
+
+    def get_knowledge_chunks(self, subject, topic, grade="grade_6", curriculum="General", num_chunks=10):
+        self.completions += 1
+        return self.chunks[:num_chunks]
+
+
+def make_seeder(tmp_path, chunks):
+    store = VectorStore("test", encoder=FakeEncoder(), client=QdrantClient(":memory:"), qdrant_mode="memory")
+    return FakeSeeder(store, KnowledgeCache(str(tmp_path / "knowledge.sqlite3")), chunks)
+
+
+def seed(seeder, num_chunks):
+    seeder.seed_knowledge_base(PARTITION["subject"], PARTITION["topic"], PARTITION["grade"], PARTITION["curriculum"], num_chunks)
+
+
+def test_partially_stored_topic_is_completed(tmp_path):
+    chunks = [f"Chunk {i} about atoms." for i in range(4)]
+    seeder = make_seeder(tmp_path, chunks)
+    # An earlier seed stopped after two of the four chunks were stored
+    seeder.vector_store.add_texts(chunks[:2], [{**PARTITION, "prompt_version": KNOWLEDGE_PROMPT_VERSION, "chunk_index": i} for i in range(2)])
+
+    seed(seeder, 4)
+    assert seeder.vector_store.count({**PARTITION, "prompt_version": KNOWLEDGE_PROMPT_VERSION}) == 4
+    assert seeder.completions == 1
+
+    seed(seeder, 4)
+    assert seeder.completions == 1
+    assert seeder.vector_store.count() == 4
+
+
+def test_prune_deletes_untagged_and_outdated_chunks(tmp_path):
+    seeder = make_seeder(tmp_path, ["Current chunk."])
+    seed(seeder, 1)
+    store = seeder.vector_store
+    store.add_texts(["Chunk from before versioning."], [{**PARTITION, "chunk_index": 0}])
+    store.add_texts(["Chunk from an old prompt."], [{**PARTITION, "prompt_version": "0", "chunk_index": 0}])
+    assert store.count() == 3 and len(store.lexical_index) == 3
+
+    assert seeder.prune_outdated_chunks() == 2
+    assert [result["text"] for result in store.search("chunk", limit=5, mode="lexical")] == ["Current chunk."]
+    assert store.count() == 1 and len(store.lexical_index) == 1
+    assert seeder.prune_outdated_chunks() == 0
@@ -0,0 +1,99 @@
+import math
+import numpy as np
+import pytest
+from qdrant_client import QdrantClient
+from lexical_index import LexicalIndex, tokenize
+from vector_store import RRF_K, VectorStore
+
+DOCS = {
+    "a": ("Fission splits a nucleus and releases energy", [1.0, 0.0, 0.0, 0.0]),
+    "b": ("Fusion powers every star", [0.0, 1.0, 0.0, 0.0]),
+    "c": ("Fission reactors use uranium fuel rods in a reactor core", [0.0, 0.0, 1.0, 0.0]),
+}
+
+
+class FakeEncoder:
+    """Returns fixed vectors for known texts, so dense rankings are chosen by the test"""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.calls = 0
+
+    def encode(self, sentences, **kwargs):
+        self.calls += 1
+        return np.asarray([self.vectors.get(text, [0.0, 0.0, 0.0, 1.0]) for text in sentences], dtype=np.float32)
+
+    def get_sentence_embedding_dimension(self):
+        return 4
+
+
+def make_store(queries=None):
+    vectors = {text: vector for text, vector in DOCS.values()}
+    vectors.update(queries or {})
+    store = VectorStore("test", encoder=FakeEncoder(vectors), client=QdrantClient(":memory:"), qdrant_mode="memory")
+    store.add_texts([text for text, _ in DOCS.values()], [{"subject": "Physics", "name": name} for name in DOCS])
+    store.encoder.calls = 0
+    return store
+
+
+def test_tokenize_drops_stopwords_and_plural_s():
+    assert tokenize("The proofs of Pythagoras' theorem, and glass") == ["proof", "pythagora", "theorem", "glass"]
+
+
+def test_bm25_score_matches_the_formula():
+    index = LexicalIndex()
+    index.add("short", "alpha beta", {"subject": "Maths"})
+    index.add("long", "gamma delta epsilon gamma", {"subject": "Physics"})
+    # One of two documents has the term, twice, and is longer than the average of 3
+    idf = math.log(1 + (2 - 1 + 0.5) / (1 + 0.5))
+    expected = idf * 2 * (1.5 + 1) / (2 + 1.5 * (1 - 0.75 + 0.75 * 4 / 3))
+    assert index.search("gamma") == [("long", pytest.approx(expected))]
+    assert index.search("gamma", filters={"subject": "Maths"}) == []
+    assert index.search("the of") == []
+    assert index.count({"subject": "Physics"}) == 1
+
+
+def test_bm25_prefers_rare_terms_and_shorter_documents():
+    index = LexicalIndex()
+    index.add("a", "energy fission", {})
+    index.add("b", "energy fusion", {})
+    index.add("c", "energy fission reactor uranium rods core fuel", {})
+    ranked = [point_id for point_id, _ in index.search("fusion energy")]
+    assert ranked[0] == "b"
+    # Same term once each: the shorter document scores higher
+    scores = dict(index.search("fission"))
+    assert scores["a"] > scores["c"] > 0
+
+
+def test_hybrid_fuses_the_rankings_by_reciprocal_rank():
+    store = make_store()
+    ids = {name: VectorStore.point_id(text, {"subject": "Physics", "name": name}) for name, (text, _) in DOCS.items()}
+    dense = [{"text": DOCS[name][0], "score": score, "name": name} for name, score in (("b", 0.9), ("a", 0.5))]
+    # BM25 ranks a (shorter) above c for "fission"; dense ranks b above a
+    fused = store._fuse("fission", [0.0, 0.0, 1.0, 0.0], [ids["b"], ids["a"]], dense, 3, {"subject": "Physics"}, False)
+    assert [result["name"] for result in fused] == ["a", "b", "c"]
+    assert fused[0]["rrf_score"] == pytest.approx(1 / (RRF_K + 2) + 1 / (RRF_K + 1))
+    assert fused[1]["rrf_score"] == pytest.approx(1 / (RRF_K + 1)) and fused[1]["lexical_score"] is None
+    # The lexical-only hit is read from the collection and scored by cosine against the query
+    assert fused[2]["rrf_score"] == pytest.approx(1 / (RRF_K + 2))
+    assert fused[2]["text"] == DOCS["c"][0] and fused[2]["score"] == pytest.approx(1.0)
+    assert [result["name"] for result in store._fuse("fission", [0.0, 0.0, 1.0, 0.0], [ids["b"], ids["a"]], dense, 2, None, False)] == ["a", "b"]
+
+
+def test_auto_mode_searches_short_queries_without_the_encoder():
+    long_query = "what keeps a star shining through fusion reactions"
+    store = make_store({long_query: [0.0, 1.0, 0.0, 0.0]})
+    results = store.search("uranium", mode="auto")
+    assert [result["name"] for result in results] == ["c"]
+    assert store.encoder.calls == 0 and "rrf_score" not in results[0]
+
+    results = store.search(long_query, limit=2, mode="auto")
+    assert store.encoder.calls == 1
+    assert results[0]["name"] == "b" and "rrf_score" in results[0]
+
+    # A short query no text contains falls back to dense search
+    results = store.search("plasma", limit=1, mode="auto")
+    assert store.encoder.calls == 2 and len(results) == 1 and "rrf_score" not in results[0]
+
+    with pytest.raises(ValueError):
+        store.search("fission", mode="bm25")
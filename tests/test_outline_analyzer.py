@@ -0,0 +1,36 @@
+import json
+import pytest
+from outline_analyzer import OutlineAnalyzer, StoryOutlineTooShort, estimate_tokens
+
+
+def test_fast_estimate_counts_each_scenes_neighbours():
+    # Lengths in tokens: 1, 10, 100 and 1000, so every neighbour sum is distinct
+    scenes = ["a" * 4 * n for n in (1, 10, 100, 1000)]
+    analyzer = OutlineAnalyzer(prices={})
+    fast = analyzer.estimate(scenes, "", "grade_6", "General", "fast")["prompt_tokens"]
+    # The same scenes with no outline and no neighbours: only the fixed part and the scene itself
+    alone = sum(analyzer.estimate([scene], "", "grade_6", "General", "fast")["prompt_tokens"] for scene in scenes)
+    neighbours = [10, 1 + 100, 10 + 1000, 100]
+    assert fast - alone == sum(neighbours)
+    assert estimate_tokens(scenes[0]) == 1
+
+
+def test_short_outline_is_split_up_to_the_minimum():
+    outline = json.dumps({"title": "Atoms", "scenes": [
+        {"title": "Inside the atom", "description": "Mia shrinks down. She meets a proton. An electron zooms past. It explains its orbit."},
+        {"title": "Bonds", "description": "Two atoms share electrons."},
+    ]})
+    plan = OutlineAnalyzer(min_scenes=3, max_scenes=8, prices={}).analyze(outline, "grade_6", "General", "fast")
+    assert plan["scenes"] == [
+        "Scene 1: Inside the atom\nMia shrinks down. She meets a proton.",
+        "Scene 2: Inside the atom (continued)\nAn electron zooms past. It explains its orbit.",
+        "Scene 3: Bonds\nTwo atoms share electrons.",
+    ]
+    assert plan["adjustments"] == ["split 2 scenes into 3"]
+    assert "**Scene 2: Inside the atom (continued)**" in plan["outline"]
+
+
+def test_outline_too_short_to_split_is_rejected():
+    outline = json.dumps({"scenes": [{"title": "Atoms", "description": "Mia meets a proton."}]})
+    with pytest.raises(StoryOutlineTooShort):
+        OutlineAnalyzer(min_scenes=3, max_scenes=8, prices={}).analyze(outline, "grade_6", "General", "fast")
@@ -0,0 +1,60 @@
+import pytest
+from retrieval import ContextRetriever
+
+
+def candidate(name, score, vector, tokens=10, **extra):
+    # estimate_tokens counts four characters per token
+    return {"text": name.ljust(4 * tokens, "."), "name": name, "score": score, "vector": vector, **extra}
+
+
+def make_retriever(**kwargs):
+    settings = {"max_chunks": 3, "min_score": 0.25, "mmr_lambda": 0.7, "duplicate_threshold": 0.95, "token_budget": 1000, "search_mode": "dense"}
+    settings.update(kwargs)
+    return ContextRetriever(None, **settings)
+
+
+def names(chunks):
+    return [chunk["name"] for chunk in chunks]
+
+
+def test_candidates_below_min_score_are_dropped():
+    retriever = make_retriever()
+    chosen = retriever.select([candidate("a", 0.6, [1, 0, 0]), candidate("b", 0.2, [0, 1, 0]), candidate("c", 0.25, [0, 0, 1])])
+    assert names(chosen) == ["a", "c"]
+    assert make_retriever(min_score=0.9).select([candidate("a", 0.6, [1, 0, 0])]) == []
+
+
+def test_mmr_prefers_a_different_chunk_over_a_similar_one():
+    # a2 is 0.9 similar to a: more relevant than b, but mostly repeats a
+    candidates = [candidate("a", 0.9, [1, 0, 0]), candidate("a2", 0.88, [0.9, 0.4359, 0]), candidate("b", 0.8, [0, 1, 0])]
+    assert names(make_retriever(max_chunks=2).select(candidates)) == ["a", "b"]
+    # Relevance alone keeps the near-copy
+    assert names(make_retriever(max_chunks=2, mmr_lambda=1.0).select(candidates)) == ["a", "a2"]
+
+
+def test_duplicates_are_dropped_even_when_there_is_room():
+    candidates = [candidate("a", 0.9, [1, 0, 0]), candidate("copy", 0.9, [1, 0.01, 0]), candidate("b", 0.3, [0, 1, 0])]
+    assert names(make_retriever(mmr_lambda=1.0).select(candidates)) == ["a", "b"]
+    assert names(make_retriever(mmr_lambda=1.0, duplicate_threshold=1.01).select(candidates)) == ["a", "copy", "b"]
+
+
+def test_chunks_are_packed_into_the_token_budget():
+    candidates = [candidate("a", 0.9, [1, 0, 0], tokens=60), candidate("long", 0.8, [0, 1, 0], tokens=50), candidate("short", 0.7, [0, 0, 1], tokens=30)]
+    # long no longer fits after a, the shorter one after it still does
+    assert names(make_retriever(token_budget=100).select(candidates)) == ["a", "short"]
+    assert names(make_retriever(token_budget=100, max_chunks=1).select(candidates)) == ["a"]
+
+
+def test_hybrid_results_are_ranked_by_fused_score_and_returned_without_vectors():
+    candidates = [
+        candidate("dense", 0.9, [1, 0, 0], rrf_score=0.016, lexical_score=None),
+        candidate("both", 0.5, [0, 1, 0], rrf_score=0.032, lexical_score=3.2),
+    ]
+    chosen = make_retriever(search_mode="hybrid").select(candidates)
+    assert names(chosen) == ["both", "dense"]
+    assert all(set(chunk) == {"text", "name", "score"} for chunk in chosen)
+
+
+def test_unknown_search_mode_is_rejected():
+    with pytest.raises(ValueError):
+        make_retriever(search_mode="lexical")
@@ -0,0 +1,94 @@
+import json
+import random
+from scene_parser import SceneStreamParser, parse_scene_text, parse_repair_response
+
+SCENE = {
+    "narrative": "Maya held the leaf up to the light. \"Look!\" she said.\nIt glowed green.",
+    "explanation": "Chlorophyll absorbs red and blue light – and reflects green.",
+    "image_prompt": "a girl holding a leaf against the sun \U0001F600",
+}
+
+
+def feed_in_chunks(text, sizes):
+    parser = SceneStreamParser()
+    position = 0
+    for size in sizes:
+        parser.feed(text[position:position + size])
+        position += size
+    parser.feed(text[position:])
+    parser.close()
+    return parser
+
+
+def test_json_scene():
+    parser = parse_scene_text(json.dumps(SCENE, ensure_ascii=False))
+    assert parser.format == "json"
+    assert parser.result() == SCENE
+    assert parser.missing() == []
+
+
+def test_ascii_escaped_json_joins_surrogate_pairs():
+    # ensure_ascii writes the emoji as a \ud83d\ude00 surrogate pair and the dash as \u2013
+    text = json.dumps(SCENE)
+    assert "\\ud83d\\ude00" in text
+    result = parse_scene_text(text).result()
+    assert result == SCENE
+    # Must be storable as UTF-8 (SQLite cache, API responses)
+    result["image_prompt"].encode("utf-8")
+
+
+def test_escapes_split_across_chunks():
+    text = json.dumps(SCENE)
+    rng = random.Random(7)
+    for _ in range(200):
+        sizes = [rng.randint(1, 6) for _ in range(len(text) // 3)]
+        assert feed_in_chunks(text, sizes).result() == SCENE
+
+
+def test_unpaired_surrogates_are_replaced():
+    text = '{"narrative": "a\\ud83d b \\ude00 c \\ud83d", "explanation": "x", "image_prompt": "y"}'
+    narrative = parse_scene_text(text).result()["narrative"]
+    assert narrative == "a� b � c �"
+    narrative.encode("utf-8")
+
+
+def test_simple_escapes_and_code_fence():
+    text = '```json\n{"narrative": "tab\\there \\"quoted\\" back\\\\slash", "explanation": "e", "image_prompt": "p"}\n```'
+    parser = parse_scene_text(text)
+    assert parser.result()["narrative"] == 'tab\there "quoted" back\\slash'
+
+
+def test_unknown_and_nested_fields_are_skipped():
+    text = '{"title": "skip {me}", "meta": {"a": ["}", "\\""]}, "count": 3, "narrative": "n", "explanation": "e", "image_prompt": "p"}'
+    assert parse_scene_text(text).result() == {"narrative": "n", "explanation": "e", "image_prompt": "p"}
+
+
+def test_truncated_json_reports_cut_off_field():
+    text = json.dumps(SCENE)
+    parser = parse_scene_text(text[:text.index("image_prompt") + 30])
+    assert parser.missing() == ["image_prompt"]
+    assert parser.value("narrative") == SCENE["narrative"]
+
+
+def test_invalid_unicode_escape():
+    parser = parse_scene_text('{"narrative": "a\\uZZZZb", "explanation": "e", "image_prompt": "p"}')
+    assert parser.result()["narrative"] == "a�b"
+
+
+def test_markers_in_any_order_split_across_chunks():
+    text = "**IMAGE PROMPT:** a leaf\n\nNARRATIVE: Maya looked up.\n\nEXPLANATION: Leaves are green."
+    expected = {"narrative": "Maya looked up.", "explanation": "Leaves are green.", "image_prompt": "a leaf"}
+    for size in (1, 2, 5, 11):
+        assert feed_in_chunks(text, [size] * (len(text) // size)).result() == expected
+
+
+def test_garbage_reports_every_field_missing():
+    parser = parse_scene_text("Sorry, I can't help with that.")
+    assert parser.format == "markers"
+    assert parser.missing() == ["narrative", "explanation", "image_prompt"]
+
+
+def test_repair_response():
+    assert parse_repair_response('{"explanation": " fixed ", "narrative": 3}') == {"explanation": "fixed"}
+    assert parse_repair_response("[1, 2]") == {}
+    assert parse_repair_response("EXPLANATION: from markers")["explanation"] == "from markers"
@@ -0,0 +1,204 @@
+import random
+import threading
+import time
+from email.utils import formatdate
+import pytest
+from scheduler import (PRIORITY_IMAGE, PRIORITY_TEXT, ModelLimiter, RequestScheduler, ScheduledStream, TokenBucket,
+                       retry_after_seconds)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeResponse:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class RateLimited(Exception):
+    """What the client raises for a 429, reduced to the attributes the scheduler reads"""
+    status_code = 429
+
+    def __init__(self, headers=None):
+        super().__init__("rate limited")
+        self.response = FakeResponse(headers or {})
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+def make_scheduler(**kwargs):
+    """A scheduler whose sleeps are recorded and move its clock forward instead of waiting"""
+    sleeps = []
+    clock = kwargs.setdefault("clock", FakeClock())
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        clock.now += seconds
+
+    scheduler = RequestScheduler(limits=kwargs.pop("limits", {}), max_concurrency=kwargs.pop("max_concurrency", 4),
+                                 max_retries=kwargs.pop("max_retries", 3), sleep=sleep, **kwargs)
+    return scheduler, sleeps
+
+
+def failing(errors, result="ok"):
+    """fn that raises the given errors in turn, then returns result"""
+    calls = []
+
+    def fn(model, **request):
+        calls.append(model)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return fn, calls
+
+
+def test_token_bucket_refills_with_the_clock():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock)
+    assert bucket.wait_time(60, clock()) == 0.0
+    bucket.take(60)
+    assert bucket.wait_time(1, clock()) == pytest.approx(1.0)
+    clock.now += 0.5
+    assert bucket.wait_time(1, clock()) == pytest.approx(0.5)
+    clock.now += 120
+    # Never holds more than a minute's worth, and an oversized request waits for a full bucket only
+    assert bucket.wait_time(60, clock()) == 0.0
+    bucket.take(60)
+    assert bucket.wait_time(600, clock()) == pytest.approx(60.0)
+
+
+def test_model_limiter_waits_for_the_tighter_budget_and_pauses():
+    clock = FakeClock()
+    limiter = ModelLimiter(rpm=6, tpm=600, clock=clock)
+    limiter.take(600)
+    # One request per 10s is free again in 0s, 100 tokens per 10s need 10s
+    assert limiter.wait_time(100, clock()) == pytest.approx(10.0)
+    limiter.correct_tokens(-300)
+    assert limiter.wait_time(100, clock()) == 0.0
+    limiter.pause(30)
+    assert limiter.wait_time(0, clock()) == pytest.approx(30.0)
+
+
+def test_dispatch_reports_the_wait_until_the_budget_refills():
+    clock = FakeClock()
+    scheduler, _ = make_scheduler(limits={"gpt-4o": (2, None)}, clock=clock)
+    fn, calls = failing([])
+    scheduler.call("scene", fn, "gpt-4o")
+    scheduler.call("scene", fn, "gpt-4o")
+    ticket = {"model": "gpt-4o", "priority": PRIORITY_TEXT, "tokens": 0, "sequence": 99, "admitted": False}
+    with scheduler._cond:
+        scheduler._waiting.append(ticket)
+        # Two requests per minute: the next one is allowed 30 seconds later
+        assert scheduler._dispatch() == pytest.approx(30.0)
+        clock.now += 30
+        assert scheduler._dispatch() is None
+    assert ticket["admitted"]
+
+
+def test_full_jitter_backoff_stays_within_the_exponential_cap():
+    random.seed(3)
+    scheduler, _ = make_scheduler(base_delay=1.0, max_delay=8.0)
+    for attempt in range(6):
+        delays = [scheduler.backoff_delay(attempt) for _ in range(200)]
+        assert all(0 <= delay <= min(8.0, 2 ** attempt) for delay in delays)
+        # Jittered over the whole range, not clustered at the cap
+        assert min(delays) < min(8.0, 2 ** attempt) / 4
+    assert all(5.0 <= scheduler.backoff_delay(0, retry_after=5.0) <= 5.5 for _ in range(100))
+
+
+def test_retry_after_formats():
+    assert retry_after_seconds(RateLimited({"retry-after": "7"})) == 7.0
+    assert retry_after_seconds(RateLimited({"retry-after-ms": "250", "retry-after": "7"})) == 0.25
+    assert 8 <= retry_after_seconds(RateLimited({"retry-after": formatdate(time.time() + 10, usegmt=True)})) <= 10
+    assert retry_after_seconds(RateLimited()) is None
+    assert retry_after_seconds(ValueError()) is None
+
+
+def test_429_is_retried_after_retry_after_and_pauses_the_model():
+    clock = FakeClock()
+    scheduler, sleeps = make_scheduler(clock=clock, base_delay=1.0)
+    fn, calls = failing([RateLimited({"retry-after": "2"}), RateLimited({"retry-after": "4"})])
+    assert scheduler.call("scene", fn, "gpt-4o") == "ok"
+    assert len(calls) == 3
+    assert len(sleeps) == 2
+    assert 2.0 <= sleeps[0] <= 2.5 and 4.0 <= sleeps[1] <= 4.5
+    assert scheduler.stats()["retries"] == 2
+    # Every request for the model was held back until the Retry-After had passed, not only the one that failed
+    assert scheduler._limiter("gpt-4o").paused_until == pytest.approx(clock())
+    clock.now -= 1
+    assert scheduler.stats()["paused_models"] == ["gpt-4o"]
+
+
+def test_retries_stop_at_max_retries_and_skip_client_errors():
+    scheduler, sleeps = make_scheduler(max_retries=2)
+    fn, calls = failing([RateLimited()] * 5)
+    with pytest.raises(RateLimited):
+        scheduler.call("scene", fn, "gpt-4o")
+    assert len(calls) == 3 and len(sleeps) == 2
+
+    fn, calls = failing([BadRequest()])
+    with pytest.raises(BadRequest):
+        scheduler.call("scene", fn, "gpt-4o")
+    assert len(calls) == 1
+    assert scheduler.stats()["failures"] == 2
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_text_is_dispatched_before_images_queued_earlier():
+    scheduler, _ = make_scheduler(max_concurrency=1)
+    order = []
+    busy = threading.Event()
+    release = threading.Event()
+
+    def fn(model, name, **request):
+        order.append(name)
+        if name == "first":
+            busy.set()
+            release.wait(5)
+        return name
+
+    def submit(name, priority):
+        scheduler.call(name, fn, "gpt-4o", priority, name=name)
+
+    def wait_for_depth(depth):
+        deadline = time.monotonic() + 5
+        while scheduler.stats()["queue_depth"] < depth and time.monotonic() < deadline:
+            time.sleep(0.005)
+
+    threads = [threading.Thread(target=submit, args=("first", PRIORITY_TEXT))]
+    threads[0].start()
+    busy.wait(5)
+    for depth, (name, priority) in enumerate([("image 1", PRIORITY_IMAGE), ("image 2", PRIORITY_IMAGE), ("text", PRIORITY_TEXT)], 1):
+        threads.append(threading.Thread(target=submit, args=(name, priority)))
+        threads[-1].start()
+        wait_for_depth(depth)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert order == ["first", "text", "image 1", "image 2"]
+
+
+def test_stream_holds_its_slot_and_corrects_the_token_charge():
+    clock = FakeClock()
+    scheduler, _ = make_scheduler(limits={"gpt-4o": (None, 6000)}, max_concurrency=1, clock=clock)
+
+    class Chunk:
+        def __init__(self, usage=None):
+            self.usage = usage
+
+    fn, _ = failing([], result=iter([Chunk(), Chunk({"total_tokens": 100})]))
+    stream = scheduler.call("scene", fn, "gpt-4o", estimated_tokens=1000, stream=True)
+    assert isinstance(stream, ScheduledStream)
+    assert scheduler.stats()["in_flight"] == 1
+    assert len(list(stream)) == 2
+    assert scheduler.stats()["in_flight"] == 0
+    # Charged 1000 up front, corrected to the 100 actually used
+    assert scheduler._limiter("gpt-4o").tokens.tokens == pytest.approx(5900)
@@ -0,0 +1,176 @@
+import socket
+import threading
+import time
+import pytest
+from story_cache import FileSystemStoryBackend, RedisStoryBackend, SQLiteStoryBackend, StoryCache
+
+# Above the kernel's pid_max, so no process can have it
+DEAD_PID = 2 ** 22 + 1
+
+
+class FakeRedis:
+    """In-memory stand-in for the redis-py calls RedisStoryBackend makes, with expiry on time.time()"""
+
+    def __init__(self):
+        self._values = {}
+        self._expires = {}
+        self._sorted_sets = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and time.time() >= expires:
+            self._values.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._values
+
+    def get(self, key):
+        with self._lock:
+            return self._values[key] if self._live(key) else None
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            if nx and self._live(key):
+                return None
+            self._values[key] = value.encode("utf-8") if isinstance(value, str) else value
+            self._expires.pop(key, None)
+            if ex:
+                self._expires[key] = time.time() + ex
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._expires.pop(key, None)
+            return int(self._values.pop(key, None) is not None)
+
+    def zadd(self, name, mapping):
+        with self._lock:
+            self._sorted_sets.setdefault(name, {}).update(mapping)
+
+    def zcard(self, name):
+        with self._lock:
+            return len(self._sorted_sets.get(name, {}))
+
+    def zrange(self, name, start, end):
+        with self._lock:
+            members = sorted(self._sorted_sets.get(name, {}).items(), key=lambda item: item[1])
+            return [member.encode("utf-8") for member, _ in members[start:end + 1]]
+
+    def zrem(self, name, member):
+        with self._lock:
+            self._sorted_sets.get(name, {}).pop(member, None)
+
+    def eval(self, script, numkeys, key, token):
+        # Only the compare-and-delete unlock script is used
+        assert script == RedisStoryBackend.UNLOCK_SCRIPT and numkeys == 1
+        with self._lock:
+            if self._live(key) and self._values[key] == token.encode("utf-8"):
+                del self._values[key]
+                self._expires.pop(key, None)
+                return 1
+            return 0
+
+
+@pytest.fixture(params=["sqlite", "filesystem", "redis"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteStoryBackend(str(tmp_path / "stories.sqlite3"))
+    if request.param == "filesystem":
+        return FileSystemStoryBackend(str(tmp_path / "stories"))
+    return RedisStoryBackend(client=FakeRedis())
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Wall clock the backends read, moved forward by the tests"""
+    now = [time.time()]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+def test_put_get_and_stats(backend):
+    cache = StoryCache(backend)
+    assert cache.get("a") is None
+    cache.put("a", {"title": "Atoms", "scenes": [{"narrative": "é ✓"}]})
+    assert cache.get("a") == {"title": "Atoms", "scenes": [{"narrative": "é ✓"}]}
+    cache.delete("a")
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_entries_expire_after_the_ttl(backend, clock):
+    cache = StoryCache(backend, ttl_seconds=60)
+    cache.put("a", {"n": 1})
+    clock[0] += 59
+    assert cache.get("a") == {"n": 1}
+    clock[0] += 2
+    assert cache.get("a") is None
+
+
+def test_least_recently_used_entry_is_evicted(backend, clock):
+    cache = StoryCache(backend, max_entries=2)
+    for key in ("a", "b"):
+        cache.put(key, {"key": key})
+        clock[0] += 1
+        # The filesystem backend orders by file mtime, which follows the real clock
+        time.sleep(0.01)
+    assert cache.get("a") is not None
+    clock[0] += 1
+    time.sleep(0.01)
+    cache.put("c", {"key": "c"})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert backend.count() == 2
+
+
+def test_lock_expires_and_unlock_checks_the_token(backend, clock):
+    assert backend.try_lock("k", "other-host:1:a", 60)
+    assert not backend.try_lock("k", "other-host:1:b", 60)
+    assert backend.lock_token("k") == "other-host:1:a"
+    backend.unlock("k", "other-host:1:b")
+    assert backend.lock_token("k") == "other-host:1:a"
+    clock[0] += 61
+    assert backend.try_lock("k", "other-host:1:b", 60)
+    backend.unlock("k", "other-host:1:b")
+    assert backend.lock_token("k") is None
+
+
+def test_single_flight_generates_once(backend):
+    cache = StoryCache(backend, poll_interval=0.01)
+    calls = []
+
+    def factory():
+        calls.append(1)
+        time.sleep(0.05)
+        return {"title": "once"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_create("k", factory))) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert calls == [1]
+    assert results == [{"title": "once"}] * 6
+    assert cache._local_locks == {}
+    assert backend.lock_token("k") is None
+
+
+def test_single_flight_breaks_a_lock_left_by_a_dead_process(backend):
+    stale = f"{socket.gethostname()}:{DEAD_PID}:stale"
+    assert backend.try_lock("k", stale, 900)
+    cache = StoryCache(backend, poll_interval=0.01)
+    started = time.monotonic()
+    with cache.single_flight("k"):
+        assert backend.lock_token("k") != stale
+    assert time.monotonic() - started < 1
+
+
+def test_single_flight_waits_for_a_live_lock_to_expire(backend):
+    # Held by a process on another host, which cannot be checked, so only expiry frees it
+    assert backend.try_lock("k", "other-host:1:live", 1)
+    cache = StoryCache(backend, lock_seconds=60, poll_interval=0.05)
+    started = time.monotonic()
+    with cache.single_flight("k"):
+        pass
+    assert 0.9 <= time.monotonic() - started < 5
@@ -0,0 +1,36 @@
+from telemetry import COST_BUCKETS, COUNT_BUCKETS, DURATION_BUCKETS, Telemetry
+
+
+def bucket_lines(text, name):
+    return [line for line in text.splitlines() if line.startswith(f"{name}_bucket")]
+
+
+def test_histograms_keep_their_own_buckets():
+    telemetry = Telemetry(trace_file="")
+    telemetry.observe("story_wasted_completions", 0, buckets=COUNT_BUCKETS)
+    telemetry.observe("story_wasted_completions", 3, buckets=COUNT_BUCKETS)
+    telemetry.observe("story_job_run_seconds", 0.2)
+    text = telemetry.render_prometheus()
+
+    wasted = bucket_lines(text, "story_wasted_completions")
+    assert wasted == [
+        'story_wasted_completions_bucket{le="0"} 1',
+        'story_wasted_completions_bucket{le="1"} 1',
+        'story_wasted_completions_bucket{le="2"} 1',
+        'story_wasted_completions_bucket{le="3"} 2',
+        'story_wasted_completions_bucket{le="5"} 2',
+        'story_wasted_completions_bucket{le="10"} 2',
+        'story_wasted_completions_bucket{le="20"} 2',
+        'story_wasted_completions_bucket{le="+Inf"} 2',
+    ]
+    assert len(bucket_lines(text, "story_job_run_seconds")) == len(DURATION_BUCKETS) + 1
+    assert "story_wasted_completions_sum 3.000000" in text
+
+
+def test_story_cost_is_bucketed_in_dollars():
+    telemetry = Telemetry(trace_file="")
+    telemetry.observe("story_estimated_cost_usd", 0.42, buckets=COST_BUCKETS)
+    lines = bucket_lines(telemetry.render_prometheus(), "story_estimated_cost_usd")
+    assert 'story_estimated_cost_usd_bucket{le="0.3"} 0' in lines
+    assert 'story_estimated_cost_usd_bucket{le="0.5"} 1' in lines
+    assert len(lines) == len(COST_BUCKETS) + 1
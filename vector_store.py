@@ -1,29 +1,90 @@
 import os
-from typing import List, Dict, Any
+import gzip
+import hashlib
+import json
+import uuid
+import time
+import threading
+from datetime import datetime
+from contextlib import nullcontext
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+import numpy as np
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
-from sentence_transformers import SentenceTransformer
+from encoders import Encoder
+from lexical_index import LexicalIndex, tokenize
+from runtime import get_runtime, ENCODER_MODEL_NAME
+from telemetry import get_telemetry
 
 load_dotenv()
 
+# Namespace for content-addressed point IDs
+POINT_ID_NAMESPACE = uuid.UUID("6f1d3a52-8c1e-4b43-9a55-2f0c8e7b1d44")
+
+# Payload fields that partition the knowledge base into per-request slices
+PARTITION_FIELDS = ("curriculum", "subject", "topic", "grade", "prompt_version")
+# Payload fields left out of the content-addressed point ID: text a new prompt version
+# generates again is re-tagged on the stored point instead of being stored twice
+VERSION_FIELDS = ("prompt_version",)
+
+# "dense" ranks by embedding similarity, "lexical" by BM25 over the text without the
+# encoder, "hybrid" fuses both rankings, and "auto" runs short queries lexically
+SEARCH_MODES = ("dense", "lexical", "hybrid", "auto")
+# HNSW graph settings for new collections. The knowledge base holds thousands of
+# short chunks, not millions: a modest graph builds quickly, and partitions below
+# the full-scan threshold (in KB of vectors) are searched exactly via the payload indexes
+DEFAULT_HNSW_M = 16
+DEFAULT_HNSW_EF_CONSTRUCT = 100
+DEFAULT_FULL_SCAN_THRESHOLD = 10000
+# Points per scroll/upsert page when rebuilding the lexical index or moving snapshots
+PAGE_SIZE = 256
+
+# Reciprocal-rank fusion constant; larger values flatten the weight of the top ranks
+RRF_K = 60
+# Each ranking contributes this many times the requested results to the fusion
+HYBRID_CANDIDATE_FACTOR = 4
+# Queries of at most this many terms are searched lexically in "auto" mode
+DEFAULT_LEXICAL_QUERY_MAX_TERMS = 3
+# Seconds before a partition whose lexical search missed is scrolled from Qdrant again;
+# points written by other processes sharing the collection reach the index this way
+DEFAULT_LEXICAL_REFRESH_SECONDS = 30
+
+_embedded_client_locks: Dict[int, threading.RLock] = {}
+_embedded_client_locks_guard = threading.Lock()
+
+
+def _client_lock(client: QdrantClient):
+    """Return the lock serializing calls into an embedded Qdrant client, which is not thread-safe"""
+    with _embedded_client_locks_guard:
+        return _embedded_client_locks.setdefault(id(client), threading.RLock())
+
 class VectorStore:
-    def __init__(self, collection_name: str = "story_knowledge_base"):
+    def __init__(self, collection_name: str = "story_knowledge_base", encoder: Optional[Encoder] = None, client: Optional[QdrantClient] = None, index_fields: Sequence[str] = PARTITION_FIELDS, qdrant_mode: Optional[str] = None):
         self.collection_name = collection_name
-        self.encoder = SentenceTransformer("all-MiniLM-L6-v2")
-        
-        # Initialize Qdrant client
-        self.qdrant_url = os.getenv("QDRANT_URL")
-        self.qdrant_api_key = os.getenv("QDRANT_API_KEY")
+        self.index_fields = tuple(index_fields)
         
-        if self.qdrant_url:
-            self.client = QdrantClient(url=self.qdrant_url, api_key=self.qdrant_api_key)
-        else:
-            # Use local Qdrant instance
-            self.client = QdrantClient(":memory:")
+        # Reuse the process-wide encoder and Qdrant client unless explicitly given
+        runtime = get_runtime()
+        self.encoder = encoder if encoder is not None else runtime.get_encoder()
+        self.client = client if client is not None else runtime.get_qdrant_client()
+        # "remote", "local" or "memory" as recorded by the runtime registry. A client it did not
+        # create is treated as embedded, since locking a server client only costs throughput
+        mode = qdrant_mode if qdrant_mode is not None else runtime.get_qdrant_mode(self.client)
+        self.embedded = mode != "remote"
+        # Shared by every store on the same embedded client; a no-op for a Qdrant server
+        self._client_lock = _client_lock(self.client) if self.embedded else nullcontext()
+        self.lexical_query_max_terms = int(os.getenv("LEXICAL_QUERY_MAX_TERMS", DEFAULT_LEXICAL_QUERY_MAX_TERMS))
+        self.lexical_refresh_seconds = float(os.getenv("LEXICAL_REFRESH_SECONDS", DEFAULT_LEXICAL_REFRESH_SECONDS))
+        self._lexical_refreshed: Dict[Tuple, float] = {}
+        self._lexical_refresh_lock = threading.Lock()
         
         # Create collection if it doesn't exist
         self._create_collection()
+        
+        # BM25 sidecar for lexical and hybrid search, loaded from whatever the collection already holds
+        self.lexical_index = LexicalIndex()
+        self.rebuild_lexical_index()
     
     def _create_collection(self):
         """Create a collection if it doesn't exist"""
@@ -31,52 +92,457 @@ class VectorStore:
         collection_names = [collection.name for collection in collections]
         
         if self.collection_name not in collection_names:
+            # Embedded Qdrant has no HNSW index or payload storage options, it always scans in memory
+            tuning = {}
+            if not self.embedded:
+                tuning = {
+                    "hnsw_config": models.HnswConfigDiff(
+                        m=int(os.getenv("QDRANT_HNSW_M", DEFAULT_HNSW_M)),
+                        ef_construct=int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", DEFAULT_HNSW_EF_CONSTRUCT)),
+                        full_scan_threshold=int(os.getenv("QDRANT_FULL_SCAN_THRESHOLD", DEFAULT_FULL_SCAN_THRESHOLD))
+                    ),
+                    # Vectors stay in RAM; the chunk texts are only read for the few results returned
+                    "on_disk_payload": os.getenv("QDRANT_ON_DISK_PAYLOAD", "true").lower() in ("1", "true", "yes")
+                }
             self.client.create_collection(
                 collection_name=self.collection_name,
                 vectors_config=models.VectorParams(
                     size=self.encoder.get_sentence_embedding_dimension(),
                     distance=models.Distance.COSINE
+                ),
+                **tuning
+            )
+        
+        self._create_payload_indexes()
+    
+    def _create_payload_indexes(self):
+        """Index the filter fields so filtered searches only scan the matching slice"""
+        # Embedded Qdrant scans payloads directly and warns that indexes have no effect
+        if self.embedded:
+            return
+        
+        existing = self.client.get_collection(self.collection_name).payload_schema or {}
+        
+        for field in self.index_fields:
+            if field not in existing:
+                self.client.create_payload_index(
+                    collection_name=self.collection_name,
+                    field_name=field,
+                    field_schema=models.PayloadSchemaType.KEYWORD
+                )
+    
+    def rebuild_lexical_index(self) -> int:
+        """Reindex every point in the collection for lexical search; returns the number of points"""
+        self.lexical_index.clear()
+        offset = None
+        while True:
+            with self._client_lock:
+                records, offset = self.client.scroll(
+                    collection_name=self.collection_name,
+                    limit=PAGE_SIZE,
+                    offset=offset,
+                    with_payload=True,
+                    with_vectors=False
+                )
+            self._index_lexical(records)
+            if offset is None:
+                return len(self.lexical_index)
+    
+    def refresh_lexical_index(self, filters: Optional[Dict[str, Any]] = None) -> int:
+        """Index points of the matching slice that the lexical index has not seen, e.g. ones written
+        by another process sharing the collection; returns the number of points added.
+        
+        Only IDs are scrolled; payloads are read for the new points alone.
+        """
+        with self._lexical_refresh_lock:
+            self._lexical_refreshed[self._filter_key(filters)] = time.monotonic()
+        query_filter = self._build_filter(filters)
+        added = 0
+        offset = None
+        while True:
+            with self._client_lock:
+                records, offset = self.client.scroll(
+                    collection_name=self.collection_name,
+                    scroll_filter=query_filter,
+                    limit=PAGE_SIZE,
+                    offset=offset,
+                    with_payload=False,
+                    with_vectors=False
                 )
+            unseen = [str(record.id) for record in records if str(record.id) not in self.lexical_index]
+            if unseen:
+                self._index_lexical(self._fetch_points(unseen).values())
+                added += len(unseen)
+            if offset is None:
+                return added
+    
+    def _refresh_lexical_after_miss(self, filters: Optional[Dict[str, Any]]) -> bool:
+        """Refresh the slice a lexical search missed in, at most once per LEXICAL_REFRESH_SECONDS; True if points were added"""
+        key = self._filter_key(filters)
+        with self._lexical_refresh_lock:
+            if time.monotonic() - self._lexical_refreshed.get(key, float("-inf")) < self.lexical_refresh_seconds:
+                return False
+            self._lexical_refreshed[key] = time.monotonic()
+        return self.refresh_lexical_index(filters) > 0
+    
+    @staticmethod
+    def _filter_key(filters: Optional[Dict[str, Any]]) -> Tuple:
+        return tuple(sorted((key, str(value)) for key, value in (filters or {}).items() if value is not None))
+    
+    def _index_lexical(self, records):
+        """Add scrolled or retrieved points to the lexical index with just their filter fields"""
+        for record in records:
+            payload = record.payload or {}
+            self.lexical_index.add(str(record.id), payload.get("text", ""), self._filter_fields(payload))
+    
+    def _filter_fields(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return {field: payload[field] for field in self.index_fields if field in payload}
+    
+    def count(self, filters: Optional[Dict[str, Any]] = None) -> int:
+        """Number of points in the collection, optionally only those matching the payload filter"""
+        with self._client_lock:
+            return self.client.count(
+                collection_name=self.collection_name,
+                count_filter=self._build_filter(filters),
+                exact=True
+            ).count
+    
+    def delete_outdated(self, field: str, current: Any) -> int:
+        """Delete points whose field is missing or differs from current, e.g. chunks written by an
+        earlier prompt version that filtered searches no longer return; returns the number deleted
+        """
+        # must_not also matches points that do not have the field at all
+        outdated = models.Filter(must_not=[models.FieldCondition(key=field, match=models.MatchValue(value=current))])
+        with self._client_lock:
+            count = self.client.count(collection_name=self.collection_name, count_filter=outdated, exact=True).count
+            if count:
+                self.client.delete(collection_name=self.collection_name, points_selector=models.FilterSelector(filter=outdated))
+        if count:
+            self.rebuild_lexical_index()
+        return count
+    
+    def export_snapshot(self, path: str) -> int:
+        """Write every point (ID, vector and payload) to a gzipped JSONL file; returns the number of points.
+        
+        The first line records the collection, encoder model and vector size so import_snapshot
+        can refuse vectors from another model. Works the same for embedded and server Qdrant.
+        """
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        exported = 0
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "collection": self.collection_name,
+                "encoder_model": ENCODER_MODEL_NAME,
+                "dimension": self.encoder.get_sentence_embedding_dimension(),
+                "points": self.count(),
+                "created_at": datetime.now().isoformat(timespec="seconds")
+            }) + "\n")
+            offset = None
+            while True:
+                with self._client_lock:
+                    records, offset = self.client.scroll(
+                        collection_name=self.collection_name,
+                        limit=PAGE_SIZE,
+                        offset=offset,
+                        with_payload=True,
+                        with_vectors=True
+                    )
+                for record in records:
+                    f.write(json.dumps({"id": str(record.id), "vector": list(record.vector), "payload": record.payload}) + "\n")
+                exported += len(records)
+                if offset is None:
+                    break
+        os.replace(tmp_path, path)
+        return exported
+    
+    def import_snapshot(self, path: str) -> int:
+        """Load points written by export_snapshot, skipping ones already stored; returns the number of new points"""
+        added = 0
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            dimension = self.encoder.get_sentence_embedding_dimension()
+            if header.get("encoder_model") != ENCODER_MODEL_NAME or header.get("dimension") != dimension:
+                raise ValueError(
+                    f"Snapshot {path} was built with {header.get('encoder_model')} ({header.get('dimension')} dimensions), "
+                    f"but this store uses {ENCODER_MODEL_NAME} ({dimension} dimensions)"
+                )
+            
+            page = []
+            for line in f:
+                if line.strip():
+                    page.append(json.loads(line))
+                if len(page) == PAGE_SIZE:
+                    added += self._import_page(page)
+                    page = []
+            added += self._import_page(page)
+        return added
+    
+    def _import_page(self, entries: List[Dict[str, Any]]) -> int:
+        existing = self._existing_ids([entry["id"] for entry in entries])
+        points = [
+            models.PointStruct(id=entry["id"], vector=entry["vector"], payload=entry["payload"])
+            for entry in entries
+            if entry["id"] not in existing
+        ]
+        if not points:
+            return 0
+        
+        with get_telemetry().span("upsert", collection=self.collection_name, points=len(points)):
+            with self._client_lock:
+                self.client.upsert(collection_name=self.collection_name, points=points)
+        for point in points:
+            self.lexical_index.add(point.id, point.payload.get("text", ""), self._filter_fields(point.payload))
+        return len(points)
+    
+    def _build_filter(self, filters: Optional[Dict[str, Any]]) -> Optional[models.Filter]:
+        """Turn a {field: value} dict into an exact-match Qdrant filter"""
+        if not filters:
+            return None
+        
+        return models.Filter(
+            must=[
+                models.FieldCondition(key=key, match=models.MatchValue(value=value))
+                for key, value in filters.items()
+                if value is not None
+            ]
+        )
+    
+    @staticmethod
+    def point_id(text: str, meta: Dict[str, Any]) -> str:
+        """Derive a stable point ID from the text and its metadata, apart from the version fields"""
+        meta = {key: value for key, value in meta.items() if key not in VERSION_FIELDS}
+        digest = hashlib.sha256(
+            json.dumps({"text": text, "meta": meta}, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+        return str(uuid.uuid5(POINT_ID_NAMESPACE, digest))
+    
+    def _existing_ids(self, ids: List[str]) -> set:
+        """Return the subset of point IDs already stored in the collection"""
+        if not ids:
+            return set()
+        
+        with self._client_lock:
+            records = self.client.retrieve(
+                collection_name=self.collection_name,
+                ids=ids,
+                with_payload=False,
+                with_vectors=False
             )
+        return {str(record.id) for record in records}
     
-    def add_texts(self, texts: List[str], metadata: List[Dict[str, Any]] = None):
-        """Add texts to the vector store with optional metadata"""
+    def add_texts(self, texts: List[str], metadata: List[Dict[str, Any]] = None, vectors: Optional[List[List[float]]] = None) -> int:
+        """Add texts to the vector store with optional metadata, skipping ones already stored.
+        
+        Precomputed vectors can be passed to skip encoding. Returns the number of new points written.
+        """
         if metadata is None:
             metadata = [{}] * len(texts)
+        if vectors is None:
+            vectors = [None] * len(texts)
+        
+        # Content-addressed IDs make re-seeding idempotent and keep topics from overwriting each other
+        pending = {}
+        for text, meta, vector in zip(texts, metadata, vectors):
+            pending.setdefault(self.point_id(text, meta), (text, meta, vector))
         
-        vectors = self.encoder.encode(texts).tolist()
+        existing = self._existing_ids(list(pending))
+        self._retag(existing, pending)
+        new_items = [(point_id, *item) for point_id, item in pending.items() if point_id not in existing]
+        
+        if not new_items:
+            return 0
+        
+        # Only encode the chunks that are not stored yet and have no precomputed vector
+        to_encode = [i for i, (_, _, _, vector) in enumerate(new_items) if vector is None]
+        if to_encode:
+            with get_telemetry().span("encode", texts=len(to_encode)):
+                encoded = self.encoder.encode([new_items[i][1] for i in to_encode]).tolist()
+            for i, vector in zip(to_encode, encoded):
+                point_id, text, meta, _ = new_items[i]
+                new_items[i] = (point_id, text, meta, vector)
         
         # Prepare points for insertion
         points = [
             models.PointStruct(
-                id=i,
-                vector=vector,
+                id=point_id,
+                vector=list(vector),
                 payload={"text": text, **meta}
             )
-            for i, (vector, text, meta) in enumerate(zip(vectors, texts, metadata))
+            for point_id, text, meta, vector in new_items
         ]
         
         # Insert points
-        self.client.upsert(
-            collection_name=self.collection_name,
-            points=points
-        )
+        with get_telemetry().span("upsert", collection=self.collection_name, points=len(points)):
+            with self._client_lock:
+                self.client.upsert(
+                    collection_name=self.collection_name,
+                    points=points
+                )
+        
+        # Keep the lexical index in step with the collection
+        for point in points:
+            self.lexical_index.add(point.id, point.payload["text"], self._filter_fields(point.payload))
+        
+        return len(points)
     
-    def search(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
-        """Search for similar texts based on the query"""
-        query_vector = self.encoder.encode(query).tolist()
+    def _retag(self, ids: set, pending: Dict[str, Any]):
+        """Set the version fields of points already stored to those they were just added with"""
+        groups: Dict[Tuple, List[str]] = {}
+        for point_id in ids:
+            meta = pending[point_id][1]
+            version = tuple((field, meta[field]) for field in VERSION_FIELDS if field in meta)
+            if version:
+                groups.setdefault(version, []).append(point_id)
         
-        results = self.client.search(
-            collection_name=self.collection_name,
-            query_vector=query_vector,
-            limit=limit
-        )
+        for version, point_ids in groups.items():
+            with self._client_lock:
+                self.client.set_payload(collection_name=self.collection_name, payload=dict(version), points=point_ids)
+            for point_id in point_ids:
+                self.lexical_index.update_fields(point_id, dict(version))
+    
+    def resolve_mode(self, mode: str, query: str) -> str:
+        """The concrete search mode for a query; "auto" picks lexical for short queries and hybrid otherwise"""
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {mode!r}, expected one of {SEARCH_MODES}")
+        if mode == "auto":
+            return "lexical" if len(tokenize(query)) <= self.lexical_query_max_terms else "hybrid"
+        return mode
+    
+    def search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None, with_vectors: bool = False, mode: str = "dense") -> List[Dict[str, Any]]:
+        """Search for similar texts based on the query, optionally restricted to matching payload fields.
+        
+        mode is one of SEARCH_MODES; dense and hybrid results are scored by cosine similarity,
+        lexical ones by BM25.
+        """
+        return self.search_batch([query], limit, filters, with_vectors, mode)[0]
+    
+    def search_batch(self, queries: List[str], limit: int = 5, filters: Optional[Dict[str, Any]] = None, with_vectors: bool = False, mode: str = "dense") -> List[List[Dict[str, Any]]]:
+        """Search for several queries at once: one batched encoder pass and one batched Qdrant request.
+        
+        The same payload filter applies to every query. Returns one result list per query;
+        with_vectors adds each point's stored vector under "vector".
+        """
+        if not queries:
+            return []
+        
+        modes = [self.resolve_mode(mode, query) for query in queries]
+        results: List[Optional[List[Dict[str, Any]]]] = [None] * len(queries)
+        
+        # Short queries in "auto" mode skip the encoder, unless no text matches them
+        for i, query in enumerate(queries):
+            if modes[i] == "lexical":
+                with get_telemetry().span("lexical_search"):
+                    results[i] = self._lexical_search(query, limit, filters, with_vectors)
+                    # Another process may have stored this slice since the index was built
+                    if not results[i] and self._refresh_lexical_after_miss(filters):
+                        results[i] = self._lexical_search(query, limit, filters, with_vectors)
+                if not results[i] and mode == "auto":
+                    modes[i], results[i] = "dense", None
         
+        pending = [i for i in range(len(queries)) if results[i] is None]
+        if not pending:
+            return results
+        
+        with get_telemetry().span("encode", texts=len(pending)):
+            query_vectors = self.encoder.encode([queries[i] for i in pending]).tolist()
+        
+        hybrid = any(modes[i] == "hybrid" for i in pending)
+        dense_limit = limit * HYBRID_CANDIDATE_FACTOR if hybrid else limit
+        query_filter = self._build_filter(filters)
+        with self._client_lock:
+            batch_results = self.client.search_batch(
+                collection_name=self.collection_name,
+                requests=[
+                    models.SearchRequest(vector=vector, filter=query_filter, limit=dense_limit, with_payload=True, with_vector=with_vectors)
+                    for vector in query_vectors
+                ]
+            )
+        
+        # Dense hits the lexical index has never seen were written by another process
+        unseen = any(str(point.id) not in self.lexical_index for i, points in zip(pending, batch_results) if modes[i] == "hybrid" for point in points)
+        if unseen:
+            self._refresh_lexical_after_miss(filters)
+        
+        for i, vector, points in zip(pending, query_vectors, batch_results):
+            dense = self._format_results(points)
+            if modes[i] == "hybrid":
+                results[i] = self._fuse(queries[i], vector, [str(point.id) for point in points], dense, limit, filters, with_vectors)
+            else:
+                results[i] = dense[:limit]
+        return results
+    
+    def _lexical_search(self, query: str, limit: int, filters: Optional[Dict[str, Any]], with_vectors: bool) -> List[Dict[str, Any]]:
+        """BM25 results from the lexical index, in the same format as dense results"""
+        hits = self.lexical_index.search(query, limit, filters)
+        records = self._fetch_points([point_id for point_id, _ in hits], with_vectors)
+        # Points deleted from the collection since they were indexed are skipped
+        return [self._lexical_result(records[point_id], score, with_vectors) for point_id, score in hits if point_id in records]
+    
+    def _lexical_result(self, record, score: float, with_vectors: bool) -> Dict[str, Any]:
+        payload = record.payload or {}
+        result = {"text": payload.get("text", ""), "score": score, **{k: v for k, v in payload.items() if k != "text"}}
+        if with_vectors:
+            result["vector"] = record.vector
+        return result
+    
+    def _fetch_points(self, ids: List[str], with_vectors: bool = False) -> Dict[str, Any]:
+        """Stored points by ID, with payload and optionally the vector"""
+        if not ids:
+            return {}
+        with self._client_lock:
+            records = self.client.retrieve(
+                collection_name=self.collection_name,
+                ids=ids,
+                with_payload=True,
+                with_vectors=with_vectors
+            )
+        return {str(record.id): record for record in records}
+    
+    def _fuse(self, query: str, query_vector: List[float], dense_ids: List[str], dense: List[Dict[str, Any]], limit: int, filters: Optional[Dict[str, Any]], with_vectors: bool) -> List[Dict[str, Any]]:
+        """Merge dense and BM25 rankings by reciprocal-rank fusion.
+        
+        Results are ordered by "rrf_score"; "score" stays the cosine similarity (computed for
+        lexical-only hits from their stored vectors) and "lexical_score" is the BM25 score.
+        """
+        lexical = self.lexical_index.search(query, limit * HYBRID_CANDIDATE_FACTOR, filters)
+        fused: Dict[str, Dict[str, Any]] = {}
+        for rank, (point_id, result) in enumerate(zip(dense_ids, dense)):
+            fused[point_id] = {**result, "lexical_score": None, "rrf_score": 1 / (RRF_K + rank + 1)}
+        
+        lexical_only = []
+        for rank, (point_id, score) in enumerate(lexical):
+            if point_id in fused:
+                fused[point_id]["lexical_score"] = score
+                fused[point_id]["rrf_score"] += 1 / (RRF_K + rank + 1)
+            else:
+                lexical_only.append(point_id)
+                fused[point_id] = {"lexical_score": score, "rrf_score": 1 / (RRF_K + rank + 1)}
+        
+        ranked = sorted(fused.items(), key=lambda item: item[1]["rrf_score"], reverse=True)[:limit]
+        
+        # Lexical-only hits that made the cut are read from Qdrant, and get a cosine score so thresholds keep working
+        missing = [point_id for point_id, _ in ranked if point_id in lexical_only]
+        records = self._fetch_points(missing, with_vectors=True)
+        if missing:
+            query_array = np.asarray(query_vector, dtype=np.float32)
+            query_array /= np.linalg.norm(query_array) or 1.0
+            for point_id in missing:
+                if point_id not in records:
+                    continue
+                vector = np.asarray(records[point_id].vector, dtype=np.float32)
+                score = float(query_array @ (vector / (np.linalg.norm(vector) or 1.0)))
+                fused[point_id].update(self._lexical_result(records[point_id], score, with_vectors))
+        # Points deleted since they were indexed have no record and are dropped
+        return [result for point_id, result in ranked if point_id not in lexical_only or point_id in records]
+    
+    def _format_results(self, results) -> List[Dict[str, Any]]:
+        """Flatten scored points into dicts of text, score and payload fields (and the vector, if fetched)"""
         return [
             {
                 "text": result.payload.get("text", ""),
                 "score": result.score,
-                **{k: v for k, v in result.payload.items() if k != "text"}
+                **{k: v for k, v in result.payload.items() if k != "text"},
+                **({"vector": result.vector} if result.vector is not None else {})
             }
             for result in results
-        ] 
\ No newline at end of file
+        ]